@@ -0,0 +1,195 @@
+import csv
+import json
+import math
+import os
+import re
+import sys
+
+import run_viper_simulations as runner
+from analyse_static_data_freq import analyse_run as analyse_frequency_run
+from input_store import InputStore, input_store_dir
+from parameter_sweep import SweepIndex, format_value, run_identity, default_columns
+from run_cache import RunCache, cache_manifest_file
+from run_ledger import RunLedger, ledger_file
+
+# Adaptive Control frequency sweep. Starts from a coarse set of frequencies, runs and
+# analyses them, then adds runs only where the gain changes fastest or peaks until
+# neighbouring points agree to within the tolerance. Settings come from a JSON file:
+#
+#   {
+#     "base": {"Reynolds number": 100, "mesh_file": 1, "Polynomial order": 3,
+#              "Control amplitude": 0.2, "Control up-down balance": 0, "Time step": 0.0005,
+#              "Animation loops": 200, "End Time": 60},
+#     "frequencies": [0.1, 0.3, 1, 3, 10],
+#     "tolerance": 0.05,        (largest allowed gain change between neighbours, relative to the peak)
+#     "min_spacing": 0.02,      (smallest frequency ratio, or difference when not log spaced)
+#     "log_spacing": true,
+#     "max_runs": 40,
+#     "jobs": 4,
+#     "start_index": 1001        (optional; by default after the largest index in the run
+#                                 ledger or the run directory names)
+#   }
+#
+# Run indices are shared with the sweep index of the settings file, so rerunning the
+# driver picks up completed runs from the run cache instead of simulating them again.
+# Gains are read from each run's results record ({index}_results.json).
+
+output_csv = "adaptive_sweep_results.csv"
+significant_figures = 4  # Keeps new frequencies (and so directory names) short
+
+def gain_from_record(record):
+    """Returns the gain amplitude held in a results record (see read_gain_amplitude)."""
+    harmonic = record.get('harmonic')
+    if harmonic:
+        return harmonic.get('Gain Magnitude')  # null where the demodulation failed
+    section = record.get('statistics', {}).get('System Gain')
+    if not section or section.get('Minimum') is None or section.get('Maximum') is None:
+        return None
+    return (section['Maximum'] - section['Minimum']) / 2
+
+def read_gain_amplitude(results_file):
+    """Returns the demodulated gain magnitude of a run, or half the peak-to-peak System Gain for older results.
+
+    Read from the run's results record, or from the text results if it has none.
+    """
+    record_file = os.path.splitext(results_file)[0] + '.json'
+    if os.path.exists(record_file):
+        with open(record_file, 'r') as f:
+            return gain_from_record(json.load(f))
+    with open(results_file, 'r') as f:
+        content = f.read()
+    harmonic = re.search(r'Harmonic Response at Control Frequency:.*?Gain Magnitude:\s*(\S+)', content, re.DOTALL)
+    if harmonic:
+        gain = float(harmonic.group(1))
+        return None if math.isnan(gain) else gain
+    section = re.search(r'Statistics for System Gain .*?Minimum:\s*(\S+).*?Maximum:\s*(\S+)', content, re.DOTALL)
+    if not section:
+        return None
+    minimum, maximum = float(section.group(1)), float(section.group(2))
+    if math.isnan(minimum) or math.isnan(maximum):
+        return None
+    return (maximum - minimum) / 2
+
+def last_used_index(root, ledger):
+    """Returns the largest run index in the ledger or in the names of the run directories under root (0 if none)."""
+    indices = [run['run_index'] for run in ledger.runs()]
+    for name in os.listdir(root):
+        match = re.match(r'(\d+)_', name)
+        if match and os.path.isdir(os.path.join(root, name)):
+            indices.append(int(match.group(1)))
+    return max(indices, default=0)
+
+def midpoint(low, high, log_spacing):
+    if log_spacing and low > 0:
+        value = math.sqrt(low * high)
+    else:
+        value = (low + high) / 2
+    return float(f"{value:.{significant_figures}g}")
+
+def is_resolved(low, high, settings):
+    """Checks whether two frequencies are already as close as the sweep allows."""
+    if settings.get("log_spacing", True) and low > 0:
+        return high / low <= 1 + settings["min_spacing"]
+    return high - low <= settings["min_spacing"]
+
+def refinement_frequencies(results, settings):
+    """Returns new frequencies to run, largest gain changes first.
+
+    An interval is split when the gain changes across it by more than the tolerance
+    (relative to the largest gain seen), and both intervals next to a local peak are
+    split until the peak's neighbours agree with it to the same tolerance.
+    """
+    points = sorted((frequency, gain) for frequency, gain in results.items() if gain is not None)
+    if len(points) < 2:
+        return []
+    reference = max(abs(gain) for _, gain in points) or 1.0
+    tolerance = settings["tolerance"]
+
+    scores = {}
+    for i in range(len(points) - 1):
+        scores[i] = abs(points[i + 1][1] - points[i][1]) / reference
+    for i in range(1, len(points) - 1):
+        if points[i][1] >= points[i - 1][1] and points[i][1] >= points[i + 1][1]:
+            # Keep splitting around the peak even where the two sides happen to be level
+            scores[i - 1] = max(scores[i - 1], (points[i][1] - points[i - 1][1]) / reference + tolerance / 2)
+            scores[i] = max(scores[i], (points[i][1] - points[i + 1][1]) / reference + tolerance / 2)
+
+    candidates = []
+    for i, score in sorted(scores.items(), key=lambda item: -item[1]):
+        low, high = points[i][0], points[i + 1][0]
+        if score > tolerance and not is_resolved(low, high, settings):
+            frequency = midpoint(low, high, settings.get("log_spacing", True))
+            if frequency not in results and low < frequency < high:
+                candidates.append(frequency)
+    return candidates
+
+def make_row(base, frequency, sweep_index):
+    """Builds the parameter row and zero-based index for one frequency."""
+    row = dict(default_columns)
+    row.update({key: format_value(value) for key, value in base.items()})
+    row['Control frequency'] = format_value(frequency)
+    index = sweep_index.index_for(run_identity(row))
+    row['Index'] = str(index + 1)
+    return index, row
+
+def analyse_run(directory):
+    """Runs the frequency analysis in a completed run directory and returns its gain amplitude."""
+    sim_index = os.path.basename(directory).split('_')[0]
+    results_file = os.path.join(directory, f"Simulation_{sim_index}_Results", f"{sim_index}_results.txt")
+    if not os.path.exists(results_file):
+        try:
+            analyse_frequency_run(directory)
+        except Exception as e:
+            print(f"Error analysing {directory}: {e}")
+            return None
+    return read_gain_amplitude(results_file)
+
+def run_adaptive_sweep(settings_path):
+    with open(settings_path, 'r') as f:
+        settings = json.load(f)
+
+    original_directory = os.getcwd()
+    viper_path = os.path.join(original_directory, runner.viper_exe)
+    run_cache = RunCache(os.path.join(original_directory, cache_manifest_file))
+    input_store = InputStore(os.path.join(original_directory, input_store_dir), run_cache.file_digest)
+    ledger = RunLedger(os.path.join(original_directory, ledger_file))
+    # New runs are numbered after every index already used, so they never clash with parameters.csv runs
+    start_index = settings['start_index'] if 'start_index' in settings else last_used_index(original_directory, ledger) + 1
+    sweep_index = SweepIndex(os.path.splitext(settings_path)[0] + '.index.jsonl', start_index - 1)
+
+    results = {}
+    directories = {}
+    pending = sorted(float(frequency) for frequency in settings["frequencies"])
+    while pending and len(results) < settings.get("max_runs", 40):
+        pending = pending[:settings.get("max_runs", 40) - len(results)]
+        print(f"\nRunning {len(pending)} frequencies: {', '.join(format_value(f) for f in pending)}")
+        rows = [make_row(settings["base"], frequency, sweep_index) for frequency in pending]
+        runner.run_scheduled(rows, original_directory, viper_path, settings.get("jobs", 1), settings.get("max_cores", runner.max_total_cores), settings.get("threads_per_run"), run_cache, input_store, ledger)
+
+        for frequency, (index, row) in zip(pending, rows):
+            cached = run_cache.lookup(runner.get_run_key(run_cache, original_directory, row))
+            if cached is None:
+                print(f"Run for frequency {format_value(frequency)} did not complete, leaving it out of the sweep.")
+                results[frequency] = None
+                continue
+            directories[frequency] = cached["directory"]
+            results[frequency] = analyse_run(cached["directory"])
+            if results[frequency] is not None:
+                sim_index = os.path.basename(cached["directory"]).split('_')[0]
+                ledger.record_stage(cached["directory"], analysis_status='done', results_file=os.path.join(cached["directory"], f"Simulation_{sim_index}_Results", f"{sim_index}_results.txt"))
+            print(f"Frequency {format_value(frequency)}: gain amplitude {results[frequency]}")
+
+        pending = refinement_frequencies(results, settings)
+
+    with open(output_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Control frequency', 'Gain amplitude', 'Directory'])
+        for frequency in sorted(results):
+            writer.writerow([frequency, '' if results[frequency] is None else results[frequency], directories.get(frequency, '')])
+    print(f"\nAdaptive sweep finished after {len(results)} runs. Results written to {output_csv}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python adaptive_frequency_sweep.py <settings.json>")
+        sys.exit(1)
+    run_adaptive_sweep(sys.argv[1])
@@ -1,169 +1,104 @@
 import os
-import re
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-
-# Set up directory and file paths
-full_path = os.getcwd()
-folder_name = os.path.basename(full_path)
-
-# Helper function to extract values from folder names
-def extract_value(string, pattern):
-    match = re.search(pattern + r'([\d\.]+)', string)
-    if match:
-        return float(match.group(1))
-    return None
-
-# Extract simulation parameters
-sim_index = extract_value(folder_name, r'(\d+)_Re')
-reynolds_num = extract_value(folder_name, r'Re')
-mesh_types = ['Low', 'Medium', 'High']
-mesh_num = int(extract_value(folder_name, r'm'))
-mesh = mesh_types[mesh_num - 1]
-poly_order = extract_value(folder_name, r'N')
-control_amplitude = extract_value(folder_name, r'A')
-control_frequency = extract_value(folder_name, r'o')
-control_balance = extract_value(folder_name, r'b')
-timestep = extract_value(folder_name, r'dt')
-
-# Parameters
-output_dir = f'Simulation_{int(sim_index)}_Results'
-os.makedirs(output_dir, exist_ok=True)
-
-# Write simulation parameters to a text file
-param_file = os.path.join(output_dir, f'{int(sim_index)}_results.txt')
-with open(param_file, 'w') as f:
-    f.write(f'Simulation Parameters:\n')
-    f.write(f'Simulation Index: {sim_index}\n')
-    f.write(f'Reynolds Number: {reynolds_num}\n')
-    f.write(f'Mesh Type: {mesh}\n')
-    f.write(f'Element Polynomial Order: {poly_order}\n')
-    f.write(f'Control Amplitude: {control_amplitude:.4f}\n')
-    f.write(f'Control Frequency: {control_frequency:.4f}\n')
-    f.write(f'Control Balance: {control_balance:.4f}\n')
-    f.write(f'Timestep: {timestep:.6f} s\n')
-
-# Read the data files into pandas dataframes using 'sep' instead of 'delim_whitespace'
-int_KE = pd.read_csv('int_KE.dat', sep='\s+')
-pressure_outlet_upper = pd.read_csv('pressure_outlet_upper.dat', sep='\s+')
-pressure_outlet_lower = pd.read_csv('pressure_outlet_lower.dat', sep='\s+')
-flow_outlet_upper = pd.read_csv('flow_outlet_upper.dat', sep='\s+')
-flow_outlet_lower = pd.read_csv('flow_outlet_lower.dat', sep='\s+')
-flowrate = pd.read_csv('flowrate.dat', sep='\s+')
-
-# Cull the last n_cull rows
-n_cull = int(len(int_KE) * 0.05)
-int_KE = int_KE.iloc[:-n_cull]
-pressure_outlet_upper = pressure_outlet_upper.iloc[:-n_cull]
-pressure_outlet_lower = pressure_outlet_lower.iloc[:-n_cull]
-flow_outlet_upper = flow_outlet_upper.iloc[:-n_cull]
-flow_outlet_lower = flow_outlet_lower.iloc[:-n_cull]
-flowrate = flowrate.iloc[:-n_cull]
-
-# Calculate Gain
-gain = (flow_outlet_lower['user_specified_function'] - flow_outlet_upper['user_specified_function']) / \
-       (flowrate['bndry003'] - flowrate['bndry002'])
-
-# Create plots
-fig, axs = plt.subplots(2, 2, figsize=(15, 10))
-
-# Plot 1: Internal Kinetic Energy
-axs[0, 0].plot(int_KE['t'], int_KE['integral'], linewidth=2)
-axs[0, 0].set_title('Internal Kinetic Energy vs Time')
-axs[0, 0].set_xlabel('Time')
-axs[0, 0].set_ylabel('Internal Kinetic Energy')
-axs[0, 0].grid(True)
-
-# Plot 2: System Gain
-axs[0, 1].plot(flowrate['t'], gain, linewidth=2)
-axs[0, 1].set_title('System Gain vs Time')
-axs[0, 1].set_xlabel('Time')
-axs[0, 1].set_ylabel('Gain')
-axs[0, 1].grid(True)
-
-# Plot 3: Pressure Outlets
-axs[1, 0].plot(pressure_outlet_upper['t'], pressure_outlet_upper['user_specified_function'], linewidth=2)
-axs[1, 0].plot(pressure_outlet_lower['t'], pressure_outlet_lower['user_specified_function'], linewidth=2)
-axs[1, 0].set_title('Pressure Outlets vs Time')
-axs[1, 0].set_xlabel('Time')
-axs[1, 0].set_ylabel('Pressure')
-axs[1, 0].legend(['Upper Outlet', 'Lower Outlet'])
-axs[1, 0].grid(True)
-
-# Plot 4: Flow Outlets and Flowrates with LaTeX-style subscripts
-axs[1, 1].plot(flow_outlet_upper['t'], flow_outlet_upper['user_specified_function'], linewidth=2)
-axs[1, 1].plot(flow_outlet_lower['t'], flow_outlet_lower['user_specified_function'], linewidth=2)
-axs[1, 1].plot(flowrate['t'], flowrate['bndry001'], linewidth=2)
-axs[1, 1].plot(flowrate['t'], flowrate['bndry002'], linewidth=2)
-axs[1, 1].plot(flowrate['t'], flowrate['bndry003'], linewidth=2)
-axs[1, 1].set_title('Flow Outlets and Flowrates vs Time')
-axs[1, 1].set_xlabel('Time')
-axs[1, 1].set_ylabel('Flow Rate')
-axs[1, 1].legend([r'$Q_{O1}$ (Upper)', r'$Q_{O2}$ (Lower)', r'$Q_{stream}$', 
-                   r'$Q_{C1}$ (Upper Control Jet)', r'$Q_{C2}$ (Lower Control Jet)'])
-axs[1, 1].grid(True)
-
-# Adjust layout to avoid title overlap and add more space at the top
-plt.tight_layout(rect=[0, 0, 1, 0.95])  # Adjust the figure's layout, reserve 5% space for the title
-
-# Create a string with key simulation parameters for the title
-sim_info = f'Re: {reynolds_num}, Mesh: {mesh}, N: {poly_order}, A: {control_amplitude}, f: {control_frequency}, b: {control_balance}, dt: {timestep}'
-
-# Add a super-title (overall title) above the plots with more space
-plt.suptitle(f'Data Analysis Results - Simulation {int(sim_index)}\n{sim_info}', fontsize=16)
-plt.savefig(os.path.join(output_dir, (f'{int(sim_index)}_plot.png')), dpi=400)
-plt.savefig(os.path.join(output_dir, (f'{int(sim_index)}_plot.pdf')))
-plt.close(fig)
-
-# Function to calculate statistics
-def calculate_stats(data):
-    return {
-        'average': np.mean(data),
-        'median': np.median(data),
-        'minimum': np.min(data),
-        'maximum': np.max(data),
-        'std_dev': np.std(data),
-        'percentile_25': np.percentile(data, 25),
-        'percentile_75': np.percentile(data, 75),
-    }
-
-# Write statistics for each dataset
-datasets = [
-    (int_KE['integral'], 'Internal Kinetic Energy'),
-    (pressure_outlet_upper['user_specified_function'], 'Pressure Outlet Upper'),
-    (pressure_outlet_lower['user_specified_function'], 'Pressure Outlet Lower'),
-    (flow_outlet_upper['user_specified_function'], 'Upper Outlet Flow'),
-    (flow_outlet_lower['user_specified_function'], 'Lower Outlet Flow'),
-    (flowrate['bndry001'], 'Power Stream (Q_{stream})'),
-    (flowrate['bndry002'], 'Upper Control Jet (Q_{C1})'),
-    (flowrate['bndry003'], 'Lower Control Jet (Q_{C2})'),
-    (gain, 'System Gain')
+from plot_rendering import figure_template, plot_dpi, plot_formats
+from analysis_core import (CONTROL_LOWER, CONTROL_UPPER, FLOW_LOWER, FLOW_UPPER, KE, PRESSURE_LOWER, PRESSURE_UPPER, STREAM,
+                           channels, incremental_series, load_channels, processed_data, results_paths, results_record,
+                           run_parameters, statistics_record, statistics_window, window_statistics, write_parameters,
+                           write_results_record, write_statistics)
+from incremental_analysis import incremental_statistics
+from processed_store import write_processed
+
+def system_gain(values):
+    """Ratio of the outlet flow difference to the control jet flow difference, row by row."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values[FLOW_LOWER] - values[FLOW_UPPER]) / (values[CONTROL_LOWER] - values[CONTROL_UPPER])
+
+def gain_series(records, start, stop, length):
+    """System Gain for rows start to stop, computed from the cached monitor rows."""
+    outlets = records['flow_outlet_lower']['user_specified_function'][start:stop] - records['flow_outlet_upper']['user_specified_function'][start:stop]
+    controls = records['flowrate']['bndry003'][start:stop] - records['flowrate']['bndry002'][start:stop]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return outlets / controls
+
+# Rows of the plotted series: the monitor channels, then the gain
+GAIN = len(channels)
+
+# Layout of the plot, as panels of the figure template, in the order of the axes
+panels = [
+    # Plot 1: Internal Kinetic Energy
+    {'title': 'Internal Kinetic Energy vs Time', 'ylabel': 'Internal Kinetic Energy', 'series': [(KE, {'linewidth': 2})]},
+    # Plot 2: System Gain
+    {'title': 'System Gain vs Time', 'ylabel': 'Gain', 'series': [(GAIN, {'linewidth': 2})]},
+    # Plot 3: Pressure Outlets
+    {'title': 'Pressure Outlets vs Time', 'ylabel': 'Pressure', 'legend': True, 'series': [
+        (PRESSURE_UPPER, {'linewidth': 2, 'label': 'Upper Outlet'}),
+        (PRESSURE_LOWER, {'linewidth': 2, 'label': 'Lower Outlet'}),
+    ]},
+    # Plot 4: Flow Outlets and Flowrates with LaTeX-style subscripts
+    {'title': 'Flow Outlets and Flowrates vs Time', 'ylabel': 'Flow Rate', 'legend': True, 'series': [
+        (FLOW_UPPER, {'linewidth': 2, 'label': r'$Q_{O1}$ (Upper)'}),
+        (FLOW_LOWER, {'linewidth': 2, 'label': r'$Q_{O2}$ (Lower)'}),
+        (STREAM, {'linewidth': 2, 'label': r'$Q_{stream}$'}),
+        (CONTROL_UPPER, {'linewidth': 2, 'label': r'$Q_{C1}$ (Upper Control Jet)'}),
+        (CONTROL_LOWER, {'linewidth': 2, 'label': r'$Q_{C2}$ (Lower Control Jet)'}),
+    ]},
 ]
 
-with open(param_file, 'a') as f:
-    for data, name in datasets:
-        start_index = int(0.75 * len(data))
-        last_25_percent_data = data[start_index:]
-        stats = calculate_stats(last_25_percent_data)
-        f.write(f'\nStatistics for {name} (Last 25% of Data):\n')
-        f.write(f"Average: {stats['average']:.4f}\n")
-        f.write(f"Median: {stats['median']:.4f}\n")
-        f.write(f"Minimum: {stats['minimum']:.4f}\n")
-        f.write(f"Maximum: {stats['maximum']:.4f}\n")
-        f.write(f"Standard Deviation: {stats['std_dev']:.4f}\n")
-        f.write(f"25th Percentile: {stats['percentile_25']:.4f}\n")
-        f.write(f"75th Percentile: {stats['percentile_75']:.4f}\n")
-
-# Save processed data
-processed_data = {
-    'int_KE': int_KE,
-    'pressure_outlet_upper': pressure_outlet_upper,
-    'pressure_outlet_lower': pressure_outlet_lower,
-    'flow_outlet_upper': flow_outlet_upper,
-    'flow_outlet_lower': flow_outlet_lower,
-    'flowrate': flowrate,
-    'gain': gain
-}
-processed_data_file = os.path.join(output_dir, 'processed_data.npz')
-np.savez(processed_data_file, **processed_data)
\ No newline at end of file
+def plot_run(t, values, gain, params, output_dir, formats=plot_formats, dpi=plot_dpi):
+    figure_template('static', panels).render(t, np.vstack([values, gain]), params, output_dir, formats, dpi)
+
+def replot_run(run_dir, formats=plot_formats, dpi=plot_dpi):
+    """Redraws the plot of an analysed run from its monitor files, without redoing the statistics."""
+    params = run_parameters(run_dir)
+    output_dir, _ = results_paths(run_dir, params)
+    t, values, _ = load_channels(run_dir)
+    plot_run(t, values, system_gain(values), params, output_dir, formats, dpi)
+    return output_dir
+
+def analyse_run(run_dir, incremental=False, plot_formats=plot_formats, plot_dpi=plot_dpi):
+    """Analyses the monitor files of one run directory and returns the path of its results file.
+
+    With incremental, only the statistics are written, updated from the rows appended since
+    the last incremental pass, so runs can be re-analysed cheaply while they are running.
+    Runs whose monitor files are not on one time base get the full analysis instead.
+    The plot is saved in each of plot_formats, or not at all if there are none.
+    """
+    params = run_parameters(run_dir)
+    output_dir, param_file = results_paths(run_dir, params)
+    record = results_record(params)  # The same results at full precision, for data_collect.py
+    with open(param_file, 'w') as f:
+        write_parameters(f, params)
+
+    if incremental:
+        series = incremental_series + [('System Gain', gain_series, 0)]
+        result = incremental_statistics(run_dir, series, params['steady_state_time'])
+        if result is not None:
+            statistics, window = result
+            with open(param_file, 'a') as f:
+                for name, stats in statistics.items():
+                    write_statistics(f, name, stats, window)
+                    record['statistics'][name] = statistics_record(stats)
+            write_results_record(param_file, record)
+            return param_file
+        print(f"Monitor files of {run_dir} are not on one time base; running the full analysis instead.")
+
+    t, values, records = load_channels(run_dir)
+    gain = system_gain(values)
+    if plot_formats:
+        plot_run(t, values, gain, params, output_dir, plot_formats, plot_dpi)
+
+    # Write statistics for every channel and the gain
+    names = [name for name, _, _ in channels] + ['System Gain']
+    start, window = statistics_window(t, params['steady_state_time'])
+    statistics = window_statistics(values, start) + window_statistics(gain, start)  # Without stacking a copy of every channel
+    with open(param_file, 'a') as f:
+        for name, stats in zip(names, statistics):
+            write_statistics(f, name, stats, window)
+            record['statistics'][name] = statistics_record(stats)
+    write_results_record(param_file, record)
+
+    write_processed(output_dir, processed_data(records, gain))
+    return param_file
+
+if __name__ == "__main__":
+    analyse_run(os.getcwd())
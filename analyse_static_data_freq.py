@@ -1,219 +1,148 @@
 import os
-import re
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-
-# Set up directory and file paths
-full_path = os.getcwd()
-folder_name = os.path.basename(full_path)
-
-# Helper function to extract values from folder names
-def extract_value(string, pattern):
-    match = re.search(pattern + r'([\d\.]+)', string)
-    if match:
-        return float(match.group(1))
-    return None
-
-# Extract simulation parameters
-sim_index = extract_value(folder_name, r'(\d+)_Re')
-reynolds_num = extract_value(folder_name, r'Re')
-mesh_types = ['Low', 'Medium', 'High']
-mesh_num = int(extract_value(folder_name, r'm'))
-mesh = mesh_types[mesh_num - 1]
-poly_order = extract_value(folder_name, r'N')
-control_amplitude = extract_value(folder_name, r'A')
-control_frequency = extract_value(folder_name, r'o')
-control_balance = extract_value(folder_name, r'b')
-timestep = extract_value(folder_name, r'dt')
-
-# Parameters
-output_dir = f'Simulation_{int(sim_index)}_Results'
-os.makedirs(output_dir, exist_ok=True)
-
-# Write simulation parameters to a text file
-param_file = os.path.join(output_dir, f'{int(sim_index)}_results.txt')
-with open(param_file, 'w') as f:
-    f.write(f'Simulation Parameters:\n')
-    f.write(f'Simulation Index: {sim_index}\n')
-    f.write(f'Reynolds Number: {reynolds_num}\n')
-    f.write(f'Mesh Type: {mesh}\n')
-    f.write(f'Element Polynomial Order: {poly_order}\n')
-    f.write(f'Control Amplitude: {control_amplitude:.4f}\n')
-    f.write(f'Control Frequency: {control_frequency:.4f}\n')
-    f.write(f'Control Balance: {control_balance:.4f}\n')
-    f.write(f'Timestep: {timestep:.6f} s\n')
-
-# Read the data files into pandas dataframes using 'sep' instead of 'delim_whitespace'
-int_KE = pd.read_csv('int_KE.dat', sep='\s+')
-pressure_outlet_upper = pd.read_csv('pressure_outlet_upper.dat', sep='\s+')
-pressure_outlet_lower = pd.read_csv('pressure_outlet_lower.dat', sep='\s+')
-flow_outlet_upper = pd.read_csv('flow_outlet_upper.dat', sep='\s+')
-flow_outlet_lower = pd.read_csv('flow_outlet_lower.dat', sep='\s+')
-flowrate = pd.read_csv('flowrate.dat', sep='\s+')
-
-# Cull the last n_cull rows
-n_cull = int(len(int_KE) * 0.05)
-int_KE = int_KE.iloc[:-n_cull]
-pressure_outlet_upper = pressure_outlet_upper.iloc[:-n_cull]
-pressure_outlet_lower = pressure_outlet_lower.iloc[:-n_cull]
-flow_outlet_upper = flow_outlet_upper.iloc[:-n_cull]
-flow_outlet_lower = flow_outlet_lower.iloc[:-n_cull]
-flowrate = flowrate.iloc[:-n_cull]
-
-# Calculate window size based on 5-second average
-desired_averaging_time = 5  # seconds
-window_size = int(desired_averaging_time / timestep)  # timestep is already extracted earlier from folder name
-
-# Make sure window size is reasonable (greater than 1)
-if window_size < 2:
-    window_size = 2  # Ensure we have at least a small window
-
-# Calculate window size based on a smaller time window, e.g., 1 second
+from plot_rendering import figure_template, plot_dpi, plot_formats
+from analysis_core import (CONTROL_LOWER, CONTROL_UPPER, FLOW_LOWER, FLOW_UPPER, KE, PRESSURE_LOWER, PRESSURE_UPPER, STREAM,
+                           channels, incremental_series, load_channels, processed_data, results_paths, results_record,
+                           rolling_mean, run_parameters, sample_spacing, statistics_record, window_rows, statistics_window,
+                           window_statistics, write_parameters, write_results_record, write_statistics)
+from dat_cache import load_dat
+from harmonic_gain import demodulate_runs, harmonic_record, incremental_response, write_harmonic_section
+from incremental_analysis import incremental_statistics
+from processed_store import write_processed
+
+desired_averaging_time = 5  # seconds, for the rolling averages plotted over each channel
 desired_gain_averaging_time = 1  # seconds for gain smoothing
-gain_window_size = int(desired_gain_averaging_time / timestep)  # timestep is already extracted earlier
-
-# Make sure window size is reasonable (greater than 1)
-if gain_window_size < 2:
-    gain_window_size = 2  # Ensure we have at least a small window
-
-# Apply a rolling mean to the numerator to smooth the output differences
-flow_diff = flow_outlet_lower['user_specified_function'] - flow_outlet_upper['user_specified_function']
-rolling_numerator = flow_diff.rolling(window=gain_window_size, center=True).mean()
-
-# Use the max amplitude (constant value) as the denominator
-amplitude_input = control_amplitude  # This is already extracted from the folder name
-
-# Calculate the signed rolling gain using the max amplitude
-rolling_gain = rolling_numerator / amplitude_input
-
-# Create plots
-fig, axs = plt.subplots(2, 2, figsize=(15, 10))
-
-# Plot 1: Internal Kinetic Energy
-axs[0, 0].plot(int_KE['t'], int_KE['integral'], linewidth=2, label='Internal Kinetic Energy')
-rolling_ke = int_KE['integral'].rolling(window=window_size, center=True).mean()  # Rolling mean based on calculated window
-axs[0, 0].plot(int_KE['t'], rolling_ke, color='blue', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average (no label here)
-axs[0, 0].set_title('Internal Kinetic Energy vs Time')
-axs[0, 0].set_xlabel('Time')
-axs[0, 0].set_ylabel('Internal Kinetic Energy')
-axs[0, 0].legend()
-axs[0, 0].grid(True)
-
-# Plot 2: System Gain (with smoothed rolling gain)
-axs[0, 1].plot(flowrate['t'], rolling_gain, linewidth=2, label='Signed Rolling Gain (based on amplitude input)')
-axs[0, 1].set_title('System Gain vs Time')
-axs[0, 1].set_xlabel('Time')
-axs[0, 1].set_ylabel('Signed Gain')
-axs[0, 1].legend()
-axs[0, 1].grid(True)
-
-# Plot 3: Pressure Outlets
-axs[1, 0].plot(pressure_outlet_upper['t'], pressure_outlet_upper['user_specified_function'], color='green', linewidth=2, label='Upper Outlet')
-axs[1, 0].plot(pressure_outlet_lower['t'], pressure_outlet_lower['user_specified_function'], color='red', linewidth=2, label='Lower Outlet')
-
-rolling_pressure_upper = pressure_outlet_upper['user_specified_function'].rolling(window=window_size, center=True).mean()
-rolling_pressure_lower = pressure_outlet_lower['user_specified_function'].rolling(window=window_size, center=True).mean()
-
-axs[1, 0].plot(pressure_outlet_upper['t'], rolling_pressure_upper, color='green', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average
-axs[1, 0].plot(pressure_outlet_lower['t'], rolling_pressure_lower, color='red', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average
-
-axs[1, 0].set_title('Pressure Outlets vs Time')
-axs[1, 0].set_xlabel('Time')
-axs[1, 0].set_ylabel('Pressure')
-axs[1, 0].legend()
-axs[1, 0].grid(True)
-
-# Plot 4: Flow Outlets and Flowrates
-axs[1, 1].plot(flow_outlet_upper['t'], flow_outlet_upper['user_specified_function'], color='blue', linewidth=2, label=r'$Q_{O1}$ (Upper)')
-axs[1, 1].plot(flow_outlet_lower['t'], flow_outlet_lower['user_specified_function'], color='purple', linewidth=2, label=r'$Q_{O2}$ (Lower)')
-axs[1, 1].plot(flowrate['t'], flowrate['bndry001'], color='green', linewidth=2, label=r'$Q_{stream}$')
-axs[1, 1].plot(flowrate['t'], flowrate['bndry002'], color='cyan', linewidth=2, label=r'$Q_{C1}$ (Upper Control Jet)')
-axs[1, 1].plot(flowrate['t'], flowrate['bndry003'], color='magenta', linewidth=2, label=r'$Q_{C2}$ (Lower Control Jet)')
-
-rolling_flow_upper = flow_outlet_upper['user_specified_function'].rolling(window=window_size, center=True).mean()
-rolling_flow_lower = flow_outlet_lower['user_specified_function'].rolling(window=window_size, center=True).mean()
-rolling_bndry001 = flowrate['bndry001'].rolling(window=window_size, center=True).mean()
-rolling_bndry002 = flowrate['bndry002'].rolling(window=window_size, center=True).mean()
-rolling_bndry003 = flowrate['bndry003'].rolling(window=window_size, center=True).mean()
-
-axs[1, 1].plot(flow_outlet_upper['t'], rolling_flow_upper, color='blue', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average
-axs[1, 1].plot(flow_outlet_lower['t'], rolling_flow_lower, color='purple', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average
-axs[1, 1].plot(flowrate['t'], rolling_bndry001, color='green', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average
-axs[1, 1].plot(flowrate['t'], rolling_bndry002, color='cyan', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average
-axs[1, 1].plot(flowrate['t'], rolling_bndry003, color='magenta', linestyle='--', linewidth=1, alpha=0.5)  # Rolling average
-
-axs[1, 1].set_title('Flow Outlets and Flowrates vs Time')
-axs[1, 1].set_xlabel('Time')
-axs[1, 1].set_ylabel('Flow Rate')
-axs[1, 1].legend()
-axs[1, 1].grid(True)
-
-# Add a single legend entry for the rolling average (dashed line, black)
-fig.legend([plt.Line2D([0], [0], color='black', linestyle='--', linewidth=2)], 
-           ['Rolling Average'], loc='lower center', bbox_to_anchor=(0.5, -0.05), 
-           fancybox=True, shadow=True, ncol=1)
-
-# Adjust layout to avoid title overlap and add more space at the top
-plt.tight_layout(rect=[0, 0, 1, 0.95])  # Adjust the figure's layout, reserve 5% space for the title
-
-# Create a string with key simulation parameters for the title
-sim_info = f'Re: {reynolds_num}, Mesh: {mesh}, N: {poly_order}, A: {control_amplitude}, f: {control_frequency}, b: {control_balance}, dt: {timestep}'
-
-# Add a super-title (overall title) above the plots with more space
-plt.suptitle(f'Data Analysis Results - Simulation {int(sim_index)}\n{sim_info}', fontsize=16)
-plt.savefig(os.path.join(output_dir, (f'{int(sim_index)}_plot.png')), dpi=400)
-plt.savefig(os.path.join(output_dir, (f'{int(sim_index)}_plot.pdf')))
-plt.close(fig)
-
-# Function to calculate statistics
-def calculate_stats(data):
-    return {
-        'average': np.mean(data),
-        'median': np.median(data),
-        'minimum': np.min(data),
-        'maximum': np.max(data),
-        'std_dev': np.std(data),
-        'percentile_25': np.percentile(data, 25),
-        'percentile_75': np.percentile(data, 75),
-    }
-
-# Write statistics for each dataset
-datasets = [
-    (int_KE['integral'], 'Internal Kinetic Energy'),
-    (pressure_outlet_upper['user_specified_function'], 'Pressure Outlet Upper'),
-    (pressure_outlet_lower['user_specified_function'], 'Pressure Outlet Lower'),
-    (flow_outlet_upper['user_specified_function'], 'Upper Outlet Flow'),
-    (flow_outlet_lower['user_specified_function'], 'Lower Outlet Flow'),
-    (flowrate['bndry001'], 'Power Stream (Q_{stream})'),
-    (flowrate['bndry002'], 'Upper Control Jet (Q_{C1})'),
-    (flowrate['bndry003'], 'Lower Control Jet (Q_{C2})'),
-    (rolling_gain, 'System Gain')
+
+def rolling_gain(values, gain_window_size, amplitude_input):
+    """Signed rolling gain: the smoothed outlet flow difference over the control amplitude (a constant)."""
+    return rolling_mean(values[FLOW_LOWER] - values[FLOW_UPPER], gain_window_size)[0] / amplitude_input
+
+def rolling_gain_series(gain_window_size, amplitude_input):
+    """Returns a series function for the signed rolling gain, matching the full analysis."""
+    def series(records, start, stop, length):
+        # Pad the slice by a window each side so the centred rolling mean matches the full series
+        padded_start, padded_stop = max(0, start - gain_window_size), min(length, stop + gain_window_size)
+        flow_diff = (records['flow_outlet_lower']['user_specified_function'][padded_start:padded_stop]
+                     - records['flow_outlet_upper']['user_specified_function'][padded_start:padded_stop])
+        rolling_numerator = rolling_mean(flow_diff, gain_window_size)[0]
+        return rolling_numerator[start - padded_start:stop - padded_start] / amplitude_input
+    return series
+
+# Rows of the plotted series: the monitor channels, their rolling averages, then the gain
+SMOOTHED, GAIN = len(channels), 2 * len(channels)
+flows = [
+    (FLOW_UPPER, 'blue', r'$Q_{O1}$ (Upper)'),
+    (FLOW_LOWER, 'purple', r'$Q_{O2}$ (Lower)'),
+    (STREAM, 'green', r'$Q_{stream}$'),
+    (CONTROL_UPPER, 'cyan', r'$Q_{C1}$ (Upper Control Jet)'),
+    (CONTROL_LOWER, 'magenta', r'$Q_{C2}$ (Lower Control Jet)'),
+]
+rolling_style = {'linestyle': '--', 'linewidth': 1, 'alpha': 0.5}  # Rolling averages, unlabelled
+
+# Layout of the plot, as panels of the figure template, in the order of the axes
+panels = [
+    # Plot 1: Internal Kinetic Energy
+    {'title': 'Internal Kinetic Energy vs Time', 'ylabel': 'Internal Kinetic Energy', 'legend': True, 'series': [
+        (KE, {'linewidth': 2, 'label': 'Internal Kinetic Energy'}),
+        (SMOOTHED + KE, {'color': 'blue', **rolling_style}),
+    ]},
+    # Plot 2: System Gain (with smoothed rolling gain)
+    {'title': 'System Gain vs Time', 'ylabel': 'Signed Gain', 'legend': True, 'series': [
+        (GAIN, {'linewidth': 2, 'label': 'Signed Rolling Gain (based on amplitude input)'}),
+    ]},
+    # Plot 3: Pressure Outlets, each with its rolling average dashed
+    {'title': 'Pressure Outlets vs Time', 'ylabel': 'Pressure', 'legend': True, 'series': [
+        (PRESSURE_UPPER, {'color': 'green', 'linewidth': 2, 'label': 'Upper Outlet'}),
+        (SMOOTHED + PRESSURE_UPPER, {'color': 'green', **rolling_style}),
+        (PRESSURE_LOWER, {'color': 'red', 'linewidth': 2, 'label': 'Lower Outlet'}),
+        (SMOOTHED + PRESSURE_LOWER, {'color': 'red', **rolling_style}),
+    ]},
+    # Plot 4: Flow Outlets and Flowrates, each with its rolling average dashed
+    {'title': 'Flow Outlets and Flowrates vs Time', 'ylabel': 'Flow Rate', 'legend': True, 'series':
+        [(channel, {'color': color, 'linewidth': 2, 'label': label}) for channel, color, label in flows]
+        + [(SMOOTHED + channel, {'color': color, **rolling_style}) for channel, color, _ in flows]},
 ]
 
-with open(param_file, 'a') as f:
-    for data, name in datasets:
-        start_index = int(0.75 * len(data))
-        last_25_percent_data = data[start_index:]
-        stats = calculate_stats(last_25_percent_data)
-        f.write(f'\nStatistics for {name} (Last 25% of Data):\n')
-        f.write(f"Average: {stats['average']:.4f}\n")
-        f.write(f"Median: {stats['median']:.4f}\n")
-        f.write(f"Minimum: {stats['minimum']:.4f}\n")
-        f.write(f"Maximum: {stats['maximum']:.4f}\n")
-        f.write(f"Standard Deviation: {stats['std_dev']:.4f}\n")
-        f.write(f"25th Percentile: {stats['percentile_25']:.4f}\n")
-        f.write(f"75th Percentile: {stats['percentile_75']:.4f}\n")
-
-# Save processed data
-processed_data = {
-    'int_KE': int_KE,
-    'pressure_outlet_upper': pressure_outlet_upper,
-    'pressure_outlet_lower': pressure_outlet_lower,
-    'flow_outlet_upper': flow_outlet_upper,
-    'flow_outlet_lower': flow_outlet_lower,
-    'flowrate': flowrate,
-    'gain': rolling_gain
-}
-processed_data_file = os.path.join(output_dir, 'processed_data.npz')
-np.savez(processed_data_file, **processed_data)
\ No newline at end of file
+# A single legend entry for the rolling average (dashed line, black)
+figure_legend = [({'color': 'black', 'linestyle': '--', 'linewidth': 2}, 'Rolling Average')]
+
+def plot_run(t, values, gain, params, output_dir, formats=plot_formats, dpi=plot_dpi):
+    smoothed = rolling_mean(values, window_rows(desired_averaging_time, sample_spacing(t, params['timestep'])))
+    figure_template('freq', panels, figure_legend).render(t, np.vstack([values, smoothed, gain]), params, output_dir, formats, dpi)
+
+def replot_run(run_dir, formats=plot_formats, dpi=plot_dpi):
+    """Redraws the plot of an analysed run from its monitor files, without redoing the statistics."""
+    params = run_parameters(run_dir)
+    output_dir, _ = results_paths(run_dir, params)
+    t, values, _ = load_channels(run_dir)
+    gain = rolling_gain(values, window_rows(desired_gain_averaging_time, sample_spacing(t, params['timestep'])), params['control_amplitude'])
+    plot_run(t, values, gain, params, output_dir, formats, dpi)
+    return output_dir
+
+def write_harmonic(f, record, response, control_frequency):
+    """Writes the harmonic response of a run's (t, outlet flow difference, omega, amplitude, window start) to its results."""
+    harmonic = demodulate_runs([response])[0]
+    write_harmonic_section(f, harmonic, control_frequency)
+    record['harmonic'] = harmonic_record(harmonic, control_frequency)
+
+def analyse_run(run_dir, incremental=False, plot_formats=plot_formats, plot_dpi=plot_dpi):
+    """Analyses the monitor files of one run directory and returns the path of its results file.
+
+    With incremental, only the statistics and the harmonic response are written, the
+    statistics updated from the rows appended since the last incremental pass, so runs can
+    be re-analysed cheaply while they are running.
+    Runs whose monitor files are not on one time base get the full analysis instead.
+    The plot is saved in each of plot_formats, or not at all if there are none.
+    """
+    params = run_parameters(run_dir)
+    control_amplitude, control_frequency = params['control_amplitude'], params['control_frequency']
+    output_dir, param_file = results_paths(run_dir, params)
+    record = results_record(params)  # The same results at full precision, for data_collect.py
+    with open(param_file, 'w') as f:
+        write_parameters(f, params)
+
+    if incremental:
+        spacing = sample_spacing(load_dat(os.path.join(run_dir, 'int_KE.dat'))['t'], params['timestep'])
+        gain_window_size = window_rows(desired_gain_averaging_time, spacing)
+        series = incremental_series + [('System Gain', rolling_gain_series(gain_window_size, control_amplitude), gain_window_size)]
+        result = incremental_statistics(run_dir, series, params['steady_state_time'])
+        if result is not None:
+            statistics, window = result
+            with open(param_file, 'a') as f:
+                for name, stats in statistics.items():
+                    write_statistics(f, name, stats, window)
+                    record['statistics'][name] = statistics_record(stats)
+                if control_frequency:
+                    write_harmonic(f, record, incremental_response(run_dir, params), control_frequency)
+            write_results_record(param_file, record)
+            return param_file
+        print(f"Monitor files of {run_dir} are not on one time base; running the full analysis instead.")
+
+    t, values, records = load_channels(run_dir)
+
+    # Averaging windows in rows, from the spacing of the monitor samples
+    spacing = sample_spacing(t, params['timestep'])
+    gain = rolling_gain(values, window_rows(desired_gain_averaging_time, spacing), control_amplitude)
+    if plot_formats:
+        plot_run(t, values, gain, params, output_dir, plot_formats, plot_dpi)
+
+    # Write statistics for every channel and the gain
+    names = [name for name, _, _ in channels] + ['System Gain']
+    start, window = statistics_window(t, params['steady_state_time'])
+    statistics = window_statistics(values, start) + window_statistics(gain, start)  # Without stacking a copy of every channel
+    with open(param_file, 'a') as f:
+        for name, stats in zip(names, statistics):
+            write_statistics(f, name, stats, window)
+            record['statistics'][name] = statistics_record(stats)
+
+        # Gain, phase lag and distortion from demodulating the outlet flow difference at the control frequency
+        if control_frequency and len(t):
+            flow_diff = values[FLOW_LOWER] - values[FLOW_UPPER]
+            write_harmonic(f, record, (t, flow_diff, control_frequency, control_amplitude, t[start]), control_frequency)
+    write_results_record(param_file, record)
+
+    write_processed(output_dir, processed_data(records, gain))
+    return param_file
+
+if __name__ == "__main__":
+    analyse_run(os.getcwd())
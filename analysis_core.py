@@ -0,0 +1,301 @@
+import json
+import math
+import os
+import re
+
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured, unstructured_to_structured
+
+from dat_cache import load_dat
+from steady_state import read_steady_state_time, steady_state_file
+from streaming_stats import describe_rows
+
+# Signal processing shared by analyse_static_data.py and analyse_static_data_freq.py.
+# Every monitor channel of a run is resampled onto one time base and loaded into one
+# (channels x rows) array, so culling, rolling means and statistics are each one array operation over
+# all channels. Averaging windows are set in seconds and converted to rows with the
+# spacing of the monitor samples themselves, not the solver time step in the folder name.
+# The full analysis holds a run's channels in memory, since the plots, the rolling-mean gain
+# and the processed data all need every row; only the incremental pass is bounded.
+
+# Monitor channels, as (statistics name, monitor file, column), in the order they are written
+channels = [
+    ('Internal Kinetic Energy', 'int_KE', 'integral'),
+    ('Pressure Outlet Upper', 'pressure_outlet_upper', 'user_specified_function'),
+    ('Pressure Outlet Lower', 'pressure_outlet_lower', 'user_specified_function'),
+    ('Upper Outlet Flow', 'flow_outlet_upper', 'user_specified_function'),
+    ('Lower Outlet Flow', 'flow_outlet_lower', 'user_specified_function'),
+    ('Power Stream (Q_{stream})', 'flowrate', 'bndry001'),
+    ('Upper Control Jet (Q_{C1})', 'flowrate', 'bndry002'),
+    ('Lower Control Jet (Q_{C2})', 'flowrate', 'bndry003'),
+]
+KE, PRESSURE_UPPER, PRESSURE_LOWER, FLOW_UPPER, FLOW_LOWER, STREAM, CONTROL_UPPER, CONTROL_LOWER = range(len(channels))
+monitor_files = list(dict.fromkeys(monitor for _, monitor, _ in channels))
+reference_monitor = 'int_KE'  # Its sample times are the time base every channel is resampled onto
+
+cull_fraction = 0.05  # Trailing rows left out, where Viper may still be writing
+window_fraction = 0.75  # Statistics cover the data after this fraction of the run
+default_window_label = 'Last 25% of Data'  # Unless they start from the periodic steady state
+mesh_types = ['Low', 'Medium', 'High']
+
+def column_series(name, column):
+    """Returns a series function that reads one column of a monitor file.
+
+    A series function takes (records, start, stop, length), where records maps monitor
+    names to their cached rows and length is the number of rows being analysed, and
+    returns the series values for rows start to stop.
+    """
+    def series(records, start, stop, length):
+        return np.asarray(records[name][column][start:stop], dtype=np.float64)
+    return series
+
+# Series for the incremental statistics, as (name, series function, lookahead rows); each
+# script adds its own System Gain series
+incremental_series = [(name, column_series(monitor, column), 0) for name, monitor, column in channels]
+
+# Helper function to extract values from folder names
+def extract_value(string, pattern):
+    match = re.search(pattern + r'([\d\.]+)', string)
+    if match:
+        return float(match.group(1))
+    return None
+
+def run_parameters(run_dir):
+    """Returns the simulation parameters of a run, read from its folder name.
+
+    The folder name of the linked run is used for runs served from the run cache.
+    """
+    folder_name = os.path.basename(os.path.realpath(run_dir))
+    return {
+        'sim_index': extract_value(folder_name, r'(\d+)_Re'),
+        'reynolds_num': extract_value(folder_name, r'Re'),
+        'mesh': mesh_types[int(extract_value(folder_name, r'm')) - 1],
+        'poly_order': extract_value(folder_name, r'N'),
+        'control_amplitude': extract_value(folder_name, r'A'),
+        'control_frequency': extract_value(folder_name, r'o'),
+        'control_balance': extract_value(folder_name, r'b'),
+        'timestep': extract_value(folder_name, r'dt'),
+        'steady_state_time': read_steady_state_time(run_dir),  # Set when the run was stopped at its periodic steady state
+    }
+
+def write_parameters(f, params):
+    f.write(f'Simulation Parameters:\n')
+    f.write(f"Simulation Index: {params['sim_index']}\n")
+    f.write(f"Reynolds Number: {params['reynolds_num']}\n")
+    f.write(f"Mesh Type: {params['mesh']}\n")
+    f.write(f"Element Polynomial Order: {params['poly_order']}\n")
+    f.write(f"Control Amplitude: {params['control_amplitude']:.4f}\n")
+    f.write(f"Control Frequency: {params['control_frequency']:.4f}\n")
+    f.write(f"Control Balance: {params['control_balance']:.4f}\n")
+    f.write(f"Timestep: {params['timestep']:.6f} s\n")
+    if params['steady_state_time'] is not None:
+        f.write(f"Periodic Steady State From: {params['steady_state_time']:.6f} s\n")
+
+def write_statistics(f, name, stats, window=default_window_label):
+    f.write(f'\nStatistics for {name} ({window}):\n')
+    f.write(f"Average: {stats['average']:.4f}\n")
+    f.write(f"Median: {stats['median']:.4f}\n")
+    f.write(f"Minimum: {stats['minimum']:.4f}\n")
+    f.write(f"Maximum: {stats['maximum']:.4f}\n")
+    f.write(f"Standard Deviation: {stats['std_dev']:.4f}\n")
+    f.write(f"25th Percentile: {stats['percentile_25']:.4f}\n")
+    f.write(f"75th Percentile: {stats['percentile_75']:.4f}\n")
+    if stats['rank_error'] > 0:
+        f.write(f"Quantile Rank Error Bound: {stats['rank_error']:.2e}\n")
+
+# Labels of the statistics in the results files, by key of the statistics dicts
+statistic_labels = {
+    'average': 'Average',
+    'median': 'Median',
+    'minimum': 'Minimum',
+    'maximum': 'Maximum',
+    'std_dev': 'Standard Deviation',
+    'percentile_25': '25th Percentile',
+    'percentile_75': '75th Percentile',
+    'rank_error': 'Quantile Rank Error Bound',
+}
+
+def results_record(params):
+    """Returns the start of a run's machine-readable results, holding its parameters at full precision.
+
+    The record is saved as {index}_results.json next to the text results, with the same
+    labels, and is what data_collect.py reads. Statistics are added under 'statistics'
+    by section name, and the harmonic response (if any) under 'harmonic'.
+    """
+    parameters = {
+        'Simulation Index': params['sim_index'],
+        'Reynolds Number': params['reynolds_num'],
+        'Mesh Type': params['mesh'],
+        'Element Polynomial Order': params['poly_order'],
+        'Control Amplitude': params['control_amplitude'],
+        'Control Frequency': params['control_frequency'],
+        'Control Balance': params['control_balance'],
+        'Timestep': params['timestep'],
+    }
+    if params['steady_state_time'] is not None:
+        parameters['Periodic Steady State From'] = params['steady_state_time']
+    return {'parameters': parameters, 'statistics': {}}
+
+def statistics_record(stats):
+    return {label: stats[key] for key, label in statistic_labels.items()}
+
+def json_safe(value):
+    """Replaces NaN and infinities with None (null), which every JSON reader accepts."""
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def write_results_record(param_file, record):
+    """Saves the record of a run's results next to its text results file, atomically."""
+    record_path = os.path.splitext(param_file)[0] + '.json'
+    temp_path = f'{record_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(json_safe(record), f, indent=1)
+    os.replace(temp_path, record_path)
+
+def increasing_rows(t):
+    """Returns a mask of the rows to keep so the times strictly increase, or None if they already do.
+
+    Where a restarted run went back over times it had already written, the rows written
+    last are kept.
+    """
+    t = np.asarray(t)
+    if len(t) < 2 or np.all(t[1:] > t[:-1]):
+        return None
+    later_minimum = np.minimum.accumulate(t[::-1])[::-1]  # Earliest time from each row on
+    keep = np.ones(len(t), dtype=bool)
+    keep[:-1] = t[:-1] < later_minimum[1:]
+    return keep
+
+def on_grid(records, grid):
+    """Returns a monitor file's rows at the grid times, as a structured array of the same columns.
+
+    Rows whose times are already the grid are used as they are. Otherwise every column is
+    linearly interpolated from the monitor's own times in one batched operation, with the
+    interpolation weights shared by all columns.
+    """
+    t = np.asarray(records['t'])
+    first = int(np.searchsorted(t, grid[0])) if len(grid) else 0
+    if first + len(grid) <= len(t) and np.array_equal(t[first:first + len(grid)], grid):
+        return records[first:first + len(grid)]
+    upper = np.clip(np.searchsorted(t, grid, side='right'), 1, len(t) - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.nan_to_num((grid - t[upper - 1]) / (t[upper] - t[upper - 1]))[:, None]
+    block = structured_to_unstructured(np.asarray(records))
+    resampled = unstructured_to_structured(block[upper - 1] * (1 - weight) + block[upper] * weight, dtype=records.dtype)
+    resampled['t'] = grid
+    return resampled
+
+def load_monitors(run_dir, monitors=monitor_files):
+    """Loads monitor files of a run onto one time base, less the culled rows, through the binary .dat cache.
+
+    The monitor files can differ in length (a run killed mid-write) or go back over times
+    already written (a restarted run), so rows are not matched by position. Each file
+    keeps its last-written row at every time, and is resampled onto the times of int_KE
+    where all of the given files have data. Returns those times and each monitor file's
+    rows at those times.
+    """
+    records = {}
+    for monitor in dict.fromkeys([reference_monitor] + list(monitors)):
+        r = load_dat(os.path.join(run_dir, monitor + '.dat'))
+        keep = increasing_rows(r['t'])
+        records[monitor] = r if keep is None else r[keep]
+
+    # Shared time base: the reference monitor's times covered by every monitor file
+    t = np.asarray(records[reference_monitor]['t'])
+    if all(len(r) for r in records.values()):
+        start = max(r['t'][0] for r in records.values())
+        end = min(r['t'][-1] for r in records.values())
+        t = t[np.searchsorted(t, start):np.searchsorted(t, end, side='right')]
+    else:
+        t = t[:0]
+    length = len(t) - int(len(t) * cull_fraction)
+    t = t[:length]
+
+    return t, {monitor: on_grid(r, t) for monitor, r in records.items()}
+
+def load_channels(run_dir):
+    """Loads every monitor channel of a run onto one time base, as in load_monitors.
+
+    Returns the times, the (channels x rows) array of every channel and each monitor
+    file's rows at those times.
+    """
+    t, records = load_monitors(run_dir)
+    values = np.empty((len(channels), len(t)))
+    for i, (_, monitor, column) in enumerate(channels):
+        values[i] = records[monitor][column]
+    return t, values, records
+
+def sample_spacing(t, timestep):
+    """Returns the median spacing of the monitor samples, or the solver time step if there are too few."""
+    if len(t) < 2:
+        return timestep
+    return float(np.median(np.diff(t)))
+
+def window_rows(seconds, spacing):
+    """Returns the rows in a window of the given length in seconds, at least 2."""
+    return max(2, int(round(seconds / spacing)))
+
+def rolling_mean(values, window):
+    """Centred rolling mean of each row of a 2-D array, as pandas' rolling(window, center=True).mean().
+
+    Windows holding a NaN or running off either end give NaN. The rows are offset by their
+    mean before the running sums are taken, to keep the sums small.
+    """
+    values = np.atleast_2d(values)
+    result = np.full(values.shape, np.nan)
+    if values.shape[1] < window:
+        return result
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore'):
+        offset = np.nanmean(values, axis=1, keepdims=True)
+    offset = np.nan_to_num(offset)
+    sums = np.zeros((values.shape[0], values.shape[1] + 1))
+    np.cumsum(np.where(valid, values - offset, 0.0), axis=1, out=sums[:, 1:])
+    counts = np.zeros(sums.shape, dtype=np.int64)
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+    window_sums = sums[:, window:] - sums[:, :-window]
+    complete = counts[:, window:] - counts[:, :-window] == window
+    first = window // 2  # Row labelled by the first complete window
+    result[:, first:first + window_sums.shape[1]] = np.where(complete, window_sums / window + offset, np.nan)
+    return result
+
+def statistics_window(t, steady_state_time):
+    """Returns the first row of the statistics window and the label of the window in the results file."""
+    if steady_state_time is not None:
+        # Use every converged period rather than a fixed fraction of the run
+        steady_index = int(np.searchsorted(t, steady_state_time))
+        if steady_index < len(t) - 1:
+            return steady_index, f'From Periodic Steady State at t={steady_state_time:.6f} s'
+    return int(window_fraction * len(t)), default_window_label
+
+def window_start(t, steady_state_time):
+    """Returns the first row of the statistics window."""
+    return statistics_window(t, steady_state_time)[0]
+
+def window_statistics(series, start):
+    """Returns the statistics of each row of a 2-D array from row start on."""
+    return describe_rows(np.atleast_2d(series)[:, start:])
+
+def processed_data(records, gain):
+    """Returns the channels saved as the processed data of a run: each monitor file's culled rows, and the gain.
+
+    Each is a structured array with one named float64 field per column, the gain paired with its time.
+    """
+    data = {monitor: np.asarray(r) for monitor, r in records.items()}
+    data['gain'] = np.rec.fromarrays([records[reference_monitor]['t'], gain], names=['t', 'gain']).view(np.ndarray)
+    return data
+
+def outputs_current(run_dir, outputs):
+    """Checks that every output exists and is newer than the run's monitor files and steady_state.txt."""
+    inputs = [os.path.join(run_dir, monitor + '.dat') for monitor in monitor_files] + [os.path.join(run_dir, steady_state_file)]
+    newest_input = max((os.path.getmtime(path) for path in inputs if os.path.exists(path)), default=0)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= newest_input for path in outputs)
+
+def results_paths(run_dir, params):
+    """Returns the results directory of a run, created if needed, and the path of its results file."""
+    output_dir = os.path.join(run_dir, f"Simulation_{int(params['sim_index'])}_Results")
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir, os.path.join(output_dir, f"{int(params['sim_index'])}_results.txt")
@@ -1,50 +1,73 @@
+import argparse
 import os
-import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
 
-def run_data_analysis():
+from analyse_static_data_freq import analyse_run
+from analysis_core import outputs_current
+from plot_rendering import parse_formats, plot_dpi, plot_formats, plot_path
+from processed_store import processed_path
+from run_ledger import open_ledger
+
+# Number of runs analysed at once, each in its own worker process
+analysis_workers = os.cpu_count() or 1
+
+def run_data_analysis(workers=analysis_workers, incremental=False, formats=plot_formats, dpi=plot_dpi):
     # Get the current directory
     current_dir = os.getcwd()
     
-    # Get all subdirectories
-    subdirs = [d for d in os.listdir(current_dir) if os.path.isdir(os.path.join(current_dir, d))]
-    
-    # Path to analyse_static_data.py
-    analysis_script = os.path.join(current_dir, 'analyse_static_data_freq.py')
-    
-    # Check if analyse_static_data.py exists
-    if not os.path.exists(analysis_script):
-        print(f"Error: {analysis_script} not found in the current directory.")
-        return
+    # Get the finished runs from the ledger, or all subdirectories if there is none
+    # (an incremental pass also takes runs that are still going, to follow them as they progress)
+    ledger = open_ledger(current_dir)
+    if ledger is not None:
+        statuses = ("running", "completed", "cached", "exists") if incremental else ("completed", "cached", "exists")
+        subdirs = [os.path.relpath(d, current_dir) for d in ledger.directories(statuses)]
+    else:
+        subdirs = [d for d in os.listdir(current_dir) if os.path.isdir(os.path.join(current_dir, d))]
     
-    # Iterate through all subdirectories
+    # Collect the subdirectories that still need analysing
+    to_analyse = {}
     for subdir in subdirs:
         # Full path of the subdirectory
         subdir_path = os.path.join(current_dir, subdir)
         
-        # Output directory and file names
-        output_dir = os.path.join(subdir_path, f"Simulation_{subdir}_Results")
-        results_file = os.path.join(output_dir, f"{subdir}_results.txt")
-        plot_png = os.path.join(output_dir, f"{subdir}_plot.png")
-        plot_pdf = os.path.join(output_dir, f"{subdir}_plot.pdf")
+        # Output directory and file names, numbered by the simulation index at the start of the folder name
+        # (of the linked run, for runs served from the run cache)
+        sim_index = os.path.basename(os.path.realpath(subdir_path)).split('_')[0]
+        output_dir = os.path.join(subdir_path, f"Simulation_{sim_index}_Results")
+        results_file = os.path.join(output_dir, f"{sim_index}_results.txt")
         
-        # Check if the necessary output files already exist
-        if os.path.exists(results_file) and os.path.exists(plot_png) and os.path.exists(plot_pdf):
-            print(f"Skipping {subdir} - All result files already generated.")
+        # Check if the full analysis is already up to date with the monitor files (then an
+        # incremental pass has nothing to add either, and would only replace exact statistics)
+        outputs = [results_file, processed_path(output_dir)] + [plot_path(output_dir, sim_index, fmt) for fmt in formats]
+        if outputs_current(subdir_path, outputs):
+            print(f"Skipping {subdir} - All result files up to date.")
+            if ledger is not None:
+                ledger.record_stage(subdir_path, analysis_status='done', results_file=results_file)
             continue
         
-        print(f"Processing directory: {subdir}")
-        
-        # Change to the subdirectory
-        os.chdir(subdir_path)
-        
-        # Run analyse_static_data.py
-        try:
-            subprocess.run(['python', analysis_script], check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error running analyse_static_data.py in {subdir}: {e}")
-        
-        # Change back to the original directory
-        os.chdir(current_dir)
+        to_analyse[subdir] = subdir_path
+    
+    # Analyse the runs in worker processes, so a failure in one run does not stop the others
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(partial(analyse_run, incremental=incremental, plot_formats=formats, plot_dpi=dpi), subdir_path): subdir for subdir, subdir_path in to_analyse.items()}
+        for future in as_completed(futures):
+            subdir = futures[future]
+            try:
+                results_file = future.result()
+                print(f"Processed directory: {subdir}")
+                if ledger is not None:
+                    ledger.record_stage(to_analyse[subdir], analysis_status='incremental' if incremental else 'done', results_file=results_file)
+            except Exception as e:
+                print(f"Error analysing {subdir}: {e}")
+                if ledger is not None:
+                    ledger.record_stage(to_analyse[subdir], analysis_status='failed')
 
 if __name__ == "__main__":
-    run_data_analysis()
+    parser = argparse.ArgumentParser(description="Run analyse_static_data_freq.py on every finished run.")
+    parser.add_argument("-j", "--jobs", type=int, default=analysis_workers, help="number of runs to analyse at once")
+    parser.add_argument("--incremental", action="store_true", help="update only the statistics, from the rows appended since the last pass, including runs still in progress")
+    parser.add_argument("--plot-formats", type=parse_formats, default=plot_formats, help="comma separated plot formats to save, e.g. png or png,pdf; none to skip plotting")
+    parser.add_argument("--dpi", type=int, default=plot_dpi, help="resolution of the PNG plots")
+    args = parser.parse_args()
+    run_data_analysis(args.jobs, args.incremental, args.plot_formats, args.dpi)
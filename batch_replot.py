@@ -0,0 +1,53 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+from plot_rendering import parse_formats, plot_dpi, plot_formats
+from run_ledger import open_ledger
+
+# Number of runs plotted at once; each worker process lays out its figure once and reuses it for every run it takes
+plot_workers = os.cpu_count() or 1
+
+def replot(run_dir, frequency=False, formats=plot_formats, dpi=plot_dpi):
+    # Imported in the worker, so only the script being replotted is loaded
+    if frequency:
+        from analyse_static_data_freq import replot_run
+    else:
+        from analyse_static_data import replot_run
+    return replot_run(run_dir, formats, dpi)
+
+def analysed_directories(root_dir):
+    """Returns the run directories that have been analysed, from the ledger or the subdirectories."""
+    ledger = open_ledger(root_dir)
+    if ledger is not None:
+        return ledger.directories(analysis_status='done')
+    directories = []
+    for subdir in sorted(os.listdir(root_dir)):
+        subdir_path = os.path.join(root_dir, subdir)
+        sim_index = os.path.basename(os.path.realpath(subdir_path)).split('_')[0]
+        if os.path.isfile(os.path.join(subdir_path, f"Simulation_{sim_index}_Results", f"{sim_index}_results.txt")):
+            directories.append(subdir_path)
+    return directories
+
+def replot_runs(frequency=False, workers=plot_workers, formats=plot_formats, dpi=plot_dpi):
+    """Redraws the plots of every analysed run in the current directory, e.g. after a change of style."""
+    directories = analysed_directories(os.getcwd())
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(partial(replot, frequency=frequency, formats=formats, dpi=dpi), d): d for d in directories}
+        for future in as_completed(futures):
+            subdir = os.path.basename(futures[future])
+            try:
+                future.result()
+                print(f"Replotted directory: {subdir}")
+            except Exception as e:
+                print(f"Error replotting {subdir}: {e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redraw the plots of every analysed run without redoing the statistics.")
+    parser.add_argument("--freq", action="store_true", help="draw the analyse_static_data_freq.py plot (rolling averages and gain)")
+    parser.add_argument("-j", "--jobs", type=int, default=plot_workers, help="number of runs to plot at once")
+    parser.add_argument("--plot-formats", type=parse_formats, default=plot_formats, help="comma separated plot formats to save, e.g. png or png,pdf")
+    parser.add_argument("--dpi", type=int, default=plot_dpi, help="resolution of the PNG plots")
+    args = parser.parse_args()
+    replot_runs(args.freq, args.jobs, args.plot_formats, args.dpi)
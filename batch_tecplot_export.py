@@ -1,39 +1,69 @@
+import argparse
 import os
-import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def run_tecplot_export():
+from run_ledger import open_ledger
+from tecplot_export import StubBackend, TecplotBackend, export_run, outputs_up_to_date
+
+# Tecplot sessions kept running at once; each worker process starts the engine (and takes
+# a licence seat) once, then exports every run directory it is handed
+tecplot_workers = 1
+
+# The backend of this worker process, started by start_session
+session = None
+
+def start_session(stub=False):
+    global session
+    session = StubBackend() if stub else TecplotBackend()
+
+def export_directory(run_dir, force=False):
+    export_run(run_dir, session, force)  # export_run resets the layout before loading the run
+    return run_dir
+
+def run_tecplot_export(workers=tecplot_workers, stub=False, force=False):
     # Get the current directory
     current_dir = os.getcwd()
-    
-    # Get all subdirectories
-    subdirs = [d for d in os.listdir(current_dir) if os.path.isdir(os.path.join(current_dir, d))]
-    
-    # Path to tecplot_export.py
-    tecplot_script = os.path.join(current_dir, 'tecplot_export.py')
-    
-    # Check if tecplot_export.py exists
-    if not os.path.exists(tecplot_script):
-        print(f"Error: {tecplot_script} not found in the current directory.")
-        return
-    
-    # Iterate through all subdirectories
+
+    # Get the finished runs from the ledger, or all subdirectories if there is none
+    ledger = open_ledger(current_dir)
+    if ledger is not None:
+        subdirs = [os.path.relpath(d, current_dir) for d in ledger.directories()]
+    else:
+        subdirs = [d for d in os.listdir(current_dir) if os.path.isdir(os.path.join(current_dir, d))]
+
+    # Skip runs whose images and movies are all newer than their Tecplot files
+    pending = []
     for subdir in subdirs:
-        # Full path of the subdirectory
         subdir_path = os.path.join(current_dir, subdir)
-        
-        print(f"Processing directory: {subdir}")
-        
-        # Change to the subdirectory
-        os.chdir(subdir_path)
-        
-        # Run tecplot_export.py
-        try:
-            subprocess.run(['python', tecplot_script], check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error running tecplot_export.py in {subdir}: {e}")
-        
-        # Change back to the original directory
-        os.chdir(current_dir)
+        if not force and outputs_up_to_date(subdir_path):
+            print(f"Up to date: {subdir}")
+            if ledger is not None:
+                ledger.record_stage(subdir_path, tecplot_status='done')
+        else:
+            pending.append(subdir_path)
+    if not pending:
+        return
+
+    # The sessions take run directories off the executor's queue as they finish the last one
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(pending))), initializer=start_session, initargs=(stub,)) as executor:
+        futures = {executor.submit(export_directory, subdir_path, force): subdir_path for subdir_path in pending}
+        for future in as_completed(futures):
+            subdir_path = futures[future]
+            subdir = os.path.relpath(subdir_path, current_dir)
+            try:
+                future.result()
+                print(f"Processed directory: {subdir}")
+                if ledger is not None:
+                    ledger.record_stage(subdir_path, tecplot_status='done')
+            except Exception as e:
+                print(f"Error exporting {subdir}: {e}")
+                if ledger is not None:
+                    ledger.record_stage(subdir_path, tecplot_status='failed')
 
 if __name__ == "__main__":
-    run_tecplot_export()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export the Tecplot images and movies of every run from a few long-lived Tecplot sessions.")
+    parser.add_argument("-j", "--jobs", type=int, default=tecplot_workers, help="number of Tecplot sessions (and licence seats) to run at once")
+    parser.add_argument("--force", action="store_true", help="export every image and movie again, even if up to date")
+    parser.add_argument("--stub", action="store_true", help="use a stand-in for Tecplot that writes empty outputs, to test without a licence")
+    args = parser.parse_args()
+    run_tecplot_export(args.jobs, args.stub, args.force)
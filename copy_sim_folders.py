@@ -1,6 +1,8 @@
 import os
 import shutil
 
+from run_ledger import open_ledger
+
 # Define the root directory and the destination directory
 root_dir = os.getcwd()  # Change this to your actual root path
 destination_dir = os.path.join(root_dir, "Frequency Results")
@@ -9,8 +11,14 @@ destination_dir = os.path.join(root_dir, "Frequency Results")
 if not os.path.exists(destination_dir):
     os.makedirs(destination_dir)
 
-# Traverse through the root directory
-for folder_name in os.listdir(root_dir):
+# Traverse the finished runs in the ledger, or every folder in the root directory if there is none
+ledger = open_ledger(root_dir)
+if ledger is not None:
+    folder_names = [os.path.basename(d) for d in ledger.directories()]
+else:
+    folder_names = os.listdir(root_dir)
+
+for folder_name in folder_names:
     folder_path = os.path.join(root_dir, folder_name)
 
     # Check if it's a directory
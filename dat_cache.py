@@ -0,0 +1,149 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Binary copies of Viper's .dat monitor files, kept next to them in each run directory
+dat_cache_dir = ".dat_cache"
+guard_bytes = 64  # Source bytes remembered before the parsed offset, to tell an append from a rewrite
+stale_lock_seconds = 120
+
+# Each .dat file is converted once into <name>.bin, a headerless array of little-endian
+# float64 records with one field per column, plus <name>.json holding the column names,
+# row count, and the size, mtime and byte offset of the source it was built from.
+# When Viper has only appended rows since, just the new complete lines are parsed and
+# added to the end of the .bin file. A rewritten or truncated source (for example a
+# restarted run) is converted again from the start.
+
+def parse_values(data, column_count):
+    """Parses whitespace separated rows into an (n, column_count) float64 array, skipping malformed lines."""
+    try:
+        values = np.array(data.split(), dtype=np.float64)
+        if values.size % column_count == 0:
+            return values.reshape(-1, column_count)
+    except ValueError:
+        pass
+    rows = []
+    for line in data.split(b"\n"):
+        words = line.split()
+        if len(words) != column_count:
+            continue
+        try:
+            rows.append([float(word) for word in words])
+        except ValueError:
+            continue
+    return np.array(rows, dtype=np.float64).reshape(-1, column_count)
+
+def record_dtype(columns):
+    return np.dtype([(column, "<f8") for column in columns])
+
+def cache_paths(path):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), dat_cache_dir)
+    name = os.path.basename(path)
+    return cache_dir, os.path.join(cache_dir, name + ".bin"), os.path.join(cache_dir, name + ".json")
+
+def read_meta(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def read_guard(f, offset):
+    start = max(0, offset - guard_bytes)
+    f.seek(start)
+    return f.read(offset - start).hex()
+
+def open_records(bin_path, meta):
+    """Memory-maps the cached records described by meta."""
+    dtype = record_dtype(meta["columns"])
+    if meta["rows"] == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(bin_path, dtype=dtype, mode="r", shape=(meta["rows"],))
+
+def parse_new_rows(path, meta):
+    """Parses the complete lines after meta's offset, or the whole file when meta is None.
+
+    Returns the meta the new rows follow on from (None when starting over), the updated
+    meta and the new rows as an (n, columns) array.
+    """
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        if meta is not None and (stat.st_size < meta["offset"] or read_guard(f, meta["offset"]) != meta["guard"]):
+            meta = None  # Rewritten rather than appended to
+        start = 0 if meta is None else meta["offset"]
+        f.seek(start)
+        data = f.read(stat.st_size - start)
+        columns = None if meta is None else meta["columns"]
+        end = data.rfind(b"\n") + 1  # Leave a part-written last line for the next refresh
+        complete = data[:end]
+        if columns is None:
+            header_end = complete.find(b"\n") + 1
+            columns = [word.decode() for word in complete[:header_end].split()]
+            complete = complete[header_end:]
+        values = parse_values(complete, len(columns)) if columns else np.empty((0, 0))
+        offset = start + end
+        guard = read_guard(f, offset)
+    new_meta = {
+        "columns": columns,
+        "rows": (0 if meta is None else meta["rows"]) + len(values),
+        "offset": offset,
+        "guard": guard,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    return meta, new_meta, values
+
+def acquire_lock(lock_path):
+    """Takes the cache lock of one .dat file, breaking locks left behind by a crashed process."""
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        try:
+            if time.time() - os.stat(lock_path).st_mtime > stale_lock_seconds:
+                os.remove(lock_path)
+                return acquire_lock(lock_path)
+        except FileNotFoundError:
+            return acquire_lock(lock_path)
+        return False
+
+def load_dat(path):
+    """Returns the rows of a Viper .dat file as a structured float64 array, one field per column.
+
+    The array is memory-mapped from the binary cache, which is brought up to date first.
+    If another process is updating the same cache, or the run directory is read-only,
+    the file is parsed into memory instead.
+    """
+    cache_dir, bin_path, meta_path = cache_paths(path)
+    stat = os.stat(path)
+    meta = read_meta(meta_path)
+    if meta is not None and meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+        return open_records(bin_path, meta)
+
+    lock_path = bin_path + ".lock"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        locked = acquire_lock(lock_path)
+    except OSError:
+        locked = False
+    if not locked:
+        _, new_meta, values = parse_new_rows(path, None)
+        return np.ascontiguousarray(values, dtype="<f8").view(record_dtype(new_meta["columns"])).reshape(-1)
+
+    try:
+        meta = read_meta(meta_path)  # Another process may have refreshed it before we took the lock
+        old_meta, new_meta, values = parse_new_rows(path, meta)
+        with open(bin_path, "r+b" if old_meta is not None and os.path.isfile(bin_path) else "wb") as f:
+            row_bytes = 8 * len(new_meta["columns"])
+            f.truncate(0 if old_meta is None else old_meta["rows"] * row_bytes)  # Drop anything past the last recorded row
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(values, dtype="<f8").tobytes())
+        temp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(new_meta, f)
+        os.replace(temp_path, meta_path)
+    finally:
+        os.remove(lock_path)
+    return open_records(bin_path, new_meta)
@@ -1,6 +1,11 @@
+import argparse
 import os
 import csv
+import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+from run_ledger import open_ledger
 
 # Output CSV file name
 output_csv = 'simulation_data.csv'
@@ -8,15 +13,30 @@ output_csv = 'simulation_data.csv'
 # Regex pattern to find files named "#_results.txt"
 file_pattern = re.compile(r'(\d+)_results\.txt')
 
+# Regex pattern matching run directory names, "#_Re..." as made by run_viper_simulations.py
+run_pattern = re.compile(r'(\d+)_Re')
+
+# Results files read at once; reading is mostly waiting on the (often network) filesystem
+collect_workers = 32
+
+# Number as written in the text results, including signs, exponents and nan (used for runs without a .json record)
+number = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?nan|[-+]?inf)'
+
 # Regex pattern to capture all the simulation parameters
 parameters_pattern = re.compile(
-    r'Simulation Index:\s*([\d.]+).*?Reynolds Number:\s*([\d.]+).*?Mesh Type:\s*(\w+).*?Element Polynomial Order:\s*([\d.]+).*?Control Amplitude:\s*([\d.]+).*?Control Frequency:\s*([\d.]+).*?Control Balance:\s*([\d.]+).*?Timestep:\s*([\d.]+)',
+    rf'Simulation Index:\s*{number}.*?Reynolds Number:\s*{number}.*?Mesh Type:\s*(\w+).*?Element Polynomial Order:\s*{number}.*?Control Amplitude:\s*{number}.*?Control Frequency:\s*{number}.*?Control Balance:\s*{number}.*?Timestep:\s*{number}',
     re.DOTALL
 )
 
 # Regex pattern to capture all the statistics (average, median, etc.)
 statistics_pattern = re.compile(
-    r'Statistics for (.*?) \(Last 25% of Data\):.*?Average:\s*(-?\d+\.\d+).*?Median:\s*(-?\d+\.\d+).*?Minimum:\s*(-?\d+\.\d+).*?Maximum:\s*(-?\d+\.\d+).*?Standard Deviation:\s*(-?\d+\.\d+).*?25th Percentile:\s*(-?\d+\.\d+).*?75th Percentile:\s*(-?\d+\.\d+)',
+    rf'Statistics for (.*?) \((?:Last 25% of Data|From Periodic Steady State[^)]*)\):.*?Average:\s*{number}.*?Median:\s*{number}.*?Minimum:\s*{number}.*?Maximum:\s*{number}.*?Standard Deviation:\s*{number}.*?25th Percentile:\s*{number}.*?75th Percentile:\s*{number}',
+    re.DOTALL
+)
+
+# Regex pattern to capture the harmonic response written by analyse_static_data_freq.py
+harmonic_pattern = re.compile(
+    rf'Harmonic Response at Control Frequency:.*?Gain Magnitude:\s*{number}.*?Phase Lag:\s*{number} deg.*?Total Harmonic Distortion:\s*{number}',
     re.DOTALL
 )
 
@@ -42,88 +62,186 @@ included_stats = [
 
 #  'Minimum', 'Maximum', '25th Percentile', '75th Percentile'
 
-# ========== NO NEED TO MODIFY BELOW ========== #
-
-# Map of simulation parameters to the order they appear in the text file
-parameter_keys = {
-    'Simulation Index': 0, 'Reynolds Number': 1, 'Mesh Type': 2, 'Element Polynomial Order': 3, 
-    'Control Amplitude': 4, 'Control Frequency': 5, 'Control Balance': 6, 'Timestep': 7
-}
+# Harmonic response values to include (left empty for runs analysed without a control frequency)
+included_harmonic = [
+    'Gain Magnitude', 'Phase Lag', 'Total Harmonic Distortion',
+]
 
-# List to store extracted data
-data = []
+# ========== NO NEED TO MODIFY BELOW ========== #
 
-# Walk through the current directory and subdirectories
-for root, dirs, files in os.walk('.'):
-    for file in files:
-        # Check if file matches the "#_results.txt" pattern
-        match = file_pattern.match(file)
+# Labels of the values captured by each pattern, in order
+parameter_labels = [
+    'Simulation Index', 'Reynolds Number', 'Mesh Type', 'Element Polynomial Order',
+    'Control Amplitude', 'Control Frequency', 'Control Balance', 'Timestep'
+]
+statistic_labels = ['Average', 'Median', 'Minimum', 'Maximum', 'Standard Deviation', '25th Percentile', '75th Percentile']
+harmonic_labels = ['Gain Magnitude', 'Phase Lag', 'Total Harmonic Distortion']
+
+def to_value(text):
+    try:
+        return float(text)
+    except ValueError:
+        return text  # e.g. the mesh type
+
+def parse_results_text(content):
+    """Returns the record of a text results file, for runs analysed before the .json records were written."""
+    record = {'parameters': {}, 'statistics': {}}
+    parameters_match = re.search(parameters_pattern, content)
+    if parameters_match:
+        record['parameters'] = dict(zip(parameter_labels, map(to_value, parameters_match.groups())))
+    for section, *values in re.findall(statistics_pattern, content):
+        record['statistics'][section] = dict(zip(statistic_labels, map(to_value, values)))
+    harmonic_match = re.search(harmonic_pattern, content)
+    if harmonic_match:
+        record['harmonic'] = dict(zip(harmonic_labels, map(to_value, harmonic_match.groups())))
+    return record
+
+def read_record(file_path):
+    """Returns the results of a run: the full-precision .json record written alongside the text
+    results, or what can be parsed from the text if there is no up-to-date record."""
+    record_path = os.path.splitext(file_path)[0] + '.json'
+    try:
+        if os.path.getmtime(record_path) >= os.path.getmtime(file_path):
+            with open(record_path, 'r') as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    with open(file_path, 'r') as f:
+        return parse_results_text(f.read())
+
+def cell(value):
+    return '' if value is None else value
+
+def record_row(file_number, record):
+    """Combines all the data for one run into a row of the CSV."""
+    row = [file_number]
+
+    # Append simulation parameters based on the included_parameters list
+    for param in included_parameters:
+        row.append(cell(record['parameters'].get(param)))
+
+    # Append statistics for each included section (if found), or empty values
+    for section in included_sections:
+        stats = record['statistics'].get(section, {})
+        for stat in included_stats:
+            row.append(cell(stats.get(stat)))
+
+    # Append the harmonic response (if found)
+    harmonic = record.get('harmonic', {})
+    for value in included_harmonic:
+        row.append(cell(harmonic.get(value)))
+    return row
+
+def run_results_file(run_dir):
+    """Returns the results file of a run directory by the Simulation_N_Results layout, or None if it has none."""
+    match = run_pattern.match(os.path.basename(os.path.realpath(run_dir)))
+    if match is None:
+        return None
+    sim_index = match.group(1)
+    results_file = os.path.join(run_dir, f'Simulation_{sim_index}_Results', f'{sim_index}_results.txt')
+    return results_file if os.path.isfile(results_file) else None
+
+def find_run_results(root):
+    """Returns the results files under root, looking only where the analysis writes them.
+
+    A run directory is recognised by its name and only its results file is checked, so
+    the animation frames, images and restart files inside are never listed. Other
+    directories are searched for run directories, skipping hidden ones such as caches.
+    Cached runs are symlinks to the run that computed them, so each results file is
+    returned once, by its real path.
+    """
+    results_files = set()
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            if run_pattern.match(entry.name) or run_pattern.match(os.path.basename(os.path.realpath(entry.path))):
+                results_file = run_results_file(entry.path)
+                if results_file is not None:
+                    results_files.add(os.path.realpath(results_file))
+            elif not entry.is_symlink():
+                pending.append(entry.path)
+    return list(results_files)
+
+def find_walk_results(root):
+    """Returns every file under root, for results kept outside the usual layout."""
+    return [os.path.join(directory, file) for directory, _, files in os.walk(root) for file in files]
+
+def find_ledger_results(ledger):
+    """Returns the results files of the runs the ledger records as analysed."""
+    results_files = set()
+    for run in ledger.runs(analysis_status='done'):
+        if run['results_file'] and os.path.exists(run['results_file']):
+            results_files.add(os.path.realpath(run['results_file']))  # Cached runs link to the same results
+    return list(results_files)
+
+def read_manifest(manifest):
+    """Returns the results files listed in a manifest, one results file or run directory per line."""
+    results_files = []
+    with open(manifest, 'r') as f:
+        for line in f:
+            path = line.strip()
+            if not path or path.startswith('#'):
+                continue
+            results_files.append(run_results_file(path) if os.path.isdir(path) else path)
+    return [path for path in results_files if path is not None]
+
+def find_results(discovery, manifest=None, root='.'):
+    """Returns the results files to collect as sorted (file number, path) pairs."""
+    if manifest is not None:
+        paths = read_manifest(manifest)
+    elif discovery == 'walk':
+        paths = find_walk_results(root)
+    else:
+        ledger = open_ledger(root) if discovery == 'auto' else None
+        paths = find_ledger_results(ledger) if ledger is not None else find_run_results(root)
+
+    # Keep the files matching the "#_results.txt" pattern, numbered from their names
+    matched_files = []
+    for path in paths:
+        match = file_pattern.match(os.path.basename(path))
         if match:
-            file_number = match.group(1)  # Extract the number from the file name
-            file_path = os.path.join(root, file)
-
-            # Open and read the file
-            with open(file_path, 'r') as f:
-                content = f.read()
-
-                # Extract simulation parameters
-                parameters_match = re.search(parameters_pattern, content)
-                if parameters_match:
-                    parameters = parameters_match.groups()
-
-                # Extract statistics for all sections
-                stats_matches = re.findall(statistics_pattern, content)
-
-                # Create a dictionary to store stats by section
-                stats_dict = {}
-                for section, avg, median, min_val, max_val, std_dev, p25, p75 in stats_matches:
-                    stats_dict[section] = {
-                        'Average': avg,
-                        'Median': median,
-                        'Minimum': min_val,
-                        'Maximum': max_val,
-                        'Standard Deviation': std_dev,
-                        '25th Percentile': p25,
-                        '75th Percentile': p75
-                    }
-
-                # Combine all the data for this file into a row
-                row = [file_number]
-
-                # Append simulation parameters based on the included_parameters list
-                for param in included_parameters:
-                    row.append(parameters[parameter_keys[param]])
-
-                # Append statistics for each included section (if found)
-                for section in included_sections:
-                    if section in stats_dict:
-                        for stat in included_stats:
-                            row.append(stats_dict[section][stat])
-                    else:
-                        # Fill with empty values if section not found
-                        row += [''] * len(included_stats)
-
-                data.append(row)
-
-# Sort the data by file number
-data.sort(key=lambda x: int(x[0]))
-
-# Define headers for the CSV
-headers = ['File Number'] + included_parameters
-
-# Add headers for each included statistics section
-for section in included_sections:
-    for stat in included_stats:
-        headers.append(f'{section} {stat}')
-
-# Write the extracted data to the CSV file
-with open(output_csv, mode='w', newline='') as csv_file:
-    writer = csv.writer(csv_file)
-    # Write the header
-    writer.writerow(headers)
-
-    # Write each row of data
-    for row in data:
-        writer.writerow(row)
-
-print(f"Data successfully written to {output_csv}")
+            matched_files.append((match.group(1), path))
+    return sorted(matched_files, key=lambda x: (int(x[0]), x[1]))
+
+def headers():
+    """Returns the header row of the CSV."""
+    row = ['File Number'] + included_parameters
+
+    # Add headers for each included statistics section
+    for section in included_sections:
+        for stat in included_stats:
+            row.append(f'{section} {stat}')
+    for value in included_harmonic:
+        row.append(f'Harmonic {value}' + (' (deg)' if value == 'Phase Lag' else ''))
+    return row
+
+def collect(discovery='auto', manifest=None, workers=collect_workers):
+    matched_files = find_results(discovery, manifest)
+
+    # Read the results on a pool of threads, so many files are being fetched at once, and
+    # write each row as soon as it and every row before it have been read
+    with open(output_csv, mode='w', newline='') as csv_file, ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        writer = csv.writer(csv_file)
+        writer.writerow(headers())
+        records = executor.map(read_record, [file_path for _, file_path in matched_files])
+        for (file_number, _), record in zip(matched_files, records):
+            writer.writerow(record_row(file_number, record))
+
+    print(f"Data for {len(matched_files)} runs successfully written to {output_csv}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect the results of every analysed run into one CSV.")
+    parser.add_argument("--discovery", choices=["auto", "runs", "walk"], default="auto",
+                        help="how results are found: auto uses the run ledger if there is one, otherwise the runs "
+                             "layout; runs looks only in each run directory's Simulation_N_Results; walk searches every file")
+    parser.add_argument("--manifest", help="file listing the results files or run directories to collect, one per line")
+    parser.add_argument("-j", "--jobs", type=int, default=collect_workers, help="number of results files to read at once")
+    args = parser.parse_args()
+    collect(args.discovery, args.manifest, args.jobs)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Stand-in for viper.exe that lets the run scripts be exercised without the solver.
+
+Reads a Viper macro on stdin like the real solver, interprets the handful of commands
+used by macro.txt and macro_animation.txt, prints Viper-style progress output and
+writes synthetic monitor .dat files, save.dat and Tecplot placeholders into the
+current directory. The behaviour is controlled through environment variables:
+
+    FAKE_VIPER_MAX_STABLE_DT   time steps above this diverge (default: never)
+    FAKE_VIPER_DIVERGE_TIME    simulation time at which an unstable run diverges (default 0.1)
+    FAKE_VIPER_HUGE_LINES      "Huge value" lines printed before Viper gives up (default 100000)
+    FAKE_VIPER_STEP_DELAY      wall-clock seconds slept per step command (default 0)
+
+Point run_viper_simulations.py at it by copying it to viper.exe (with the executable bit set).
+"""
+import math
+import os
+import re
+import sys
+import time
+
+max_stable_dt = float(os.environ.get("FAKE_VIPER_MAX_STABLE_DT", "inf"))
+diverge_time = float(os.environ.get("FAKE_VIPER_DIVERGE_TIME", "0.1"))
+huge_lines = int(os.environ.get("FAKE_VIPER_HUGE_LINES", "100000"))
+step_delay = float(os.environ.get("FAKE_VIPER_STEP_DELAY", "0"))
+
+class StopCriterionMet(Exception):
+    pass
+
+class Diverged(Exception):
+    pass
+
+def read_config(path="viper.cfg"):
+    """Returns the user variables (A, omega, UDbal, Re) set in viper.cfg."""
+    values = {"A": 0.0, "omega": 0.0, "UDbal": 0.0, "Re": 100.0}
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                match = re.match(r"\s*gvar_usrvar\s+(\w+)\s+'?([-\d.eE+]+)'?", line)
+                if match and match.group(1) in values:
+                    values[match.group(1)] = float(match.group(2))
+    return values
+
+def parse_macro(lines):
+    """Parses macro lines into a nested list of (command, args) tuples and loop blocks."""
+    stack = [[]]
+    for raw in lines:
+        line = re.sub(r"\(.*\)\s*$", "", raw.split("#", 1)[0]).strip()
+        if not line:
+            continue
+        words = line.split()
+        if words[0] == "loop":
+            block = ("loop", int(float(words[1])), [])
+            stack[-1].append(block)
+            stack.append(block[2])
+        elif words[0] == "endl":
+            stack.pop()
+        else:
+            stack[-1].append((words[0], words[1:]))
+    return stack[0]
+
+def option(args, flag, default=None):
+    return args[args.index(flag) + 1].strip("'") if flag in args else default
+
+class FakeViper:
+    def __init__(self, config):
+        self.config = config
+        self.t = 0.0
+        self.dt = 1e-3
+        self.stopcrit = 0.0
+        self.steps = 0
+        self.frame = 0
+
+    def state(self):
+        """Synthetic monitor values: a decaying transient on top of the forced response."""
+        A, omega, bal = self.config["A"], self.config["omega"], self.config["UDbal"]
+        transient = math.exp(-self.t)
+        forcing = A * math.cos(omega * self.t)
+        # Second-order resonance near omega = 2 so frequency sweeps have a peak to find
+        ratio = omega / 2.0
+        magnitude = 0.8 / math.hypot(1 - ratio ** 2, 0.4 * ratio)
+        lag = math.atan2(0.4 * ratio, 1 - ratio ** 2)
+        response = magnitude * A * math.cos(omega * self.t - lag) + 0.05 * A * math.cos(2 * omega * self.t)
+        return {
+            "ke": 1.2 + 0.3 * transient + 0.05 * response,
+            "q_upper": 0.5 - 0.5 * response + 0.02 * transient,
+            "q_lower": 0.5 + 0.5 * response - 0.02 * transient,
+            "p_upper": 0.1 - 0.2 * response,
+            "p_lower": 0.1 + 0.2 * response,
+            "q_stream": -1.0,
+            "q_c1": -(1 - bal) * forcing,
+            "q_c2": bal * forcing,
+            "change": transient * 1e-2,
+        }
+
+    def append(self, path, header, values):
+        new_file = not os.path.exists(path)
+        with open(path, "a") as f:
+            if new_file:
+                f.write(header + "\n")
+            f.write(" ".join(f"{value: .10E}" for value in values) + "\n")
+
+    def save(self, path="save.dat"):
+        with open(path, "w") as f:
+            f.write(f"t={self.t!r}")
+
+    def step(self, count):
+        for _ in range(count):
+            self.t += self.dt
+            self.steps += 1
+            if self.dt > max_stable_dt and self.t >= diverge_time:
+                raise Diverged()
+        change = self.state()["change"]
+        print(f" Step {self.steps:9d}   Time = {self.t: .6E}   dt = {self.dt:.4E}   Max vel change = {change:.6E}")
+        if step_delay:
+            time.sleep(step_delay)
+        if self.stopcrit > 0 and change < self.stopcrit:
+            raise StopCriterionMet()
+
+    def execute(self, commands):
+        for command in commands:
+            if command[0] == "loop":
+                for _ in range(command[1]):
+                    self.execute(command[2])
+                continue
+            name, args = command
+            s = self.state()
+            if name == "set" and args[0] == "dt":
+                self.dt = float(args[1])
+            elif name == "init":
+                print(f" Initialising time integration at t = {self.t:.6E}")
+            elif name == "load":
+                path = option(args, "-f", "save.dat")
+                with open(path) as f:
+                    self.t = float(f.read().split("=")[1])
+                print(f" Loaded restart file {path} at t = {self.t:.6E}")
+            elif name == "save":
+                self.save(option(args, "-f", "save.dat"))
+            elif name == "stopcrit":
+                self.stopcrit = float(args[0])
+            elif name == "step":
+                self.step(int(args[0]))
+            elif name == "int":
+                self.append(option(args, "-f"), "t integral", [self.t, s["ke"]])
+            elif name == "flowrate":
+                self.append(args[0], "t bndry001 bndry002 bndry003 bndry007",
+                            [self.t, s["q_stream"], s["q_c1"], s["q_c2"], s["q_upper"] + s["q_lower"]])
+            elif name == "line":
+                path = option(args, "-f")
+                key = ("q_" if "flow" in path else "p_") + ("upper" if "upper" in path else "lower")
+                self.append(path, "t user_specified_function", [self.t, s[key]])
+            elif name == "tecp":
+                path = option(args, "-f")
+                if "-s" in args:
+                    self.frame += 1
+                    root, ext = os.path.splitext(path)
+                    path = f"{root}_{self.frame:05d}{ext}"
+                with open(path, "w") as f:
+                    f.write(f"fake tecplot data t={self.t!r}\n")
+
+def main():
+    print(" Viper (fake) - spectral/hp element solver stand-in")
+    solver = FakeViper(read_config())
+    print(f" Re = {solver.config['Re']}, A = {solver.config['A']}, omega = {solver.config['omega']}")
+    try:
+        solver.execute(parse_macro(sys.stdin.read().splitlines()))
+    except StopCriterionMet:
+        print(f" Stopping criterion reached at t = {solver.t:.6E}")
+        solver.save()
+    except Diverged:
+        for i in range(huge_lines):
+            print(f" Huge value {1e12 * (i + 1):.4E} at index {i % 4096} of 4096")
+        print(" ***** Proc 0: Divergence in u field. *****")
+        print(" ***** Viper terminating - try a smaller time step. *****")
+        sys.exit(1)
+    print(" Viper finished.")
+
+if __name__ == "__main__":
+    main()
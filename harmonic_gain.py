@@ -0,0 +1,176 @@
+import csv
+import math
+import os
+import sys
+
+import numpy as np
+
+from analysis_core import FLOW_LOWER, FLOW_UPPER, channels, load_monitors, reference_monitor, run_parameters, statistics_window, window_start
+from incremental_analysis import load_records
+from run_ledger import open_ledger
+
+# Gain of the outlet flow difference to the control input, found by demodulating the
+# response at the known control frequency instead of smoothing it with a rolling mean.
+# The control channels are driven with A*cos(omega*t) (see viper.cfg), so over whole
+# periods the response is projected onto cos(k*omega*t) and sin(k*omega*t) for the
+# fundamental and its harmonics. Each run's response is first resampled onto a fixed
+# phase grid and averaged period by period, so the projection of any number of runs is
+# one matrix product, and a few periods give a stable answer.
+
+harmonics = 3  # Harmonics of the control frequency included in the distortion figure
+points_per_period = 64
+output_csv = "harmonic_gain.csv"
+
+def phase_average(t, y, omega, start_time):
+    """Averages y over the whole periods between start_time and the last sample.
+
+    Returns the average waveform on points_per_period phases, the phase omega*t of the
+    first grid point, and the number of periods averaged (0 if not even one fits).
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = ~np.isnan(y)
+    t, y = t[valid], y[valid]
+    if omega <= 0 or len(t) < 2:
+        return np.full(points_per_period, np.nan), 0.0, 0
+    period = 2 * math.pi / omega
+    periods = int((t[-1] - max(start_time, t[0])) // period)
+    if periods < 1:
+        return np.full(points_per_period, np.nan), 0.0, 0
+    grid_start = t[-1] - periods * period  # Whole periods ending at the last sample
+    grid = grid_start + (np.arange(periods * points_per_period) + 0.5) * (period / points_per_period)
+    waveform = np.interp(grid, t, y).reshape(periods, points_per_period).mean(axis=0)
+    return waveform, omega * (grid_start + 0.5 * period / points_per_period), periods
+
+def harmonic_coefficients(waveforms, phases, count=harmonics):
+    """Projects phase-averaged waveforms (runs x points_per_period) onto harmonics 0 to count.
+
+    Returns complex coefficients (runs x count+1) such that each waveform is the real part
+    of sum_k C_k exp(i k omega t), so |C_k| is the amplitude of harmonic k and -arg(C_k) its
+    phase lag behind cos(k omega t).
+    """
+    k = np.arange(count + 1)
+    grid_phase = 2 * math.pi * np.arange(points_per_period) / points_per_period
+    basis = np.exp(-1j * np.outer(grid_phase, k)) * (2.0 / points_per_period)
+    coefficients = np.atleast_2d(waveforms) @ basis
+    coefficients[:, 0] /= 2  # The mean is not doubled like the other harmonics
+    return coefficients * np.exp(-1j * np.outer(np.atleast_1d(phases), k))
+
+def harmonic_response(coefficients, amplitudes):
+    """Returns gain magnitude, phase lag (degrees, -180 to 180) and total harmonic distortion per run."""
+    fundamental = np.abs(coefficients[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = fundamental / np.asarray(amplitudes, dtype=np.float64)
+        distortion = np.sqrt((np.abs(coefficients[:, 2:]) ** 2).sum(axis=1)) / fundamental
+        ratios = np.abs(coefficients[:, 2:]) / fundamental[:, None]
+    phase_lag = -np.degrees(np.angle(coefficients[:, 1]))
+    phase_lag = np.where(phase_lag <= -180, phase_lag + 360, phase_lag)
+    return gain, phase_lag, distortion, ratios
+
+def demodulate_runs(responses, count=harmonics):
+    """Demodulates several runs at once.
+
+    responses is a list of (t, y, omega, amplitude, start_time). Returns a dict per run with
+    the gain, phase lag, distortion, ratio of each higher harmonic to the fundamental,
+    mean and number of periods used.
+    """
+    averaged = [phase_average(t, y, omega, start_time) for t, y, omega, _, start_time in responses]
+    return demodulate_averaged(averaged, [amplitude for _, _, _, amplitude, _ in responses], count)
+
+def demodulate_averaged(averaged, amplitudes, count=harmonics):
+    """Demodulates runs already reduced by phase_average, as demodulate_runs."""
+    if not averaged:
+        return []
+    waveforms = np.array([waveform for waveform, _, _ in averaged])
+    coefficients = harmonic_coefficients(waveforms, [phase for _, phase, _ in averaged], count)
+    gain, phase_lag, distortion, ratios = harmonic_response(coefficients, amplitudes)
+    return [{
+        'gain': float(gain[i]),
+        'phase_lag': float(phase_lag[i]),
+        'distortion': float(distortion[i]),
+        'harmonic_ratios': [float(ratio) for ratio in ratios[i]],
+        'mean': float(coefficients[i, 0].real),
+        'periods': periods,
+    } for i, (_, _, periods) in enumerate(averaged)]
+
+def write_harmonic_section(f, result, omega):
+    f.write(f'\nHarmonic Response at Control Frequency:\n')
+    f.write(f"Periods Used: {result['periods']}\n")
+    f.write(f"Period: {2 * math.pi / omega:.6f} s\n")
+    f.write(f"Gain Magnitude: {result['gain']:.6f}\n")
+    f.write(f"Phase Lag: {result['phase_lag']:.4f} deg\n")
+    f.write(f"Total Harmonic Distortion: {result['distortion']:.6f}\n")
+    for k, ratio in enumerate(result['harmonic_ratios'], start=2):
+        f.write(f"Harmonic {k} Ratio: {ratio:.6f}\n")
+
+def harmonic_record(result, omega):
+    """Returns the harmonic response for a run's results record, labelled as in write_harmonic_section."""
+    record = {
+        'Periods Used': result['periods'],
+        'Period': 2 * math.pi / omega,
+        'Gain Magnitude': result['gain'],
+        'Phase Lag': result['phase_lag'],
+        'Total Harmonic Distortion': result['distortion'],
+    }
+    for k, ratio in enumerate(result['harmonic_ratios'], start=2):
+        record[f'Harmonic {k} Ratio'] = ratio
+    return record
+
+def load_run_response(run_dir):
+    """Returns (t, outlet flow difference, omega, amplitude, window start) for a run directory.
+
+    Only int_KE, for the time base, and the two flow outlet files are read.
+    """
+    params = run_parameters(run_dir)
+    (_, upper, upper_column), (_, lower, lower_column) = channels[FLOW_UPPER], channels[FLOW_LOWER]
+    t, records = load_monitors(run_dir, [upper, lower])
+    start_time = t[window_start(t, params['steady_state_time'])] if len(t) else 0.0
+    flow_diff = np.asarray(records[lower][lower_column], dtype=np.float64) - records[upper][upper_column]
+    return t, flow_diff, params['control_frequency'], params['control_amplitude'], start_time
+
+def incremental_response(run_dir, params):
+    """Returns the same as load_run_response from the rows an incremental pass analyses.
+
+    Only the statistics window of the flow outlet files is read from their binary cache.
+    The rows are paired by position, so this is only valid once incremental_statistics has
+    found the monitor files on one time base.
+    """
+    records, _, length = load_records(run_dir)
+    start, _ = statistics_window(records[reference_monitor]['t'][:length], params['steady_state_time'])
+    t = np.asarray(records[reference_monitor]['t'][start:length], dtype=np.float64)
+    flow_diff = (np.asarray(records['flow_outlet_lower']['user_specified_function'][start:length], dtype=np.float64)
+                 - records['flow_outlet_upper']['user_specified_function'][start:length])
+    return t, flow_diff, params['control_frequency'], params['control_amplitude'], t[0] if len(t) else 0.0
+
+def run_directories(root_dir):
+    ledger = open_ledger(root_dir)
+    if ledger is not None:
+        return ledger.directories()
+    return [os.path.join(root_dir, d) for d in sorted(os.listdir(root_dir))
+            if os.path.isfile(os.path.join(root_dir, d, 'flow_outlet_upper.dat'))]
+
+if __name__ == "__main__":
+    root_dir = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
+    # Each run is reduced to its phase-averaged waveform as it loads, so only one run's
+    # time series is held at once
+    directories, settings, averaged = [], [], []
+    for directory in run_directories(root_dir):
+        try:
+            t, flow_diff, omega, amplitude, start_time = load_run_response(directory)
+        except (OSError, KeyError, ValueError, TypeError, IndexError) as e:
+            print(f"Skipping {directory}: {e}")
+            continue
+        if omega is None or amplitude is None:
+            print(f"Skipping {directory}: no control frequency or amplitude in its name.")
+            continue
+        directories.append(directory)
+        settings.append((omega, amplitude))
+        averaged.append(phase_average(t, flow_diff, omega, start_time))
+
+    with open(output_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Directory', 'Control Frequency', 'Control Amplitude', 'Periods Used', 'Gain Magnitude', 'Phase Lag (deg)', 'Total Harmonic Distortion'])
+        results = demodulate_averaged(averaged, [amplitude for _, amplitude in settings])
+        for directory, (omega, amplitude), result in zip(directories, settings, results):
+            writer.writerow([os.path.basename(directory), omega, amplitude, result['periods'], result['gain'], result['phase_lag'], result['distortion']])
+    print(f"Harmonic gain of {len(directories)} runs written to {output_csv}")
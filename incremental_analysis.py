@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+from analysis_core import cull_fraction, monitor_files as monitor_names, reference_monitor, statistics_window
+from dat_cache import cache_paths, load_dat, read_guard, read_meta
+from streaming_stats import QuantileSketch, StreamingStats, summarise
+
+# Statistics for runs that are still being written, updated from where the last pass
+# stopped. Each series is summarised in blocks of block_rows rows, as exact moments plus
+# a quantile sketch (see streaming_stats.py), and a block is only summarised once none of
+# its values can change any more. The blocks are kept in the run's .dat_cache/incremental_state.npz, so
+# a pass parses only the rows Viper has appended (through the binary .dat cache) and
+# summarises only the blocks completed since. The statistics window is made up of whole
+# blocks plus the rows at either end of it, which are computed directly. Rows are paired
+# by position, so a run whose monitor files are not all on int_KE's times (e.g. one that
+# was restarted) is left to the full analysis, which resamples them onto one time base.
+
+block_rows = 4096
+block_sketch_capacity = 1024  # Each block's sketch keeps a quarter of its values, within 3 ranks of exact
+sketch_merge_blocks = 64  # Block sketches merged into the window at a time, bounding memory
+incremental_state_file = "incremental_state.npz"
+
+def summarise_blocks(values):
+    """Returns the moments and quantile sketch of each complete block of block_rows values.
+
+    The sketches are returned concatenated, as (values, levels, start of each block, rank errors).
+    """
+    complete = len(values) // block_rows * block_rows
+    blocks = values[:complete].reshape(-1, block_rows)
+    sketches = []
+    for block in blocks:
+        sketch = QuantileSketch(block_sketch_capacity)
+        sketch.update(block)
+        sketches.append(sketch.to_arrays())
+    starts = np.cumsum([0] + [len(sketch_values) for sketch_values, _, _ in sketches])
+    return (summarise(blocks),
+            np.concatenate([sketch_values for sketch_values, _, _ in sketches] or [np.empty(0)]),
+            np.concatenate([levels for _, levels, _ in sketches] or [np.empty(0, dtype=np.int8)]),
+            starts, np.array([rank_error for _, _, rank_error in sketches], dtype=np.int64))
+
+def source_fingerprints(run_dir):
+    """Returns the parsed byte offset and the bytes before it for each monitor file's cache."""
+    fingerprints = {}
+    for name in monitor_names:
+        meta = read_meta(cache_paths(os.path.join(run_dir, name + ".dat"))[2])
+        fingerprints[name] = (meta["offset"], meta["guard"]) if meta else (0, "")
+    return fingerprints
+
+def sources_unchanged(run_dir, fingerprints):
+    """Checks that every monitor file still starts with the bytes the saved blocks were built from."""
+    for name, (offset, guard) in fingerprints.items():
+        path = os.path.join(run_dir, name + ".dat")
+        if not os.path.isfile(path) or os.path.getsize(path) < offset:
+            return False
+        with open(path, "rb") as f:
+            if read_guard(f, offset) != guard:
+                return False
+    return True
+
+def empty_blocks():
+    return {"moments": np.empty((0, 5)), "values": np.empty(0), "levels": np.empty(0, dtype=np.int8),
+            "starts": np.zeros(1, dtype=np.int64), "errors": np.empty(0, dtype=np.int64)}
+
+def append_blocks(blocks, new_blocks):
+    moments, values, levels, starts, errors = new_blocks
+    return {"moments": np.vstack([blocks["moments"], moments]),
+            "values": np.concatenate([blocks["values"], values]),
+            "levels": np.concatenate([blocks["levels"], levels]),
+            "starts": np.concatenate([blocks["starts"], blocks["starts"][-1] + starts[1:]]),
+            "errors": np.concatenate([blocks["errors"], errors])}
+
+def load_state(run_dir, names):
+    """Returns the number of rows summarised and the saved blocks of each series, or an empty state."""
+    empty = 0, {name: empty_blocks() for name in names}
+    state_path = os.path.join(run_dir, ".dat_cache", incremental_state_file)
+    if not os.path.isfile(state_path):
+        return empty
+    with np.load(state_path) as state:
+        fingerprints = {name: (int(offset), str(guard)) for name, offset, guard in zip(state["sources"], state["offsets"], state["guards"])}
+        if (list(state["names"]) != list(names) or int(state["block_rows"]) != block_rows
+                or int(state["block_sketch_capacity"]) != block_sketch_capacity or not sources_unchanged(run_dir, fingerprints)):
+            return empty  # Different series or settings, or a monitor file was rewritten (e.g. by a restart)
+        return int(state["rows"]), {name: {key: state[f"{key}_{i}"] for key in empty_blocks()} for i, name in enumerate(names)}
+
+def save_state(run_dir, rows, blocks):
+    fingerprints = source_fingerprints(run_dir)
+    state_path = os.path.join(run_dir, ".dat_cache", incremental_state_file)
+    temp_path = f"{state_path}.{os.getpid()}.tmp.npz"
+    arrays = {f"{key}_{i}": array for i, series_blocks in enumerate(blocks.values()) for key, array in series_blocks.items()}
+    np.savez(temp_path, rows=rows, block_rows=block_rows, block_sketch_capacity=block_sketch_capacity, names=np.array(list(blocks)),
+             sources=np.array(list(fingerprints)), offsets=np.array([offset for offset, _ in fingerprints.values()]),
+             guards=np.array([guard for _, guard in fingerprints.values()]), **arrays)
+    os.replace(temp_path, state_path)
+
+def on_reference_times(records, start, stop):
+    """Checks that rows start to stop of every monitor file have the reference monitor's times, strictly increasing."""
+    start = max(start - 1, 0)  # Include the last row already checked, to see that the times still increase across it
+    t = np.asarray(records[reference_monitor]["t"][start:stop])
+    if np.any(t[1:] <= t[:-1]):
+        return False
+    return all(np.array_equal(r["t"][start:stop], t) for r in records.values())
+
+def load_records(run_dir):
+    """Returns the cached rows of every monitor file, the number of rows they share and the number analysed after culling."""
+    records = {name: load_dat(os.path.join(run_dir, name + ".dat")) for name in monitor_names}
+    rows = min(len(r) for r in records.values())
+    return records, rows, rows - int(rows * cull_fraction)
+
+def incremental_statistics(run_dir, series, steady_state_time=None):
+    """Returns the window statistics of each series, summarising only the rows added since the last call.
+
+    series is a list of (name, series function, lookahead), where lookahead is how many
+    rows past the end of the analysed data can still change a value (e.g. the width of a
+    centred rolling mean). Returns a dict of each name to the same statistics as
+    streaming_stats.StreamingStats.result, and the label of the window, or None if the
+    monitor files are not on one time base, when only the full analysis gives the right
+    statistics.
+    """
+    records, rows, length = load_records(run_dir)
+    names = [name for name, _, _ in series]
+    summarised_rows, blocks = load_state(run_dir, names)
+    if not on_reference_times(records, summarised_rows, rows):
+        return None  # The rows before summarised_rows were checked when they were summarised
+
+    # Summarise the blocks whose values are now final
+    lookahead = max(lookahead for _, _, lookahead in series)
+    final_rows = max(0, length - lookahead) // block_rows * block_rows
+    if final_rows > summarised_rows:
+        for name, function, _ in series:
+            blocks[name] = append_blocks(blocks[name], summarise_blocks(function(records, summarised_rows, final_rows, length)))
+        summarised_rows = final_rows
+        save_state(run_dir, summarised_rows, blocks)
+
+    start, window = statistics_window(records[reference_monitor]["t"][:length], steady_state_time)
+
+    first_block = -(-start // block_rows)
+    last_block = summarised_rows // block_rows
+    statistics = {}
+    for name, function, _ in series:
+        stats = StreamingStats()
+        if first_block < last_block:
+            stats.update(function(records, start, first_block * block_rows, length))
+            series_blocks = blocks[name]
+            stats.add_moments(series_blocks["moments"][first_block:last_block])
+            for group in range(first_block, last_block, sketch_merge_blocks):
+                group_end = min(group + sketch_merge_blocks, last_block)
+                values_start, values_end = series_blocks["starts"][group], series_blocks["starts"][group_end]
+                stats.sketch.add_arrays(series_blocks["values"][values_start:values_end], series_blocks["levels"][values_start:values_end],
+                                        series_blocks["errors"][group:group_end].sum())
+            stats.update(function(records, last_block * block_rows, length, length))
+        else:
+            stats.update(function(records, start, length, length))
+        statistics[name] = stats.result()
+    return statistics, window
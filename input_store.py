@@ -0,0 +1,75 @@
+import errno
+import os
+import shutil
+import socket
+import threading
+
+from run_cache import hash_file
+
+# Content-addressed store of read-only inputs (meshes) shared by every run directory
+input_store_dir = ".input_store"
+
+class InputStore:
+    """Places shared read-only inputs into run directories without copying them each time.
+
+    Each distinct file is checksummed and copied into the store once, then hardlinked
+    into run directories. A symlink is used where hardlinks are not possible, and a plain
+    copy only when the run directory is on another filesystem and symlinks are
+    unavailable. Only use it for files Viper never writes, since every link points at
+    the same data.
+    """
+
+    def __init__(self, store_dir, digest_function=None):
+        self.store_dir = store_dir
+        self.digest_function = digest_function
+        self.lock = threading.Lock()
+        self.digests = {}
+        os.makedirs(store_dir, exist_ok=True)
+
+    def digest(self, path):
+        """Returns the checksum of a source file, hashing it only when it has changed."""
+        if self.digest_function is not None:
+            return self.digest_function(path)
+        file_stat = os.stat(path)
+        signature = (os.path.abspath(path), file_stat.st_size, file_stat.st_mtime_ns)
+        with self.lock:
+            if signature in self.digests:
+                return self.digests[signature]
+        digest = hash_file(path)
+        with self.lock:
+            self.digests[signature] = digest
+        return digest
+
+    def import_file(self, source):
+        """Adds a file to the store if it is not there yet and returns the stored path."""
+        digest = self.digest(source)
+        stored_path = os.path.join(self.store_dir, digest + os.path.splitext(source)[1])
+        with self.lock:
+            if not os.path.isfile(stored_path):
+                temp_path = f"{stored_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+                shutil.copyfile(source, temp_path)
+                if hash_file(temp_path) != digest:
+                    os.remove(temp_path)
+                    raise IOError(f"{source} changed while it was being added to the input store")
+                os.replace(temp_path, stored_path)
+        return stored_path
+
+    def place(self, source, destination):
+        """Puts a shared input at destination, preferring a hardlink, then a symlink, then a copy."""
+        stored_path = self.import_file(source)
+        if os.path.lexists(destination):
+            os.remove(destination)
+        try:
+            os.link(stored_path, destination)
+            return "hardlink"
+        except OSError as e:
+            cross_device = e.errno == errno.EXDEV
+        try:
+            os.symlink(os.path.abspath(stored_path), destination)
+            return "symlink"
+        except OSError:
+            pass
+        if not cross_device:
+            print(f"Warning: could not link {destination}, copying instead.")
+        shutil.copyfile(stored_path, destination)
+        return "copy"
@@ -0,0 +1,136 @@
+import csv
+import itertools
+import json
+import os
+
+# A sweep spec is a JSON file describing parameter combinations instead of listing every
+# run as a parameters.csv row:
+#
+#   {
+#     "base": {"Polynomial order": 3, "Control amplitude": 0.2, "Control up-down balance": 0,
+#              "Time step": 0.0005, "Animation loops": 200, "End Time": 50},
+#     "sweeps": [
+#       {"product": {"Reynolds number": [50, 100, 200], "mesh_file": [1, 2]}},
+#       {"product": {"Reynolds number": [100]},
+#        "zip": {"Control frequency": [0.5, 1, 2], "Time step": [0.001, 0.0005, 0.00025]}}
+#     ]
+#   }
+#
+# Each entry in "sweeps" is expanded on top of "base": every "product" parameter is varied
+# independently, and the "zip" parameters are varied together as a single axis (their
+# lists must be the same length). Runs are generated one at a time as the runner asks
+# for them.
+#
+# Indices are kept in <spec>.index.jsonl, an append-only record of every combination seen.
+# A combination keeps its index for good, and new ones are numbered after the highest
+# index used so far, so directory names and {index}_results.txt files stay consistent
+# when values or sweeps are added later. Changing a "base" value makes new combinations.
+
+# Columns every run needs, filled in when the spec does not set them
+default_columns = {
+    'Convergence criteria': '',
+    'End Time': '',
+    'Override': '',
+    'Verbose': '',
+    'Comments': '',
+}
+
+# Columns the runner reads from every row
+required_columns = [
+    'Reynolds number', 'mesh_file', 'Polynomial order', 'Control amplitude', 'Control frequency',
+    'Control up-down balance', 'Time step', 'Animation loops',
+]
+
+# Columns that do not change what Viper computes, so they are left out of a run's identity
+bookkeeping_columns = ['Index', 'Override', 'Verbose', 'Comments', 'Threads']
+
+def format_value(value):
+    """Formats a spec value the way it would appear in parameters.csv."""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def expand_sweep(sweep):
+    """Yields the parameter dicts of one sweep entry, one combination at a time."""
+    axes = []
+    for name, values in sweep.get('product', {}).items():
+        axes.append([{name: value} for value in values])
+
+    zipped = sweep.get('zip', {})
+    if zipped:
+        lengths = {len(values) for values in zipped.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"zip lists must all be the same length, got {sorted(lengths)}")
+        names = list(zipped)
+        axes.append([dict(zip(names, values)) for values in zip(*zipped.values())])
+
+    for combination in itertools.product(*axes):
+        parameters = {}
+        for part in combination:
+            parameters.update(part)
+        yield parameters
+
+def run_identity(row):
+    """Returns a canonical string identifying what a run computes."""
+    return json.dumps({key: row[key] for key in sorted(row) if key not in bookkeeping_columns})
+
+class SweepIndex:
+    """Append-only registry giving each distinct run a permanent index."""
+
+    def __init__(self, path, start_index=0):
+        self.path = path
+        self.indices = {}
+        self.next_index = start_index
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.indices[entry['identity']] = entry['index']
+                        self.next_index = max(self.next_index, entry['index'] + 1)
+
+    def index_for(self, identity):
+        """Returns the index of a run, assigning and recording a new one if needed."""
+        if identity not in self.indices:
+            self.indices[identity] = self.next_index
+            self.next_index += 1
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'index': self.indices[identity], 'identity': identity}) + '\n')
+        return self.indices[identity]
+
+def iter_sweep(spec_path):
+    """Yields (index, row) pairs for a sweep spec, with zero-based indices like enumerate()."""
+    with open(spec_path, 'r') as f:
+        spec = json.load(f)
+
+    base = dict(default_columns)
+    base.update({key: format_value(value) for key, value in spec.get('base', {}).items()})
+    sweep_index = SweepIndex(os.path.splitext(spec_path)[0] + '.index.jsonl', spec.get('start_index', 1) - 1)
+
+    seen = set()
+    for sweep in spec.get('sweeps', [{}]):
+        for parameters in expand_sweep(sweep):
+            row = dict(base)
+            row.update({key: format_value(value) for key, value in parameters.items()})
+            missing = [column for column in required_columns if not row.get(column)]
+            if missing:
+                raise ValueError(f"Sweep spec {spec_path} does not set {', '.join(missing)} for {parameters}")
+            index = sweep_index.index_for(run_identity(row))
+            if index in seen:
+                continue  # Overlapping sweeps describe the same run
+            seen.add(index)
+            row['Index'] = str(index + 1)
+            yield index, row
+
+def iter_parameter_rows(path):
+    """Yields (index, row) pairs from either parameters.csv or a JSON sweep spec."""
+    if path.lower().endswith('.json'):
+        yield from iter_sweep(path)
+        return
+
+    with open(path, 'r') as f:
+        reader = csv.DictReader(f)
+        next(reader) # Skip the description row
+        yield from enumerate(reader)
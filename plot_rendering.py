@@ -0,0 +1,136 @@
+import os
+import warnings
+
+import matplotlib
+matplotlib.use("Agg")  # Plots are only ever saved to files, and worker processes have no display
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+# Rendering of the per-run analysis plots. A monitor series can have far more samples
+# than the saved figure has pixels across, and stroking them all was the slowest part of
+# an analysis. Each series is reduced to the minimum and maximum of the samples in each
+# pixel column of its axes, and drawn as the band between them under a line through
+# its middle. This draws the same picture from a few thousand points, so every peak and
+# trough of an oscillation survives, and the PDF stays small.
+
+plot_dpi = 400
+plot_formats = ("png", "pdf")  # Formats saved for each run; empty to leave plotting to a later pass
+
+def plot_path(output_dir, sim_index, plot_format):
+    return os.path.join(output_dir, f"{sim_index}_plot.{plot_format}")
+
+def parse_formats(text):
+    """Parses a comma separated list of plot formats, where "none" (or nothing) means no plots."""
+    return tuple(fmt.strip().lower() for fmt in text.split(",") if fmt.strip() and fmt.strip().lower() != "none")
+
+def display_columns(ax, dpi=plot_dpi):
+    """Returns the pixel columns an axes can span at the given resolution, from its grid cell."""
+    spec = ax.get_subplotspec()
+    fraction = (spec.colspan.stop - spec.colspan.start) / spec.get_gridspec().ncols
+    return int(np.ceil(ax.figure.get_figwidth() * fraction * dpi))
+
+def envelope(t, values, columns):
+    """Min-max decimation of each row of a 2-D array sharing the time axis t.
+
+    The samples are split into at most `columns` runs of consecutive samples. Returns the
+    time at the middle of each run and the minimum and maximum of each row over each run,
+    as (runs,), (rows x runs) and (rows x runs) arrays. NaNs are skipped; a run that is all
+    NaN gives NaN, which leaves a gap. Rows short enough already are returned whole, with
+    the minimum and maximum both the values.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    rows, n = values.shape
+    if n <= 2 * columns:
+        return t, values, values
+    size = -(-n // columns)  # Samples per column
+    buckets = -(-n // size)
+    padded = np.full((rows, buckets * size), np.nan)
+    padded[:, :n] = values
+    padded = padded.reshape(rows, buckets, size)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN runs
+        low, high = np.nanmin(padded, axis=2), np.nanmax(padded, axis=2)
+    middle = np.minimum(np.arange(buckets) * size + size // 2, n - 1)
+    return t[middle], low, high
+
+def draw_band(ax, line, t, low, high):
+    """Draws the band between the column minima and maxima of a decimated series under its line.
+
+    The band of a solid line is edged with the line's width, so a series that varies slowly
+    across the columns looks the same as the full line. Other line styles get no edge.
+    Returns the band, or None when the series was not decimated.
+    """
+    if not np.any(high != low):
+        return None
+    edge = line.get_linewidth() if line.get_linestyle() == "-" else 0
+    return ax.fill_between(t, low, high, color=line.get_color(), alpha=line.get_alpha(), linewidth=edge,
+                           joinstyle="round", zorder=line.get_zorder())
+
+class FigureTemplate:
+    """The 2x2 analysis figure, laid out and styled once and reused for every run.
+
+    panels gives each axes as a dict with its title, ylabel, series (a list of (row, line
+    style) pairs, where row indexes the rows of the 2-D array passed to render) and whether
+    it has a legend. figure_legend is an optional list of (line style, label) entries for a
+    legend below the axes. Rendering a run only replaces the line data, the bands, the
+    limits and the title before saving.
+    """
+
+    def __init__(self, panels, figure_legend=None):
+        self.fig, axs = plt.subplots(2, 2, figsize=(15, 10))
+        self.panels = []
+        for ax, panel in zip(axs.flat, panels):
+            lines = [(row, ax.plot([], [], **style)[0]) for row, style in panel["series"]]
+            ax.set_title(panel["title"])
+            ax.set_xlabel("Time")
+            ax.set_ylabel(panel["ylabel"])
+            if panel.get("legend"):
+                ax.legend()
+            ax.grid(True)
+            self.panels.append((ax, lines))
+        if figure_legend:
+            self.fig.legend([plt.Line2D([0], [0], **style) for style, _ in figure_legend], [label for _, label in figure_legend],
+                            loc="lower center", bbox_to_anchor=(0.5, -0.05), fancybox=True, shadow=True, ncol=1)
+        self.bands = []
+
+    def render(self, t, series, params, output_dir, formats=plot_formats, dpi=plot_dpi):
+        """Plots the rows of series against t and saves the figure for one run."""
+        for band in self.bands:
+            band.remove()
+        self.bands = []
+        # Reduce every series to the pixel columns of an axes in one pass (the axes are all one grid column wide)
+        times, low, high = envelope(t, series, display_columns(self.panels[0][0], dpi))
+        for ax, lines in self.panels:
+            for row, line in lines:
+                line.set_data(times, (low[row] + high[row]) / 2)
+                band = draw_band(ax, line, times, low[row], high[row])
+                if band is not None:
+                    self.bands.append(band)
+            ax.relim()
+            rows = [row for row, _ in lines]
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN series
+                limits = np.array([[np.nanmin(times), np.nanmin(low[rows])], [np.nanmax(times), np.nanmax(high[rows])]]) if len(times) else np.empty((0, 2))
+            ax.update_datalim(limits[np.isfinite(limits).all(axis=1)])  # relim leaves out the bands
+            ax.autoscale_view()
+        save_figure(self.fig, params, output_dir, formats, dpi)
+
+# Templates built so far in this process, by name, so each worker lays out a figure only once
+templates = {}
+
+def figure_template(name, panels, figure_legend=None):
+    if name not in templates:
+        templates[name] = FigureTemplate(panels, figure_legend)
+    return templates[name]
+
+def save_figure(fig, params, output_dir, formats=plot_formats, dpi=plot_dpi):
+    """Titles a run's figure with its parameters and saves it in each of the formats."""
+    sim_info = (f"Re: {params['reynolds_num']}, Mesh: {params['mesh']}, N: {params['poly_order']}, A: {params['control_amplitude']}, "
+                f"f: {params['control_frequency']}, b: {params['control_balance']}, dt: {params['timestep']}")
+    fig.suptitle(f"Data Analysis Results - Simulation {int(params['sim_index'])}\n{sim_info}", fontsize=16)
+    # Lay out after titling, so the space left for the title is the same whether or not the figure is reused
+    fig.tight_layout()
+    for plot_format in formats:
+        fig.savefig(plot_path(output_dir, int(params['sim_index']), plot_format), dpi=dpi)
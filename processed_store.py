@@ -0,0 +1,77 @@
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+# The processed data of each run, saved as processed_data.npz in its results directory.
+# Every channel (each monitor file, and the gain) is a structured array with one named,
+# typed field per column, including its own time column, so nothing goes through pickle
+# and a channel reads back with its column names. Members are stored uncompressed by
+# default: a single channel is then memory-mapped straight out of the archive without
+# reading the rest. Compressed archives are smaller and still read one channel at a time,
+# but that channel is decompressed into memory.
+
+processed_data_file = "processed_data.npz"
+compress_processed = False  # Smaller files, but channels can no longer be memory-mapped
+
+local_header = struct.Struct("<4s22xHH")  # Signature, then the name and extra field lengths
+
+def processed_path(output_dir):
+    return os.path.join(output_dir, processed_data_file)
+
+def write_processed(output_dir, data, compress=compress_processed):
+    """Saves a dict of channel name to structured array as the processed data of a run, atomically."""
+    path = processed_path(output_dir)
+    temp_path = f"{path}.{os.getpid()}.tmp.npz"
+    (np.savez_compressed if compress else np.savez)(temp_path, **{name: np.ascontiguousarray(array) for name, array in data.items()})
+    os.replace(temp_path, path)
+    return path
+
+def channel_names(path):
+    """Returns the names of the channels in a processed data file, without reading any of them."""
+    with zipfile.ZipFile(path) as archive:
+        return [os.path.splitext(name)[0] for name in archive.namelist()]
+
+def member_offset(f, info):
+    """Returns the offset of an archive member's data, from its local header (whose extra field can differ from the directory's)."""
+    f.seek(info.header_offset)
+    signature, name_length, extra_length = local_header.unpack(f.read(local_header.size))
+    if signature != b"PK\x03\x04":
+        raise ValueError(f"Bad local header for {info.filename}")
+    return info.header_offset + local_header.size + name_length + extra_length
+
+def load_channel(path, name, mmap=True):
+    """Returns one channel of a processed data file, reading nothing else.
+
+    An uncompressed channel is memory-mapped read-only when mmap is set; otherwise (or if
+    the file is compressed) only that channel's member is read. Files written before the
+    channels had named columns load as the plain arrays they hold.
+    """
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + ".npy")
+        if mmap and info.compress_type == zipfile.ZIP_STORED:
+            with open(path, "rb") as f:
+                f.seek(member_offset(f, info))
+                version = np.lib.format.read_magic(f)
+                read_header = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}.get(version)
+                if read_header is not None:
+                    shape, fortran_order, dtype = read_header(f)
+                    if not dtype.hasobject and np.prod(shape, dtype=np.int64):
+                        return np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                         order="F" if fortran_order else "C")
+        with archive.open(info) as member:
+            return np.lib.format.read_array(member, allow_pickle=False)
+
+def load_sweep_channel(paths, name, mmap=True):
+    """Returns one channel from each of many processed data files, e.g. the gain of every run in a sweep.
+
+    Files that are missing or lack the channel give None.
+    """
+    series = []
+    for path in paths:
+        try:
+            series.append(load_channel(path, name, mmap))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            series.append(None)
+    return series
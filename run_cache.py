@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+
+# Manifest of completed runs keyed on a hash of everything Viper reads, kept in the root directory
+cache_manifest_file = "run_cache.json"
+
+def hash_file(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class RunCache:
+    """Content-addressed record of completed runs.
+
+    A run's key is the SHA-256 of its rendered viper.cfg and macro files plus the
+    checksum of its mesh, so two rows that would make Viper do identical work share a
+    key whatever their index or directory name. File checksums are remembered against
+    size and modification time, so re-planning a sweep only hashes meshes that changed.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.files = {}
+        self.loaded_mtime_ns = None
+        self.refresh()
+
+    def refresh(self):
+        """Merges in entries saved by other processes (e.g. queue workers on other hosts) since the last read."""
+        if not os.path.isfile(self.manifest_path):
+            return
+        mtime_ns = os.stat(self.manifest_path).st_mtime_ns
+        if mtime_ns == self.loaded_mtime_ns:
+            return
+        with open(self.manifest_path, "r") as f:
+            manifest = json.load(f)
+        with self.lock:
+            self.runs = {**manifest.get("runs", {}), **self.runs}
+            self.files = {**manifest.get("files", {}), **self.files}
+            self.loaded_mtime_ns = mtime_ns
+
+    def file_digest(self, path):
+        """Returns the checksum of a file, reusing the stored one if the file is unchanged."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return entry["sha256"]
+        digest = hash_file(path)
+        with self.lock:
+            self.files[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def run_key(self, rendered_inputs, mesh_path):
+        """Returns the cache key for a run from its rendered input texts and mesh file."""
+        digest = hashlib.sha256()
+        for text in rendered_inputs:
+            digest.update(text.encode())
+            digest.update(b"\0")
+        digest.update(self.file_digest(mesh_path).encode())
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        """Returns the manifest entry of a completed run with this key whose directory still exists."""
+        self.refresh()
+        with self.lock:
+            entry = self.runs.get(key)
+        if entry and os.path.isdir(entry["directory"]):
+            return entry
+        return None
+
+    def record(self, key, directory, index, dt):
+        """Records a completed run and saves the manifest."""
+        with self.lock:
+            self.runs[key] = {"directory": os.path.abspath(directory), "index": index, "dt": dt}
+        self.save()
+
+    def save(self):
+        """Writes the manifest atomically so an interrupted sweep never leaves it half written.
+
+        Entries written by other processes since this one loaded the manifest are kept.
+        """
+        self.refresh()
+        with self.lock:
+            manifest = {"runs": self.runs, "files": self.files}
+            temp_path = f"{self.manifest_path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(temp_path, self.manifest_path)
@@ -0,0 +1,188 @@
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+from parameter_sweep import run_identity
+
+# SQLite record of every run, shared by the runner, the analysis batch scripts and the collector
+ledger_file = "run_ledger.sqlite"
+
+# Parameter columns stored alongside the full row so runs can be filtered without parsing folder names
+parameter_columns = {
+    'reynolds': 'Reynolds number',
+    'mesh': 'mesh_file',
+    'poly_order': 'Polynomial order',
+    'amplitude': 'Control amplitude',
+    'frequency': 'Control frequency',
+    'balance': 'Control up-down balance',
+}
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_index INTEGER PRIMARY KEY,
+    reynolds REAL,
+    mesh INTEGER,
+    poly_order INTEGER,
+    amplitude REAL,
+    frequency REAL,
+    balance REAL,
+    time_step REAL,
+    parameters TEXT,
+    status TEXT,
+    directory TEXT,
+    dt_retries INTEGER DEFAULT 0,
+    crash_summary TEXT,
+    wall_time REAL,
+    started_at REAL,
+    finished_at REAL,
+    analysis_status TEXT,
+    results_file TEXT,
+    tecplot_status TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_status ON runs (status);
+CREATE INDEX IF NOT EXISTS runs_directory ON runs (directory);
+"""
+
+def to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class RunLedger:
+    """Run state for the whole pipeline, one row per parameter set keyed on its Index.
+
+    Run status is one of running, completed, crashed, cached (served by the run cache)
+    or exists (skipped because its directory was already there). Each stage records its
+    own progress, so later stages can query for work instead of scanning directories.
+    Every call opens its own connection, so one ledger can be shared between threads,
+    and with wal=False between processes on several hosts (wal=None keeps the current mode).
+    """
+
+    def __init__(self, path, wal=True):
+        self.path = path
+        self.conflicts = set()  # Indices whose ledger row holds a different run, not to be written by this process
+        with closing(self.connect()) as connection:
+            # WAL needs shared memory between processes, so hosts sharing a network filesystem use a rollback journal
+            if wal is not None:
+                connection.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+            connection.executescript(schema)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=60)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def upsert(self, connection, run_index, values):
+        columns = ["run_index"] + list(values)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in values)
+        connection.execute(
+            f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(run_index) DO UPDATE SET {assignments}",
+            [run_index] + list(values.values()))
+
+    def update(self, run_index, **values):
+        """Inserts or updates the given columns of a run, unless its Index was refused to this process."""
+        if run_index in self.conflicts:
+            return
+        with closing(self.connect()) as connection, connection:
+            self.upsert(connection, run_index, values)
+
+    def record_run(self, run_index, parameters, directory, **values):
+        """Records a run's parameters, directory and state, unless its Index holds a different run.
+
+        Runs from another parameter source (e.g. an adaptive sweep beside parameters.csv) can
+        reuse an Index. Rather than overwrite that row, the write is refused with a warning,
+        and later updates of the Index from this process are dropped. Returns whether the run
+        was recorded.
+        """
+        values.update({column: to_number(parameters.get(name)) for column, name in parameter_columns.items()})
+        values.update(parameters=json.dumps(parameters), directory=os.path.abspath(directory))
+        with closing(self.connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")  # Check and write in one transaction, as other hosts may share the ledger
+            existing = connection.execute("SELECT parameters, directory FROM runs WHERE run_index = ?", (run_index,)).fetchone()
+            if existing is not None and existing["parameters"] and run_identity(json.loads(existing["parameters"])) != run_identity(parameters):
+                self.conflicts.add(run_index)
+                print(f"Warning: ledger index {run_index} already records a different run ({existing['directory']}). "
+                      f"Not recording {values['directory']} over it; give the runs distinct indices.")
+                return False
+            self.conflicts.discard(run_index)
+            self.upsert(connection, run_index, values)
+        return True
+
+    def start_run(self, run_index, parameters, directory, dt):
+        return self.record_run(run_index, parameters, directory, status="running", time_step=dt, dt_retries=0, crash_summary=None,
+                               wall_time=None, started_at=time.time(), finished_at=None)
+
+    def finish_run(self, run_index, status, directory=None, dt=None, dt_retries=0, crash_summary=None, wall_time=None):
+        values = {"status": status, "dt_retries": dt_retries, "crash_summary": crash_summary, "wall_time": wall_time, "finished_at": time.time()}
+        if directory is not None:
+            values["directory"] = os.path.abspath(directory)
+        if dt is not None:
+            values["time_step"] = dt
+        self.update(run_index, **values)
+
+    def record_skipped(self, run_index, parameters, directory, status):
+        """Records a run that was not simulated because its results already exist."""
+        return self.record_run(run_index, parameters, directory, status=status, finished_at=time.time())
+
+    def record_stage(self, directory, **values):
+        """Updates the runs in a directory, e.g. analysis_status and results_file after analysis."""
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with closing(self.connect()) as connection, connection:
+            connection.execute(f"UPDATE runs SET {assignments} WHERE directory = ?", list(values.values()) + [os.path.abspath(directory)])
+
+    def runs(self, status=None, **filters):
+        """Returns the runs matching a status (or list of statuses) and column filters, as dicts."""
+        conditions, arguments = [], []
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            arguments += statuses
+        for column, value in filters.items():
+            if value is None:
+                conditions.append(f"{column} IS NULL")
+            else:
+                conditions.append(f"{column} = ?")
+                arguments.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self.connect()) as connection:
+            return [dict(row) for row in connection.execute(f"SELECT * FROM runs{where} ORDER BY run_index", arguments)]
+
+    def directories(self, status=("completed", "cached", "exists"), **filters):
+        """Returns the directories of runs with results, de-duplicated and in index order."""
+        seen, directories = set(), []
+        for run in self.runs(status, **filters):
+            if run["directory"] and run["directory"] not in seen and os.path.isdir(run["directory"]):
+                seen.add(run["directory"])
+                directories.append(run["directory"])
+        return directories
+
+    def summary(self):
+        """Returns run counts by status and the number of finished runs still to be analysed."""
+        with closing(self.connect()) as connection:
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM runs GROUP BY status").fetchall())
+            unanalysed = connection.execute(
+                "SELECT COUNT(*) FROM runs WHERE status IN ('completed', 'cached', 'exists') AND analysis_status IS NOT 'done'").fetchone()[0]
+        return counts, unanalysed
+
+def open_ledger(directory="."):
+    """Returns the ledger in a directory, or None if the runner has not created one there."""
+    path = os.path.join(directory, ledger_file)
+    return RunLedger(path, wal=None) if os.path.isfile(path) else None
+
+if __name__ == "__main__":
+    ledger = open_ledger(sys.argv[1] if len(sys.argv) > 1 else ".")
+    if ledger is None:
+        print(f"No {ledger_file} found.")
+        sys.exit(1)
+    counts, unanalysed = ledger.summary()
+    for status, count in sorted(counts.items(), key=lambda item: str(item[0])):
+        print(f"{status}: {count}")
+    print(f"Awaiting analysis: {unanalysed}")
+    for run in ledger.runs("crashed"):
+        first_line = (run["crash_summary"] or "").splitlines()[0] if run["crash_summary"] else ""
+        print(f"  Crashed: {run['run_index']} after {run['dt_retries']} dt reductions - {first_line}")
@@ -1,180 +1,627 @@
-import csv
+import argparse
+import collections
 import os
 import shutil
 import subprocess
+import threading
 import time
 import math
 import sys
 import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from input_store import InputStore, input_store_dir
+from parameter_sweep import iter_parameter_rows
+from run_cache import RunCache, cache_manifest_file
+from run_ledger import RunLedger, ledger_file
+from steady_state import SteadyStateWatcher, steady_state_file
+from work_queue import WorkQueue, queue_dir, lease_seconds, run_worker, print_status
 
 # --- Configuration ---
-parameters_file = "parameters.csv"
+parameters_file = "parameters.csv"  # Or a JSON sweep spec, see parameter_sweep.py
 viper_exe = "viper.exe"
 libiomp5md_dll = "libiomp5md.dll"
 max_iterations = 1000000
 max_dt_reductions = 4
 
+# Scheduler: number of Viper jobs to run at once, the total number of cores they may
+# share, and the OpenMP thread budget given to each job (a 'Threads' column in
+# parameters.csv overrides it per row). None leaves a serial run's threading to
+# OpenMP and splits the cores evenly between parallel runs.
+max_parallel_runs = 1
+max_total_cores = os.cpu_count() or 1
+threads_per_run = None
+
+# Retries after a time step failure restart from the last save.dat instead of t=0
+restart_from_checkpoint = True
+checkpoint_file = "save.dat"
+monitor_files = ["int_KE.dat", "flowrate.dat", "flow_outlet_upper.dat", "flow_outlet_lower.dat", "pressure_outlet_upper.dat", "pressure_outlet_lower.dat"]
+rows_per_checkpoint = 100  # Monitor rows written per outer loop of macro.txt, i.e. between saves
+
+# End time runs with a control frequency are stopped once the monitor channels repeat from
+# one period to the next for this many periods (0 runs to the full End time). They run as
+# a series of Viper jobs of steady_state_segment_loops outer loops of macro.txt, each
+# resuming from the last one's save.dat, and end after the job in which they converge.
+steady_state_periods = 3
+steady_state_tolerance = 1e-3  # Largest cycle-to-cycle change, relative to the signal's range
+steady_state_segment_loops = 10
+
 # --- Functions ---
 
 def check_file_exists(file_path):
     """Check if a file exists without printing."""
     return os.path.isfile(file_path)
 
-def create_run_directory(base_dir, parameters, index, dt):
+def run_directory_name(parameters, index, dt):
+    """Returns the concise directory name for a simulation run."""
+    return f"{index + 1}_Re{parameters['Reynolds number']}_m{parameters['mesh_file']}_N{parameters['Polynomial order']}_A{parameters['Control amplitude']}_o{parameters['Control frequency']}_b{parameters['Control up-down balance']}_dt{dt}"
+
+def read_run_key(directory):
+    """Returns the cache key stored in a run directory, or None for runs made before the cache."""
+    key_path = os.path.join(directory, "run_key.txt")
+    if not check_file_exists(key_path):
+        return None
+    with open(key_path, "r") as f:
+        return f.read().strip()
+
+def clear_run_outputs(directory):
+    """Removes the monitor files and checkpoint of an earlier run, which Viper would otherwise append to."""
+    for file_name in monitor_files + [checkpoint_file, steady_state_file, "crash_summary.txt"]:
+        path = os.path.join(directory, file_name)
+        if check_file_exists(path):
+            os.remove(path)
+
+def create_run_directory(base_dir, parameters, index, dt, run_key=None):
     """Creates a unique, concisely named directory for each simulation run."""
-    directory_name = f"{index + 1}_Re{parameters['Reynolds number']}_m{parameters['mesh_file']}_N{parameters['Polynomial order']}_A{parameters['Control amplitude']}_o{parameters['Control frequency']}_b{parameters['Control up-down balance']}_dt{dt}"
+    directory_name = run_directory_name(parameters, index, dt)
     full_path = os.path.join(base_dir, directory_name)
 
     if os.path.exists(full_path) and parameters['Override'] != 'y':
-        print(f"Skipping index {index + 1} - directory '{directory_name}' already exists.")
-        return None
-    else:
-        os.makedirs(full_path, exist_ok=True)
-        return full_path
+        existing_key = read_run_key(full_path)
+        if run_key is None or existing_key is None or existing_key == run_key:
+            print(f"Skipping index {index + 1} - directory '{directory_name}' already exists.")
+            return None
+        # Same name but different inputs (e.g. another End time), so keep both runs
+        directory_name = f"{directory_name}_{run_key[:8]}"
+        full_path = os.path.join(base_dir, directory_name)
+        if os.path.exists(full_path):
+            print(f"Skipping index {index + 1} - directory '{directory_name}' already exists.")
+            return None
+        print(f"Directory for index {index + 1} holds a different configuration, using '{directory_name}' instead.")
 
-def modify_file(template_file, parameters, output_file, replacements):
-    """Modifies a template file with the given parameters"""
-    with open(template_file, "r") as f_in, open(output_file, "w") as f_out:
+    if os.path.exists(full_path):
+        clear_run_outputs(full_path)
+    os.makedirs(full_path, exist_ok=True)
+    if run_key is not None:
+        with open(os.path.join(full_path, "run_key.txt"), "w") as f:
+            f.write(run_key + "\n")
+    return full_path
+
+def render_template(template_file, replacements):
+    """Returns the text of a template file with the replacements applied."""
+    rendered = []
+    with open(template_file, "r") as f_in:
         for line in f_in:
             modified_line = line
             for key, value in replacements.items():
                 if key in modified_line:
                     modified_line = modified_line.replace(key, str(value))
-            f_out.write(modified_line)
-
-def analyze_viper_output(stdout, stderr):
-    """Analyzes the output from viper.exe and returns a summary if it crashed."""
-    crash_indicators = [
-        r"Huge value .* at index \d+ of \d+",
-        r"\*\*\*\*\* Proc 0: Divergence in .* field\. \*\*\*\*\*",
-        r"\*\*\*\*\* Viper terminating .* \*\*\*\*\*"
-    ]
-    
-    crash_summary = []
-    for line in stdout.split('\n') + stderr.split('\n'):
-        for indicator in crash_indicators:
-            if re.search(indicator, line):
-                crash_summary.append(line.strip())
-    
-    if crash_summary:
-        return "\n".join(crash_summary)
+            rendered.append(modified_line)
+    return "".join(rendered)
+
+def modify_file(template_file, parameters, output_file, replacements):
+    """Modifies a template file with the given parameters"""
+    with open(output_file, "w") as f_out:
+        f_out.write(render_template(template_file, replacements))
+
+crash_indicators = [re.compile(pattern) for pattern in (
+    r"Huge value .* at index \d+ of \d+",
+    r"\*\*\*\*\* Proc 0: Divergence in .* field\. \*\*\*\*\*",
+    r"\*\*\*\*\* Viper terminating .* \*\*\*\*\*"
+)]
+
+# Huge values and divergence are how an unstable time step shows up, so a run stopped
+# on one of them is retried with a smaller dt just like Viper's own advice.
+timestep_indicators = ["try a smaller time step", "huge value", "divergence in"]
+
+# Number of trailing output lines kept in memory for crash_summary.txt
+output_tail_lines = 50
+# How often a running job checks whether it has been cancelled (its queue task was reclaimed)
+cancel_poll_seconds = 5
+
+def match_crash_indicator(line):
+    """Returns True if a line of Viper output reports a crash."""
+    return any(indicator.search(line) for indicator in crash_indicators)
+
+def is_timestep_failure(crash_summary):
+    """Checks whether a crash summary should be retried with a smaller time step."""
+    summary = crash_summary.lower()
+    return any(indicator in summary for indicator in timestep_indicators)
+
+def stop_process(process, timeout=10):
+    """Terminates a process, killing it if it does not exit within the timeout."""
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def monitor_viper_output(process):
+    """Reads Viper's output line by line and stops the process on the first crash indicator.
+
+    Only the last few lines are kept, so memory use does not grow with the length of the run.
+    Returns the crash summary, or None if the run finished cleanly.
+    """
+    tail = collections.deque(maxlen=output_tail_lines)
+    for line in process.stdout:
+        tail.append(line.rstrip())
+        if match_crash_indicator(line):
+            stop_process(process)
+            return "\n".join([line.strip(), "", "Last output before the run was stopped:"] + list(tail))
+    process.wait()
     return None
 
-def run_viper(directory, macro_file, viper_path):
-    """Runs viper.exe with the given macro file in the specified directory."""
+def stop_when_cancelled(process, cancel):
+    """Stops a process once the cancel event is set. Returns when the process exits on its own."""
+    while not cancel.wait(cancel_poll_seconds):
+        if process.poll() is not None:
+            return
+    stop_process(process)
+
+def write_crash_summary(directory, macro_file, crash_summary):
+    """Writes crash_summary.txt into the run directory."""
+    with open(os.path.join(directory, "crash_summary.txt"), "w") as f:
+        f.write(f"Crash while running {macro_file}\n\n{crash_summary}\n")
+
+def run_viper(directory, macro_file, viper_path, threads=None, cancel=None):
+    """Runs viper.exe with the given macro file in the specified directory.
+
+    Setting the cancel event stops the job; nothing is then written to the directory.
+    """
     macro_path = os.path.join(directory, macro_file)
     
     if not check_file_exists(viper_path) or not check_file_exists(macro_path):
         return None, "Error: Required files not found"
     
-    original_dir = os.getcwd()
-    os.chdir(directory)
-    with open(macro_file, 'r') as macro_input:
+    # Run inside the directory via cwd rather than os.chdir so several runs can share the process
+    env = os.environ.copy()
+    if threads:
+        env["OMP_NUM_THREADS"] = str(threads)  # libiomp5md.dll sizes its thread pool from this
+
+    process = None
+    with open(macro_path, 'r') as macro_input:
         try:
-            process = subprocess.Popen([viper_path], stdin=macro_input, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            stdout, stderr = process.communicate()
-            crash_summary = analyze_viper_output(stdout, stderr)
+            # stderr is merged into stdout so a single reader sees every line as it is printed
+            process = subprocess.Popen([viper_path], stdin=macro_input, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, cwd=directory, env=env)
+            if cancel is not None:
+                threading.Thread(target=stop_when_cancelled, args=(process, cancel), daemon=True).start()
+            crash_summary = monitor_viper_output(process)
         except Exception as e:
             crash_summary = f"Error running Viper: {str(e)}"
-        finally:
-            os.chdir(original_dir)
-    
+            if process is not None:
+                stop_process(process)
+
+    if cancel is not None and cancel.is_set():
+        # The directory may already belong to the worker that took the run over
+        return process, "Stopped: the run was cancelled"
+    if crash_summary:
+        write_crash_summary(directory, macro_file, crash_summary)
+
     return process, crash_summary
 
-def calculate_loops(dt, end_time):
-    """Calculate the number of loops needed to reach the end time."""
-    return math.ceil(end_time / (dt * 10))
+def calculate_loops(dt, end_time, step_count):
+    """Calculate the number of outer loops needed to reach the end time.
 
-def modify_macro_txt(template_file, parameters, output_file, dt):
-    """Modifies the macro.txt template with the given parameters."""
+    Each outer loop of macro.txt runs rows_per_checkpoint inner loops of step_count steps.
+    """
+    return math.ceil(end_time / (dt * rows_per_checkpoint * int(step_count)))
+
+def get_end_time(parameters):
+    """Returns the End time of a run, or None when it runs to its convergence criteria."""
+    if (parameters.get('Convergence criteria') or '').strip():
+        return None
+    value = parameters.get('End time') or parameters.get('End Time') or ''  # parameters.csv uses 'End Time'
+    return float(value) if value.strip() else None
+
+def macro_replacements(parameters, dt, restart_time=None, loops=None):
+    """Returns the macro.txt replacements for the given parameters.
+
+    With a restart_time the macro loads save.dat and only integrates the remaining time.
+    loops sets the number of outer loops of an End time run instead, for one of its segments.
+    """
     replacements = {
         "DT": dt,
         "STEP_COUNT": "10" if parameters.get('Verbose', 'y').lower() == 'y' else "500"
     }
     
-    if 'Convergence criteria' in parameters:
+    end_time = get_end_time(parameters)
+    if end_time is None:
         replacements["CRIT"] = parameters['Convergence criteria']
         replacements["LOOP_COUNT"] = max_iterations  # Arbitrarily large for convergence criteria
-    elif 'End time' in parameters:
-        end_time = float(parameters['End time'])
-        loops = calculate_loops(dt, end_time)
+    else:
+        if loops is None:
+            loops = calculate_loops(dt, max(end_time - (restart_time or 0.0), 0.0), replacements["STEP_COUNT"])
         replacements["CRIT"] = "0"  # Disable convergence criteria
         replacements["LOOP_COUNT"] = str(loops)
-    
-    modify_file(template_file, parameters, output_file, replacements)
+
+    if restart_time is not None:
+        replacements[f"# load -f {checkpoint_file}"] = f"load -f {checkpoint_file}"
+    return replacements
+
+def modify_macro_txt(template_file, parameters, output_file, dt, restart_time=None, loops=None):
+    """Modifies the macro.txt template with the given parameters."""
+    modify_file(template_file, parameters, output_file, macro_replacements(parameters, dt, restart_time, loops))
+
+def render_run_inputs(base_dir, parameters, dt, restart_time=None):
+    """Renders viper.cfg and the two macros for a run, as (output file name, text) pairs."""
+    return [
+        ("viper.cfg", render_template(os.path.join(base_dir, "viper.cfg"), {
+            "REYNOLDS": parameters['Reynolds number'],
+            "MESH": parameters['mesh_file'],
+            "ORDER": parameters['Polynomial order'],
+            "AMP": parameters['Control amplitude'],
+            "FREQ": parameters['Control frequency'],
+            "BAL": parameters['Control up-down balance'],
+        })),
+        (f"macro{parameters['Index']}.txt", render_template(os.path.join(base_dir, "macro.txt"), macro_replacements(parameters, dt, restart_time))),
+        (f"macro_animation{parameters['Index']}.txt", render_template(os.path.join(base_dir, "macro_animation.txt"), {
+            "DT": dt,
+            "LOOPS": parameters['Animation loops']
+        })),
+    ]
+
+def mesh_file_name(parameters):
+    return f"fluidic_amplifier_res_{parameters['mesh_file']}.msh"
+
+def get_run_key(run_cache, base_dir, parameters):
+    """Returns the cache key of a row at its requested time step, or None if its mesh is missing."""
+    mesh_path = os.path.join(base_dir, mesh_file_name(parameters))
+    if run_cache is None or not check_file_exists(mesh_path):
+        return None
+    rendered_inputs = render_run_inputs(base_dir, parameters, float(parameters['Time step']))
+    return run_cache.run_key([text for _, text in rendered_inputs], mesh_path)
+
+def link_cached_run(base_dir, parameters, index, cached):
+    """Serves a row from an identical completed run by linking its directory under this row's name."""
+    link_path = os.path.join(base_dir, run_directory_name(parameters, index, cached["dt"]))
+    if os.path.lexists(link_path):
+        print(f"Skipping index {index + 1} - results already present in '{os.path.basename(link_path)}'.")
+        return link_path
+    try:
+        os.symlink(cached["directory"], link_path, target_is_directory=True)
+        print(f"Index {index + 1} matches completed run {cached['index'] + 1}, linked '{os.path.basename(link_path)}' to its results.")
+    except OSError as e:
+        print(f"Index {index + 1} matches completed run {cached['index'] + 1} in '{cached['directory']}' (could not link: {e}).")
+        return cached["directory"]
+    return link_path
+
+def make_steady_state_watcher(directory, parameters):
+    """Returns a watcher for the periodic steady state of an End time run, or None if not applicable."""
+    frequency = float(parameters['Control frequency'] or 0)
+    if steady_state_periods <= 0 or frequency <= 0 or get_end_time(parameters) is None:
+        return None
+    period = 2 * math.pi / frequency  # The control jets are forced with cos(omega*t)
+    return SteadyStateWatcher(directory, period, steady_state_tolerance, steady_state_periods)
+
+def run_static_simulation(base_dir, directory, parameters, dt, viper_path, threads=None, restart_time=None, cancel=None):
+    """Runs the static macro of a run. Returns the crash summary (None if it finished) and the convergence time.
+
+    End time runs with a control frequency run in segments of steady_state_segment_loops
+    outer loops, each resuming from the last one's checkpoint, and end after the segment in
+    which they reach a periodic steady state (the convergence time is None if they do not).
+    """
+    macro_file = f"macro{parameters['Index']}.txt"
+    watcher = make_steady_state_watcher(directory, parameters)
+    if watcher is None:
+        _, crash_summary = run_viper(directory, macro_file, viper_path, threads, cancel)
+        return crash_summary, None
+
+    replacements = macro_replacements(parameters, dt, restart_time)
+    total_loops, step_count = int(replacements["LOOP_COUNT"]), int(replacements["STEP_COUNT"])
+    loops_done = 0
+    while loops_done < total_loops:
+        loops = min(steady_state_segment_loops, total_loops - loops_done)
+        # Later segments load the checkpoint the one before saved at its end
+        segment_start = restart_time if not loops_done else (restart_time or 0.0) + loops_done * dt * rows_per_checkpoint * step_count
+        modify_macro_txt(os.path.join(base_dir, "macro.txt"), parameters, os.path.join(directory, macro_file), dt, segment_start, loops)
+        _, crash_summary = run_viper(directory, macro_file, viper_path, threads, cancel)
+        if crash_summary:
+            return crash_summary, None
+        loops_done += loops
+        converged_time = watcher.poll()
+        if converged_time is not None:
+            watcher.record(converged_time)
+            return None, converged_time
+    return None, None
+
+def stage_restart(previous_directory, directory):
+    """Copies the last checkpoint of a failed run into a new run directory.
+
+    The monitor .dat files are copied up to the row written at the checkpoint, so the
+    restarted run appends to a continuous record. Returns the checkpoint time, or None
+    if the failed run never saved.
+    """
+    if previous_directory is None or not check_file_exists(os.path.join(previous_directory, checkpoint_file)):
+        return None
+
+    with open(os.path.join(previous_directory, monitor_files[0]), 'r') as f:
+        rows = [line for line in f if line.strip()][1:]
+    saved_rows = (len(rows) // rows_per_checkpoint) * rows_per_checkpoint
+    if saved_rows == 0:
+        return None
+    restart_time = float(rows[saved_rows - 1].split()[0])
+
+    for monitor_file in monitor_files:
+        source = os.path.join(previous_directory, monitor_file)
+        if not check_file_exists(source):
+            continue
+        with open(source, 'r') as f_in, open(os.path.join(directory, monitor_file), 'w') as f_out:
+            for line_number, line in enumerate(f_in):
+                if line_number > saved_rows:  # Header plus the rows up to the checkpoint
+                    break
+                f_out.write(line)
+    shutil.copy(os.path.join(previous_directory, checkpoint_file), os.path.join(directory, checkpoint_file))
+
+    with open(os.path.join(directory, "restart.txt"), 'w') as f:
+        f.write(f"Restarted from {os.path.basename(previous_directory)} at t = {restart_time}\n")
+    return restart_time
+
+class CoreBudget:
+    """Hands out cores from a fixed pool, blocking until enough are free."""
+
+    def __init__(self, total_cores):
+        self.total_cores = max(1, int(total_cores))
+        self.free_cores = self.total_cores
+        self.condition = threading.Condition()
+
+    def acquire(self, cores):
+        """Blocks until `cores` are available and reserves them. Returns the number reserved."""
+        cores = min(max(1, int(cores)), self.total_cores)
+        with self.condition:
+            while self.free_cores < cores:
+                self.condition.wait()
+            self.free_cores -= cores
+        return cores
+
+    def release(self, cores):
+        with self.condition:
+            self.free_cores += cores
+            self.condition.notify_all()
+
+def get_run_threads(parameters, default_threads):
+    """Returns the OpenMP thread budget for a run, taken from an optional 'Threads' column."""
+    value = (parameters.get('Threads') or '').strip()
+    if value:
+        try:
+            return max(1, int(float(value)))
+        except ValueError:
+            print(f"Warning: invalid Threads value '{value}' for index {parameters.get('Index')}, using {default_threads}.")
+    return default_threads
+
+def run_parameter_set(index, row, original_directory, viper_path, threads=None, run_cache=None, input_store=None, ledger=None, cancel=None):
+    """Runs one parameters.csv row, including the time step reduction retries and the animation run.
+
+    Setting the cancel event stops the row's Viper job and leaves the ledger, cache and
+    run directory to whoever took the row over. Returns how the row ended: "completed",
+    "crashed", "cancelled", "cached" or "exists".
+    """
+    print(f"\nProcessing index {index + 1}")
+
+    dt = float(row['Time step'])
+    dt_reduction_count = 0
+    previous_directory = None
+    start_time = time.time()
+
+    run_key = get_run_key(run_cache, original_directory, row)
+    if run_key is not None and row['Override'] != 'y':
+        cached = run_cache.lookup(run_key)
+        if cached is not None:
+            link_path = link_cached_run(original_directory, row, index, cached)
+            if ledger is not None and not ledger.runs(run_index=index + 1):
+                ledger.record_skipped(index + 1, row, link_path, "cached")
+            return "cached"
+
+    while dt_reduction_count <= max_dt_reductions:
+        directory = create_run_directory(original_directory, row, index, dt, run_key)
+        if directory is None:
+            if ledger is not None and dt_reduction_count == 0 and not ledger.runs(run_index=index + 1):
+                ledger.record_skipped(index + 1, row, os.path.join(original_directory, run_directory_name(row, index, dt)), "exists")
+            return "exists"
+
+        if ledger is not None:
+            if dt_reduction_count == 0:
+                ledger.start_run(index + 1, row, directory, dt)
+            else:
+                ledger.update(index + 1, directory=directory, time_step=dt, dt_retries=dt_reduction_count)
+
+        restart_time = stage_restart(previous_directory, directory) if restart_from_checkpoint else None
+        if restart_time is not None:
+            print(f"Restarting index {index + 1} from the checkpoint at t = {restart_time}")
+        for file_name, text in render_run_inputs(original_directory, row, dt, restart_time):
+            with open(os.path.join(directory, file_name), "w") as f:
+                f.write(text)
+
+        mesh_file = mesh_file_name(row)
+        mesh_path = os.path.join(original_directory, mesh_file)
+        if check_file_exists(mesh_path):
+            if input_store is not None:
+                input_store.place(mesh_path, os.path.join(directory, mesh_file))
+            else:
+                shutil.copy(mesh_path, os.path.join(directory, mesh_file))
+        else:
+            print(f"Error: Mesh file {mesh_file} not found. Skipping this simulation.")
+            if ledger is not None:
+                ledger.finish_run(index + 1, "crashed", crash_summary=f"Mesh file {mesh_file} not found", wall_time=time.time() - start_time)
+            return "crashed"
+
+        print(f"Running static simulation for index {index + 1} with macro{row['Index']}.txt")
+        crash_summary, converged_time = run_static_simulation(original_directory, directory, row, dt, viper_path, threads, restart_time, cancel)
+        if cancel is not None and cancel.is_set():
+            print(f"Stopped index {index + 1}, another worker has taken it over.")
+            return "cancelled"
+        if crash_summary:
+            if is_timestep_failure(crash_summary):
+                if dt_reduction_count < max_dt_reductions:
+                    dt /= 2
+                    dt_reduction_count += 1
+                    previous_directory = directory
+                    print(f"Reducing time step to {dt} and retrying.")
+                    continue
+                else:
+                    print(f"Maximum number of time step reductions reached. Moving to next parameter set.")
+            else:
+                print(f"Simulation crashed. See crash_summary.txt in the output directory for details.")
+            if ledger is not None:
+                ledger.finish_run(index + 1, "crashed", directory, dt, dt_reduction_count, crash_summary, time.time() - start_time)
+            return "crashed"
+
+        if converged_time is not None:
+            print(f"Index {index + 1} reached a periodic steady state at t = {converged_time:.6g}, stopped early.")
+
+        if run_key is not None:
+            run_cache.record(run_key, directory, index, dt)
+
+        print(f"Running animation simulation for index {index + 1} with macro_animation{row['Index']}.txt")
+        animation_process, animation_crash_summary = run_viper(directory, f"macro_animation{row['Index']}.txt", viper_path, threads, cancel)
+        if cancel is not None and cancel.is_set():
+            print(f"Stopped the animation of index {index + 1}, another worker has taken it over.")
+            return "cancelled"
+        if animation_crash_summary:
+            print(f"Animation crashed. See crash_summary.txt in the output directory for details.")
+
+        if ledger is not None:
+            ledger.finish_run(index + 1, "completed", directory, dt, dt_reduction_count, animation_crash_summary, time.time() - start_time)
+        return "completed"
+
+def run_scheduled(rows, original_directory, viper_path, parallel_runs, total_cores, default_threads, run_cache=None, input_store=None, ledger=None):
+    """Runs up to `parallel_runs` parameter sets at once without exceeding `total_cores`.
+
+    Rows are pulled from the iterable only as slots free up, so it is never materialised.
+    """
+    budget = CoreBudget(total_cores)
+    default_threads = default_threads or max(1, budget.total_cores // parallel_runs)
+
+    def worker(index, row):
+        cores = budget.acquire(get_run_threads(row, default_threads))
+        try:
+            run_parameter_set(index, row, original_directory, viper_path, cores, run_cache, input_store, ledger)
+        except Exception as e:
+            print(f"Error processing index {index + 1}: {e}")
+        finally:
+            budget.release(cores)
+
+    with ThreadPoolExecutor(max_workers=parallel_runs) as executor:
+        pending = set()
+        for index, row in rows:
+            if len(pending) >= parallel_runs:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending.add(executor.submit(worker, index, row))
+        wait(pending)
+
+def run_queue_worker(queue, original_directory, viper_path, parallel_runs, total_cores, default_threads, run_cache=None, input_store=None, ledger=None):
+    """Runs tasks from a shared work queue on `parallel_runs` threads until the queue is empty."""
+    budget = CoreBudget(total_cores)
+    default_threads = default_threads or max(1, budget.total_cores // parallel_runs)
+
+    def handle_task(index, row, reclaimed, lost):
+        if reclaimed:
+            print(f"Index {index + 1} was left unfinished by another worker, running it again.")
+            row = dict(row, Override='y')
+        cores = budget.acquire(get_run_threads(row, default_threads))
+        try:
+            return run_parameter_set(index, row, original_directory, viper_path, cores, run_cache, input_store, ledger, lost) not in ("crashed", "cancelled")
+        finally:
+            budget.release(cores)
+
+    with ThreadPoolExecutor(max_workers=parallel_runs) as executor:
+        for future in [executor.submit(run_worker, queue, handle_task) for _ in range(parallel_runs)]:
+            future.result()
+
+def plan_runs(rows, original_directory, run_cache):
+    """Prints what each row would do on a real pass: run, reuse a cached result, or be skipped."""
+    counts = collections.Counter()
+    for index, row in rows:
+        run_key = get_run_key(run_cache, original_directory, row)
+        if run_key is not None and row['Override'] != 'y' and run_cache.lookup(run_key) is not None:
+            action = "cached"
+        elif row['Override'] != 'y' and os.path.exists(os.path.join(original_directory, run_directory_name(row, index, float(row['Time step'])))):
+            action = "exists"
+        else:
+            action = "run"
+        counts[action] += 1
+        print(f"Index {index + 1}: {action}")
+    if run_cache is not None:
+        run_cache.save()  # Keep the mesh checksums so the next plan is quicker
+    print(f"\n{counts['run']} to run, {counts['cached']} served from cache, {counts['exists']} already present.")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run the Viper simulations listed in parameters.csv.")
+    parser.add_argument("parameters", nargs="?", default=parameters_file, help="parameters.csv or a JSON sweep spec")
+    parser.add_argument("-j", "--jobs", type=int, default=max_parallel_runs, help="number of Viper runs to execute at once")
+    parser.add_argument("--max-cores", type=int, default=max_total_cores, help="total cores shared by all concurrent runs")
+    parser.add_argument("--threads-per-run", type=int, default=threads_per_run, help="default OpenMP threads per run")
+    parser.add_argument("--full-retries", action="store_true", help="rerun time step retries from t=0 instead of the last checkpoint")
+    parser.add_argument("--steady-periods", type=int, default=steady_state_periods, help="converged periods before an End time run is stopped early (0 to disable)")
+    parser.add_argument("--no-cache", action="store_true", help="do not reuse completed runs with identical inputs")
+    parser.add_argument("--copy-inputs", action="store_true", help="copy meshes into each run directory instead of linking them from the input store")
+    parser.add_argument("--plan", action="store_true", help="report which rows would run or be served from the cache, without running anything")
+    parser.add_argument("--enqueue", action="store_true", help="add the rows to the shared work queue instead of running them")
+    parser.add_argument("--worker", action="store_true", help="run rows from the shared work queue until it is empty")
+    parser.add_argument("--queue-status", action="store_true", help="print the number of tasks in each state of the work queue")
+    parser.add_argument("--queue", default=queue_dir, help="work queue directory, on a filesystem shared by every worker host")
+    parser.add_argument("--lease", type=float, default=lease_seconds, help="seconds without a heartbeat before a worker's task is given to another")
+    return parser.parse_args()
 
 # --- Main Script ---
 
 if __name__ == "__main__":
+    args = parse_arguments()
+    restart_from_checkpoint = restart_from_checkpoint and not args.full_retries
+    steady_state_periods = args.steady_periods
     original_directory = os.getcwd()
     viper_path = os.path.join(original_directory, viper_exe)
 
-    required_files = [viper_exe, libiomp5md_dll, parameters_file, "viper.cfg", "macro.txt", "macro_animation.txt"]
+    if args.enqueue or args.queue_status:
+        queue = WorkQueue(os.path.join(original_directory, args.queue), args.lease)
+        if args.enqueue:
+            added = queue.enqueue(iter_parameter_rows(args.parameters))
+            print(f"Added {added} tasks to {args.queue}.")
+        print_status(queue)
+        sys.exit(0)
+
+    required_files = [viper_exe, libiomp5md_dll, "viper.cfg", "macro.txt", "macro_animation.txt"]
+    if not args.worker:
+        required_files.append(args.parameters)
     for file in required_files:
         if not check_file_exists(file):
             print(f"Error: {file} not found in the current directory.")
             sys.exit(1)
 
-    with open(parameters_file, "r") as f:
-        reader = csv.DictReader(f)
-        next(reader) # Skip the description row
-
-        for index, row in enumerate(reader):
-            print(f"\nProcessing index {index + 1}")
-            
-            dt = float(row['Time step'])
-            dt_reduction_count = 0
-            
-            while dt_reduction_count <= max_dt_reductions:
-                directory = create_run_directory(original_directory, row, index, dt)
-                if directory is None:
-                    break
+    run_cache = None if args.no_cache else RunCache(os.path.join(original_directory, cache_manifest_file))
+    input_store = None
+    if not args.copy_inputs:
+        input_store = InputStore(os.path.join(original_directory, input_store_dir), run_cache.file_digest if run_cache else None)
 
-                modify_file(os.path.join(original_directory, "viper.cfg"), row, os.path.join(directory, "viper.cfg"), {
-                    "REYNOLDS": row['Reynolds number'],
-                    "MESH": row['mesh_file'],
-                    "ORDER": row['Polynomial order'],
-                    "AMP": row['Control amplitude'],
-                    "FREQ": row['Control frequency'],
-                    "BAL": row['Control up-down balance'],
-                })
-
-                modify_macro_txt(os.path.join(original_directory, "macro.txt"), row, os.path.join(directory, f"macro{row['Index']}.txt"), dt)
-
-                modify_file(os.path.join(original_directory, "macro_animation.txt"), row, os.path.join(directory, f"macro_animation{row['Index']}.txt"), {
-                    "DT": dt,
-                    "LOOPS": row['Animation loops']
-                })
-
-                mesh_file = f"fluidic_amplifier_res_{row['mesh_file']}.msh"
-                mesh_path = os.path.join(original_directory, mesh_file)
-                if check_file_exists(mesh_path):
-                    shutil.copy(mesh_path, os.path.join(directory, mesh_file))
-                else:
-                    print(f"Error: Mesh file {mesh_file} not found. Skipping this simulation.")
-                    break
+    # Workers on several hosts share the ledger over the network filesystem, where WAL is unsafe
+    ledger = RunLedger(os.path.join(original_directory, ledger_file), wal=not args.worker)
+
+    if args.worker:
+        queue = WorkQueue(os.path.join(original_directory, args.queue), args.lease)
+        run_queue_worker(queue, original_directory, viper_path, args.jobs, args.max_cores, args.threads_per_run, run_cache, input_store, ledger)
+        print_status(queue)
+        print("\nWork queue finished.")
+        sys.exit(0)
 
-                print(f"Running static simulation for index {index + 1} with macro{row['Index']}.txt")
-                process, crash_summary = run_viper(directory, f"macro{row['Index']}.txt", viper_path)
-                if crash_summary:
-                    if "try a smaller time step" in crash_summary.lower():
-                        if dt_reduction_count < max_dt_reductions:
-                            dt /= 2
-                            dt_reduction_count += 1
-                            print(f"Reducing time step to {dt} and retrying.")
-                            continue
-                        else:
-                            print(f"Maximum number of time step reductions reached. Moving to next parameter set.")
-                            break
-                    else:
-                        print(f"Simulation crashed. See crash_summary.txt in the output directory for details.")
-                        break
-                
-                print(f"Running animation simulation for index {index + 1} with macro_animation{row['Index']}.txt")
-                animation_process, animation_crash_summary = run_viper(directory, f"macro_animation{row['Index']}.txt", viper_path)
-                if animation_crash_summary:
-                    print(f"Animation crashed. See crash_summary.txt in the output directory for details.")
-
-                break
+    rows = iter_parameter_rows(args.parameters)
+    if args.plan:
+        plan_runs(rows, original_directory, run_cache)
+        sys.exit(0)
+    elif args.jobs > 1:
+        run_scheduled(rows, original_directory, viper_path, args.jobs, args.max_cores, args.threads_per_run, run_cache, input_store, ledger)
+    else:
+        for index, row in rows:
+            run_parameter_set(index, row, original_directory, viper_path, get_run_threads(row, args.threads_per_run), run_cache, input_store, ledger)
 
     print("\nAll simulations completed.")
\ No newline at end of file
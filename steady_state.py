@@ -0,0 +1,178 @@
+import bisect
+import os
+
+# Written into the run directory when a run is stopped at its periodic steady state
+steady_state_file = "steady_state.txt"
+
+# Monitor channels compared cycle to cycle, as (file, column)
+steady_state_channels = [
+    ("int_KE.dat", "integral"),
+    ("flow_outlet_upper.dat", "user_specified_function"),
+    ("flow_outlet_lower.dat", "user_specified_function"),
+]
+
+class DatTail:
+    """Reads the rows appended to a Viper .dat monitor file since the last call."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.columns = None
+        self.partial = b""
+
+    def read_rows(self):
+        """Returns the complete rows written since the last call as lists of floats."""
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+            self.offset = f.tell()
+
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()  # Viper may be part way through writing the last line
+        rows = []
+        for line in lines:
+            words = line.split()
+            if not words:
+                continue
+            if self.columns is None:
+                self.columns = [word.decode() for word in words]
+                continue
+            try:
+                rows.append([float(word) for word in words])
+            except ValueError:
+                continue
+        return rows
+
+def resample(samples, start, period, points):
+    """Interpolates (t, value) samples onto `points` evenly spaced phases of one period.
+
+    Each phase is interpolated with the cubic through the two samples either side of it,
+    whose error at the ~30 samples per period Viper writes is well below the tolerance
+    (linear interpolation alone differs by several 1e-3 of the range from one period to
+    the next, as the samples fall at other phases). The samples should reach a little past
+    both ends of the period.
+    """
+    times = [t for t, _ in samples]
+    values = [value for _, value in samples]
+    resampled = []
+    for k in range(points):
+        t = start + period * k / points
+        i = min(max(bisect.bisect_left(times, t) - 2, 0), len(times) - 4)
+        value = 0.0
+        for j in range(i, i + 4):
+            weight = 1.0
+            for m in range(i, i + 4):
+                if m != j:
+                    weight *= (t - times[m]) / (times[j] - times[m])
+            value += weight * values[j]
+        resampled.append(value)
+    return resampled
+
+class PeriodicConvergenceDetector:
+    """Detects when a signal repeats itself from one forcing period to the next.
+
+    Each completed period is resampled onto a common phase grid and compared with the
+    one before it. The change is the largest point-wise difference relative to the
+    signal's range over the period. Once `required_periods` consecutive periods change
+    by less than `tolerance`, the signal is converged, and `converged_time` is the start
+    of the first period in that run.
+    """
+
+    min_samples_per_period = 8
+
+    def __init__(self, period, tolerance, required_periods, phase_points=64):
+        self.period = period
+        self.tolerance = tolerance
+        self.required_periods = required_periods
+        self.phase_points = phase_points
+        self.period_start = None
+        self.samples = []  # The current period, with two samples either side once it closes
+        self.previous = None  # (start, resampled values) of the last period
+        self.converged_count = 0
+        self.converged_since = None
+        self.converged_time = None
+
+    def add(self, t, value):
+        """Adds a sample and returns True once the signal has converged."""
+        if self.period_start is None:
+            self.period_start = t
+        self.samples.append((t, value))
+        while t >= self.period_start + self.period:
+            self.close_period()
+            self.period_start += self.period
+        return self.converged_time is not None
+
+    def close_period(self):
+        end = self.period_start + self.period
+        times = [t for t, _ in self.samples]
+        first, last = bisect.bisect_left(times, self.period_start), bisect.bisect_left(times, end)
+        current = None
+        if last - first >= self.min_samples_per_period:
+            current = (self.period_start, resample(self.samples[max(first - 2, 0):last + 2], self.period_start, self.period, self.phase_points))
+        if self.previous is not None and current is not None:
+            previous_values, current_values = self.previous[1], current[1]
+            scale = max(previous_values) - min(previous_values) + 1e-6 * abs(sum(previous_values) / len(previous_values)) + 1e-30
+            change = max(abs(a - b) for a, b in zip(previous_values, current_values)) / scale
+            if change < self.tolerance:
+                if self.converged_count == 0:
+                    self.converged_since = self.previous[0]
+                self.converged_count += 1
+                if self.converged_count >= self.required_periods and self.converged_time is None:
+                    self.converged_time = self.converged_since
+            else:
+                self.converged_count = 0
+        else:
+            self.converged_count = 0
+        self.previous = current
+        del self.samples[:max(last - 2, 0)]  # Keep two samples before the next period for its interpolation
+
+class SteadyStateWatcher:
+    """Follows a run's monitor files and tells when every channel is periodic.
+
+    The runner polls it between the segments of an End time run (each a Viper job that
+    resumes from the last one's save.dat), so a converged run is ended between jobs rather
+    than killed part way through writing its files. The convergence time is written to
+    steady_state.txt, which the analysis scripts use as the start of their statistics window.
+    """
+
+    def __init__(self, directory, period, tolerance, required_periods):
+        self.directory = directory
+        self.period = period
+        self.required_periods = required_periods
+        self.channels = [(DatTail(os.path.join(directory, file_name)), column, PeriodicConvergenceDetector(period, tolerance, required_periods))
+                         for file_name, column in steady_state_channels]
+        self.converged_time = None
+
+    def poll(self):
+        """Feeds new rows to the detectors and returns the convergence time once all have converged."""
+        for tail, column, detector in self.channels:
+            rows = tail.read_rows()
+            if tail.columns is None or column not in tail.columns:
+                continue
+            column_index = tail.columns.index(column)
+            for row in rows:
+                detector.add(row[0], row[column_index])
+        if all(detector.converged_time is not None for _, _, detector in self.channels):
+            return max(detector.converged_time for _, _, detector in self.channels)
+        return None
+
+    def record(self, converged_time):
+        """Writes the convergence time to steady_state.txt."""
+        self.converged_time = converged_time
+        with open(os.path.join(self.directory, steady_state_file), "w") as f:
+            f.write(f"Converged at t = {converged_time!r}\n")
+            f.write(f"Period = {self.period!r}\n")
+            f.write(f"Periods compared = {self.required_periods}\n")
+
+def read_steady_state_time(directory="."):
+    """Returns the time a run reached its periodic steady state, or None if it was not stopped early."""
+    path = os.path.join(directory, steady_state_file)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("Converged at t ="):
+                return float(line.split("=", 1)[1])
+    return None
@@ -0,0 +1,180 @@
+import math
+import warnings
+
+import numpy as np
+
+# Statistics of long series in bounded memory. The mean, standard deviation, minimum and
+# maximum come from exact running moments. The median and quartiles come from a
+# mergeable quantile sketch whose rank error is tracked as it compacts, so every result
+# states how far its ranks can be from exact. Both parts combine across chunks, blocks
+# or runs without revisiting the data, and NaNs are ignored throughout.
+
+sketch_capacity = 8192  # Values kept per sketch level; series up to this length are exact
+chunk_rows = 65536  # Rows fed to the accumulators at a time when describing an array
+
+def summarise(blocks):
+    """Returns the moments (count, mean, M2, min, max) of each row of a 2-D array, ignoring NaNs."""
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=1)
+    mean = np.where(valid, blocks, 0.0).sum(axis=1) / np.maximum(count, 1)
+    m2 = (np.where(valid, blocks - mean[:, None], 0.0) ** 2).sum(axis=1)
+    minimum = np.where(valid, blocks, np.inf).min(axis=1)
+    maximum = np.where(valid, blocks, -np.inf).max(axis=1)
+    return np.column_stack([count, mean, m2, minimum, maximum])
+
+def combine(summaries):
+    """Combines rows of moments with Chan's parallel update. Returns (count, mean, M2, min, max)."""
+    count = summaries[:, 0]
+    total = count.sum()
+    if total == 0:
+        return 0, math.nan, math.nan, math.nan, math.nan
+    mean = (count * summaries[:, 1]).sum() / total
+    m2 = summaries[:, 2].sum() + (count * (summaries[:, 1] - mean) ** 2).sum()
+    return total, mean, m2, summaries[:, 3].min(), summaries[:, 4].max()
+
+class QuantileSketch:
+    """Deterministic mergeable quantile sketch with a tracked rank error bound.
+
+    Values enter level 0, where each stands for one value; a value at level h stands for
+    2**h. When a level holds more than `capacity` values it is sorted and every other
+    value moves up a level, alternating which half is kept. One such compaction moves
+    the estimated rank of any value by at most 2**h, so rank_error, the sum of these over
+    every compaction, bounds the rank error of any quantile. A sketch that has never
+    compacted is exact.
+    """
+
+    def __init__(self, capacity=sketch_capacity):
+        self.capacity = capacity
+        self.levels = [np.empty(0)]
+        self.offsets = [0]
+        self.count = 0
+        self.rank_error = 0
+
+    def add_levels(self, levels):
+        for h, values in enumerate(levels):
+            while h >= len(self.levels):
+                self.levels.append(np.empty(0))
+                self.offsets.append(0)
+            if len(values):
+                self.levels[h] = np.concatenate([self.levels[h], values])
+                self.count += len(values) << h
+        self.compress()
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.add_levels([values[~np.isnan(values)]])
+
+    def merge(self, other):
+        self.rank_error += other.rank_error
+        self.add_levels(other.levels)
+
+    def compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.capacity:
+                values = np.sort(self.levels[h])
+                kept = values[len(values) - len(values) % 2:]  # An odd value out stays at this level
+                promoted = values[self.offsets[h]:len(values) - len(kept):2]
+                self.offsets[h] ^= 1
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                    self.offsets.append(0)
+                self.levels[h] = kept
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.rank_error += 1 << h
+            h += 1
+
+    def quantile(self, q):
+        """Returns the q-quantile (0 <= q <= 1), interpolated like np.percentile while the sketch is exact."""
+        if self.count == 0:
+            return math.nan
+        if self.rank_error == 0:
+            return float(np.percentile(self.levels[0], q * 100))
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 1 << h, dtype=np.int64) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        index = min(int(np.searchsorted(cumulative, q * (self.count - 1), side="right")), len(values) - 1)
+        return float(values[order][index])
+
+    def error_bound(self):
+        """Returns the largest possible rank error of a quantile, as a fraction of the count."""
+        return self.rank_error / self.count if self.count else 0.0
+
+    def to_arrays(self):
+        """Returns the sketch as (values, levels, rank_error), for saving."""
+        values = np.concatenate(self.levels)
+        levels = np.concatenate([np.full(len(level), h, dtype=np.int8) for h, level in enumerate(self.levels)])
+        return values, levels, self.rank_error
+
+    def add_arrays(self, values, levels, rank_error):
+        """Merges in a sketch saved with to_arrays."""
+        self.rank_error += int(rank_error)
+        self.add_levels([values[levels == h] for h in range(int(levels.max()) + 1)] if len(levels) else [])
+
+class StreamingStats:
+    """Running moments and a quantile sketch of one series, fed in chunks."""
+
+    def __init__(self, capacity=sketch_capacity):
+        self.moments = np.array([[0, 0.0, 0.0, np.inf, -np.inf]])
+        self.sketch = QuantileSketch(capacity)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.add_moments(summarise(values[None, :]))
+        self.sketch.update(values)
+
+    def add_moments(self, summaries):
+        self.moments = np.array([combine(np.vstack([self.moments, summaries]))])
+
+    def merge(self, other):
+        self.add_moments(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def result(self):
+        """Returns the statistics written by the analysis scripts, plus the quantile rank error bound."""
+        sketch = self.sketch
+        return statistics(self.moments[0], [sketch.quantile(q) for q in (0.25, 0.5, 0.75)], sketch.error_bound())
+
+def statistics(moments, quartiles, rank_error):
+    """Returns the statistics dict from one row of moments and the 25th, 50th and 75th percentiles."""
+    count, mean, m2, minimum, maximum = moments
+    return {
+        'average': float(mean) if count else math.nan,
+        'median': float(quartiles[1]),
+        'minimum': float(minimum) if count else math.nan,
+        'maximum': float(maximum) if count else math.nan,
+        'std_dev': math.sqrt(m2 / count) if count else math.nan,
+        'percentile_25': float(quartiles[0]),
+        'percentile_75': float(quartiles[2]),
+        'rank_error': rank_error,
+    }
+
+def describe(values):
+    """Returns the statistics of an array, reading it a chunk at a time (e.g. from a memory map)."""
+    stats = StreamingStats()
+    for start in range(0, len(values), chunk_rows):
+        stats.update(values[start:start + chunk_rows])
+    return stats.result()
+
+def describe_rows(rows):
+    """Returns the statistics of each row of a 2-D array, with the same results as describe.
+
+    The moments of every row are computed together. Rows short enough for the sketch to
+    be exact get their quartiles from one np.nanpercentile call; longer rows go through a
+    sketch each.
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    moments = summarise(rows)
+    if rows.shape[1] <= sketch_capacity:
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN rows give NaN quartiles
+            quartiles = np.nanpercentile(rows, [25, 50, 75], axis=1).T
+        return [statistics(row_moments, row_quartiles, 0.0) for row_moments, row_quartiles in zip(moments, quartiles)]
+    results = []
+    for row, row_moments in zip(rows, moments):
+        sketch = QuantileSketch()
+        for start in range(0, len(row), chunk_rows):
+            sketch.update(row[start:start + chunk_rows])
+        results.append(statistics(row_moments, [sketch.quantile(q) for q in (0.25, 0.5, 0.75)], sketch.error_bound()))
+    return results
@@ -0,0 +1,217 @@
+import argparse
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+from analysis_core import run_parameters
+from data_collect import find_results
+from processed_store import channel_names, load_channel, processed_path
+
+# Every analysed run's processed channels, consolidated into one store at the campaign root.
+# Each column (the time, and each field of each channel, e.g. "flowrate.bndry002" or
+# "gain.gain") is an append-only file of float64 values, with every run's rows kept
+# together. An SQLite index holds each run's parameters from its folder name, where its
+# rows start in the column files, and the time range of each chunk of rows. A query
+# selects runs by parameter and chunks by time in SQL, then memory-maps just those rows
+# of just the requested columns.
+
+store_dir = "sweep_store"
+chunk_rows = 65536  # Rows per indexed time range
+
+# Run parameters indexed for filtering, as named by analysis_core.run_parameters
+parameter_columns = ['sim_index', 'reynolds_num', 'mesh', 'poly_order', 'control_amplitude',
+                     'control_frequency', 'control_balance', 'timestep']
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_key TEXT PRIMARY KEY,
+    directory TEXT,
+    sim_index REAL,
+    reynolds_num REAL,
+    mesh TEXT,
+    poly_order REAL,
+    control_amplitude REAL,
+    control_frequency REAL,
+    control_balance REAL,
+    timestep REAL,
+    row_start INTEGER,
+    rows INTEGER,
+    source_mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS run_columns (
+    run_key TEXT,
+    column_name TEXT,
+    PRIMARY KEY (run_key, column_name)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    run_key TEXT,
+    chunk INTEGER,
+    row_start INTEGER,
+    rows INTEGER,
+    t_min REAL,
+    t_max REAL,
+    PRIMARY KEY (run_key, chunk)
+);
+CREATE INDEX IF NOT EXISTS runs_parameters ON runs (reynolds_num, poly_order, control_amplitude, control_frequency);
+"""
+
+def run_columns(output_dir):
+    """Returns the columns of a run's processed data as a dict of name to 1-D array, the time first."""
+    path = processed_path(output_dir)
+    columns = {}
+    for channel in channel_names(path):
+        data = load_channel(path, channel)
+        if data.dtype.names is None:
+            continue  # Saved before the channels had named columns
+        if 't' in data.dtype.names and 't' not in columns:
+            columns['t'] = data['t']
+        for field in data.dtype.names:
+            if field != 't':
+                columns[f'{channel}.{field}'] = data[field]
+    return columns
+
+class SweepStore:
+    """The consolidated time series of a campaign, queried by run parameters and time."""
+
+    def __init__(self, root="."):
+        self.path = os.path.join(root, store_dir)
+        os.makedirs(self.path, exist_ok=True)
+        with closing(self.connect()) as connection:
+            connection.executescript(schema)
+
+    def connect(self):
+        connection = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=60)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def column_path(self, column):
+        return os.path.join(self.path, column.replace(os.sep, "_") + ".f8")
+
+    def add_run(self, run_dir):
+        """Appends a run's processed data to the store. Returns False if it is already there and unchanged.
+
+        A run whose processed data has changed since is appended again; its old rows are
+        left unreferenced until the store is rebuilt.
+        """
+        params = run_parameters(run_dir)
+        output_dir = os.path.join(run_dir, f"Simulation_{int(params['sim_index'])}_Results")
+        mtime_ns = os.stat(processed_path(output_dir)).st_mtime_ns
+        run_key = os.path.basename(os.path.realpath(run_dir))
+        with closing(self.connect()) as connection:
+            existing = connection.execute("SELECT source_mtime_ns FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+        if existing is not None and existing['source_mtime_ns'] == mtime_ns:
+            return False
+
+        columns = run_columns(output_dir)
+        if 't' not in columns:
+            raise ValueError("processed data has no named channels; re-analyse the run")
+        t = np.asarray(columns['t'])
+        rows = len(t)
+
+        # Every run takes the same rows in every column file, so columns it lacks are padded with NaN.
+        # It starts after the longest, which also steps over rows left by a replaced run or an interrupted append.
+        known = set(self.columns()) | set(columns)
+        row_start = max(os.path.getsize(path) // 8 if os.path.isfile(path) else 0 for path in map(self.column_path, known))
+        for column in known:
+            with open(self.column_path(column), "ab") as f:
+                written = f.tell() // 8
+                if written < row_start:
+                    f.write(np.full(row_start - written, np.nan).tobytes())
+                values = columns.get(column)
+                f.write((np.full(rows, np.nan) if values is None else np.ascontiguousarray(values, dtype="<f8")).tobytes())
+
+        chunks = []
+        for chunk, start in enumerate(range(0, rows, chunk_rows)):
+            block = t[start:start + chunk_rows]
+            chunks.append((run_key, chunk, row_start + start, len(block), float(np.nanmin(block)), float(np.nanmax(block))))
+        with closing(self.connect()) as connection, connection:
+            for table in ("runs", "run_columns", "chunks"):
+                connection.execute(f"DELETE FROM {table} WHERE run_key = ?", (run_key,))
+            values = [run_key, os.path.abspath(run_dir)] + [params[name] for name in parameter_columns] + [row_start, rows, mtime_ns]
+            connection.execute(f"INSERT INTO runs VALUES ({', '.join('?' for _ in values)})", values)
+            connection.executemany("INSERT INTO run_columns VALUES (?, ?)", [(run_key, column) for column in columns])
+            connection.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", chunks)
+        return True
+
+    def columns(self):
+        """Returns the names of every column in the store."""
+        with closing(self.connect()) as connection:
+            return [row[0] for row in connection.execute("SELECT DISTINCT column_name FROM run_columns ORDER BY column_name")]
+
+    def runs(self, **filters):
+        """Returns the runs matching the parameter filters, as dicts in index order.
+
+        Each filter is a parameter column and a value, or a list of values to match any of.
+        """
+        conditions, arguments = [], []
+        for column, value in filters.items():
+            if column not in parameter_columns:
+                raise ValueError(f"Unknown parameter: {column}")
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            arguments += values
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self.connect()) as connection:
+            return [dict(row) for row in connection.execute(f"SELECT * FROM runs{where} ORDER BY sim_index, run_key", arguments)]
+
+    def read(self, columns, t_min=None, t_max=None, **filters):
+        """Returns the given columns of every run matching the filters, between t_min and t_max.
+
+        Returns a list of (run, {column: values}) pairs, where run is the dict from runs().
+        The time is always included as 't'. Values are read-only memory maps of the rows
+        of the chunks overlapping the time range, so nothing is read until it is used.
+        """
+        columns = ['t'] + [column for column in columns if column != 't']
+        maps = {}
+        for column in columns:
+            path = self.column_path(column)
+            if not os.path.isfile(path):
+                raise KeyError(f"No column {column} in the store")
+            maps[column] = np.memmap(path, dtype="<f8", mode="r") if os.path.getsize(path) else np.empty(0)
+
+        results = []
+        with closing(self.connect()) as connection:
+            for run in self.runs(**filters):
+                conditions, arguments = ["run_key = ?"], [run['run_key']]
+                if t_min is not None:
+                    conditions.append("t_max >= ?")
+                    arguments.append(t_min)
+                if t_max is not None:
+                    conditions.append("t_min <= ?")
+                    arguments.append(t_max)
+                start, stop = connection.execute(
+                    f"SELECT MIN(row_start), MAX(row_start + rows) FROM chunks WHERE {' AND '.join(conditions)}", arguments).fetchone()
+                if start is None:
+                    start = stop = run['row_start']
+                t = maps['t'][start:stop]
+                # Trim the partial chunks at either end to the time range
+                first = 0 if t_min is None else int(np.searchsorted(t, t_min, side='left'))
+                last = len(t) if t_max is None else int(np.searchsorted(t, t_max, side='right'))
+                results.append((run, {column: maps[column][start + first:start + last] for column in columns}))
+        return results
+
+def consolidate(root=".", rebuild=False):
+    """Adds every analysed run under root to its sweep store, or only those new or changed since the last pass."""
+    if rebuild:
+        path = os.path.join(root, store_dir)
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+    store = SweepStore(root)
+    for _, results_file in find_results('auto', root=root):
+        run_dir = os.path.dirname(os.path.dirname(results_file))
+        subdir = os.path.basename(run_dir)
+        try:
+            if store.add_run(run_dir):
+                print(f"Consolidated directory: {subdir}")
+        except Exception as e:
+            print(f"Error consolidating {subdir}: {e}")
+    return store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consolidate the processed data of every analysed run into one store queryable by parameters.")
+    parser.add_argument("--rebuild", action="store_true", help="start the store afresh, dropping the rows of replaced runs")
+    args = parser.parse_args()
+    consolidate(os.getcwd(), args.rebuild)
@@ -1,30 +1,163 @@
+import json
 import os
 import re
-import tecplot as tp
-from tecplot.constant import ExportRegion, JPEGEncoding, PlotType
-
-# Get the current folder name and extract the identifier
-current_folder = os.path.basename(os.getcwd())
-identifier = re.match(r'(\d+)_', current_folder)
-if identifier:
-    identifier = identifier.group(1)
-else:
-    identifier = "unknown"
-
-# Create output folder
-output_folder = f"Simulation_{identifier}_Results"
-os.makedirs(output_folder, exist_ok=True)
-
-# Function to save contour plot
-def save_contour_plot(frame, var_index, var_name, show_mesh=False, show_vectors=False):
+
+# Exports the contour images and animation movies of a run from its Tecplot output. Run it
+# in a run directory, or let batch_tecplot_export.py call export_run for every run from a
+# few long-lived Tecplot sessions. Every Tecplot call goes through a backend:
+# TecplotBackend drives the engine of the current process, and StubBackend stands in for
+# it (writing empty outputs) so the export logic can be tried without a licence.
+
+variables = [
+    #2,  # U
+    #3,  # V
+    #4,  # P
+    #5,  # vort_z
+    6,  # user_specified
+    7   # psi
+]
+var_names = [
+    #"U",
+    #"V",
+    #"P",
+    #"vort_z",
+    "user_specified",
+    "psi"
+]
+user_specified_index = 6
+psi_index = 7
+
+# Written to the output folder by each export: the outputs it skipped because the run has no
+# such variable, so they do not count as missing until its Tecplot files change
+skipped_outputs_file = "skipped_outputs.json"
+
+def run_identifier(run_dir):
+    """Returns the simulation index from the run folder name, or "unknown"."""
+    identifier = re.match(r'(\d+)_', os.path.basename(os.path.abspath(run_dir)))
+    return identifier.group(1) if identifier else "unknown"
+
+def output_folder(run_dir):
+    return os.path.join(run_dir, f"Simulation_{run_identifier(run_dir)}_Results")
+
+def output_name(var_name):
+    return 'vel' if var_name == 'user_specified' else var_name
+
+def image_filename(run_dir, var_name, show_mesh=False, show_vectors=False):
+    # Generate the file name based on the specified criteria
+    mods = []
+    if show_mesh:
+        mods.append("msh")
+    if show_vectors:
+        mods.append("vect")
+    mod_str = "_".join(mods) if mods else ""
+    return os.path.join(output_folder(run_dir), f"{run_identifier(run_dir)}_{output_name(var_name)}{'_' + mod_str if mod_str else ''}.jpeg")
+
+def animation_filename(run_dir, var_name):
+    return os.path.join(output_folder(run_dir), f"{run_identifier(run_dir)}_{output_name(var_name)}_anim.mp4")
+
+def frame_number(frame_file):
+    match = re.search(r'(\d+)', frame_file)
+    return int(match.group(1)) if match else -1
+
+def animation_frames(run_dir):
+    """Returns the paths of the run's animation frames in frame number order."""
+    frames = [f for f in os.listdir(run_dir) if f.startswith("tec_animation_frame_") and f.endswith(".plt")]
+    return [os.path.join(run_dir, f) for f in sorted(frames, key=frame_number)]
+
+def expected_outputs(run_dir, frames):
+    """Returns every image and movie the export writes for a run with the given animation frames."""
+    images = [image_filename(run_dir, var_name) for var_name in var_names]
+    images += [image_filename(run_dir, "vel", show_mesh=True), image_filename(run_dir, "psi_vec")]
+    movies = [animation_filename(run_dir, var_name) for var_name in var_names] if frames else []
+    return images + movies
+
+def newest_input(run_dir, frames):
+    """Returns the latest modification time of the Tecplot files the outputs are made from."""
+    return max(os.path.getmtime(path) for path in [os.path.join(run_dir, "tec_out.plt")] + frames)
+
+def is_current(path, input_mtime):
+    """Returns whether an output exists and was written after its inputs last changed."""
     try:
-        # Set the active plot and apply necessary settings
+        return os.path.getmtime(path) >= input_mtime
+    except OSError:
+        return False
+
+def skipped_outputs(run_dir, input_mtime):
+    """Returns the outputs the last export skipped for lack of their variable, if it ran since the Tecplot files changed."""
+    path = os.path.join(output_folder(run_dir), skipped_outputs_file)
+    if not is_current(path, input_mtime):
+        return set()
+    with open(path, "r") as f:
+        return {os.path.join(output_folder(run_dir), name) for name in json.load(f)}
+
+def write_skipped_outputs(run_dir, skipped):
+    path = os.path.join(output_folder(run_dir), skipped_outputs_file)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(sorted({os.path.basename(output) for output in skipped}), f)
+    os.replace(temp_path, path)
+
+def outputs_up_to_date(run_dir):
+    """Returns whether every expected output of a run is newer than its Tecplot files (False if it has none).
+
+    Outputs of variables the run does not have, as recorded by its last export, are not expected.
+    """
+    try:
+        frames = animation_frames(run_dir)
+        input_mtime = newest_input(run_dir, frames)
+        skipped = skipped_outputs(run_dir, input_mtime)
+    except (OSError, ValueError):
+        return False
+    return all(is_current(path, input_mtime) for path in expected_outputs(run_dir, frames) if path not in skipped)
+
+class TecplotBackend:
+    """The Tecplot calls of the export, made on the engine of this process.
+
+    tecplot is imported on first use, so the engine starts (and checks out its licence)
+    once for every run the process exports.
+    """
+
+    def __init__(self):
+        import tecplot
+        self.tp = tecplot
+
+    def reset(self):
+        """Clears the layout left by the previous run."""
+        self.tp.new_layout()
+
+    def load_static(self, path):
+        """Loads tec_out.plt and applies the initial settings. Returns the number of variables."""
+        tp = self.tp
+        dataset = tp.data.load_tecplot(path)
+
+        # Ensure we have a plot and apply initial settings
         plot = tp.active_frame().plot()
-        plot.show_mesh = show_mesh
+        plot.show_shade = False
+        plot.rgb_coloring.red_variable_index = 2
+        plot.rgb_coloring.green_variable_index = 2
+        plot.rgb_coloring.blue_variable_index = 2
+
+        # Execute the Pick and FrameControl commands from the macro
+        tp.macro.execute_command('''$!Pick AddAtPosition
+  X = 4.15525291829
+  Y = 0.530155642023
+  ConsiderStyle = Yes''')
+        tp.macro.execute_command('''$!Pick AddAtPosition
+  X = 5.5373540856
+  Y = 0.25
+  ConsiderStyle = Yes''')
+        tp.macro.execute_command('''$!FrameControl ActivateByNumber
+  Frame = 1''')
+        tp.macro.execute_command('''$!Pick Shift
+  X = 0
+  Y = 3.2373540856
+  PickSubposition = Top''')
+        return dataset.num_variables
+
+    def style_plot(self, plot, show_edge):
         plot.show_contour = True
-        plot.show_edge = False
+        plot.show_edge = show_edge
         plot.show_shade = False
-        plot.contour(0).variable_index = var_index
         plot.contour(0).colormap_name = "Sequential - Viridis"
 
         # Set axes limits
@@ -33,7 +166,7 @@ def save_contour_plot(frame, var_index, var_name, show_mesh=False, show_vectors=
         plot.axes.y_axis.min = -7.5
         plot.axes.y_axis.max = 7.5
         plot.view.fit()  # Ensure the plot fits within the view
-        
+
         # Configure the legend
         legend = plot.contour(0).legend
         legend.show = True
@@ -42,163 +175,194 @@ def save_contour_plot(frame, var_index, var_name, show_mesh=False, show_vectors=
         legend.overlay_bar_grid = False
         legend.position = (99, 70)  # Frame percentages
 
+    def show_vectors(self, show):
+        """Turns the U/V velocity vectors on or off."""
+        from tecplot.constant import PlotType
+        plot = self.tp.active_frame().plot(PlotType.Cartesian2D)
+        if show:
+            plot.vector.u_variable_index = 2
+            plot.vector.v_variable_index = 3
+        plot.show_vector = show
+
+    def save_contour_plot(self, var_index, filename, show_mesh=False):
+        from tecplot.constant import ExportRegion, JPEGEncoding
+        tp = self.tp
+        # Set the active plot and apply necessary settings
+        plot = tp.active_frame().plot()
+        plot.show_mesh = show_mesh
+        self.style_plot(plot, show_edge=False)
+        plot.contour(0).variable_index = var_index
+
+        tp.macro.execute_command('$!RedrawAll')  # Redraw to apply changes
+        tp.export.save_jpeg(filename, width=3840, region=ExportRegion.CurrentFrame, supersample=2, quality=100, encoding=JPEGEncoding.Progressive)
+
+    def load_frames(self, paths):
+        """Loads every animation frame in one call, replacing the static data so zone k is frame k,
+        and applies the animation styling and export settings. Returns the number of variables."""
+        from tecplot.constant import ReadDataOption
+        tp = self.tp
+        frames = tp.data.load_tecplot(paths, read_data_option=ReadDataOption.ReplaceInActiveFrame, reset_style=False)
+        plot = tp.active_frame().plot()
+        plot.show_mesh = False
+        self.style_plot(plot, show_edge=True)
+
+        # Export animation settings
+        tp.macro.execute_command('''$!ExportSetup
+          ExportFormat = MPEG4''')
+        tp.macro.execute_command('''$!ExportSetup
+          ImageWidth = 3840''')  # Set to 3840 as requested
+        tp.macro.execute_command('''$!ExportSetup
+          UseSuperSampleAntiAliasing = Yes''')
+        self.frame_count = frames.num_zones
+        return frames.num_variables
+
+    def export_movie(self, var_index, filename):
+        """Steps through the loaded frames with one contour variable, saving them as a movie."""
+        tp = self.tp
+        tp.active_frame().plot().contour(0).variable_index = var_index  # Set to current variable
         tp.macro.execute_command('$!RedrawAll')  # Redraw to apply changes
+        tp.macro.execute_command(f'''$!ExportSetup
+          ExportFName = '{filename}' ''')
+
+        # Animate the frames
+        tp.macro.execute_command('''$!AnimateZones
+          ZoneAnimationMode = StepByNumber
+          Start = 1
+          End = {}
+          Skip = 1
+          CreateMovieFile = Yes
+          LimitScreenSpeed = Yes
+          MaxScreenSpeed = 12'''.format(self.frame_count))
+
+class StubBackend:
+    """Stands in for Tecplot without an engine or licence, for trying out the export and batch logic.
+
+    Every call is recorded in calls, and each image or movie is written as an empty file.
+    """
+
+    def __init__(self, num_variables=8):
+        self.num_variables = num_variables
+        self.calls = []
+
+    def reset(self):
+        self.calls.append(("reset",))
+
+    def load_static(self, path):
+        self.calls.append(("load_static", path))
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        return self.num_variables
+
+    def show_vectors(self, show):
+        self.calls.append(("show_vectors", show))
 
-        # Generate the file name based on the specified criteria
-        mods = []
-        if show_mesh:
-            mods.append("msh")
-        if show_vectors:
-            mods.append("vect")
-        
-        mod_str = "_".join(mods) if mods else ""
-        image_filename = f"{output_folder}/{identifier}_{'vel' if var_name == 'user_specified' else var_name}{'_' + mod_str if mod_str else ''}.jpeg"
-        
-        if os.path.exists(image_filename):
-            print(f"File already exists: {image_filename}")
+    def save_contour_plot(self, var_index, filename, show_mesh=False):
+        self.calls.append(("save_contour_plot", var_index, filename, show_mesh))
+        open(filename, "wb").close()
+
+    def load_frames(self, paths):
+        self.calls.append(("load_frames", len(paths)))
+        return self.num_variables
+
+    def export_movie(self, var_index, filename):
+        self.calls.append(("export_movie", var_index, filename))
+        open(filename, "wb").close()
+
+def export_run(run_dir, backend, force=False):
+    """Exports the images and movies of one run that are missing or older than its Tecplot files, or all of them with force."""
+    frames = animation_frames(run_dir)
+    if force:
+        input_mtime = float("inf")  # No output counts as current
+    else:
+        input_mtime = newest_input(run_dir, frames) if os.path.exists(os.path.join(run_dir, "tec_out.plt")) else 0
+
+    skipped = []
+
+    # Function to save contour plot
+    def save_contour_plot(var_index, var_name, show_mesh=False, show_vectors=False):
+        image_path = image_filename(run_dir, var_name, show_mesh, show_vectors)
+        if is_current(image_path, input_mtime):
+            print(f"File already exists: {image_path}")
+            return
+        if var_index >= num_variables:
+            print(f"Warning: Variable index {var_index} is out of range. Skipping.")
+            skipped.append(image_path)
             return
-        
-        tp.export.save_jpeg(image_filename, width=3840, region=ExportRegion.CurrentFrame, supersample=2, quality=100, encoding=JPEGEncoding.Progressive)
-        print(f"Saved: {image_filename}")
+        try:
+            backend.save_contour_plot(var_index, image_path, show_mesh)
+            print(f"Saved: {image_path}")
+        except Exception as e:
+            print(f"Error saving contour plot for {var_name}: {str(e)}")
+
+    # Process tec_out.plt file
+    backend.reset()
+    try:
+        num_variables = backend.load_static(os.path.join(run_dir, "tec_out.plt"))
     except Exception as e:
-        print(f"Error saving contour plot for {var_name}: {str(e)}")
-
-# Process tec_out.plt file
-try:
-    dataset = tp.data.load_tecplot("tec_out.plt")
-    #print("Successfully loaded tec_out.plt")
-except Exception as e:
-    print(f"Error loading tec_out.plt: {str(e)}")
-    exit(1)
-
-# Ensure we have a plot and apply initial settings
-plot = tp.active_frame().plot()
-plot.show_shade = False
-plot.rgb_coloring.red_variable_index = 2
-plot.rgb_coloring.green_variable_index = 2
-plot.rgb_coloring.blue_variable_index = 2
-
-# Execute the Pick and FrameControl commands from the macro
-tp.macro.execute_command('''$!Pick AddAtPosition
-  X = 4.15525291829
-  Y = 0.530155642023
-  ConsiderStyle = Yes''')
-tp.macro.execute_command('''$!Pick AddAtPosition
-  X = 5.5373540856
-  Y = 0.25
-  ConsiderStyle = Yes''')
-tp.macro.execute_command('''$!FrameControl ActivateByNumber
-  Frame = 1''')
-tp.macro.execute_command('''$!Pick Shift
-  X = 0
-  Y = 3.2373540856
-  PickSubposition = Top''')
+        raise RuntimeError(f"Error loading tec_out.plt: {str(e)}") from e
 
-variables = [
-    #2,  # U 
-    #3,  # V 
-    #4,  # P 
-    #5,  # vort_z 
-    6,  # user_specified
-    7   # psi
-]  
-var_names = [
-    #"U", 
-    #"V", 
-    #"P", 
-    #"vort_z", 
-    "user_specified", 
-    "psi"
-]
+    # Create output folder
+    os.makedirs(output_folder(run_dir), exist_ok=True)
 
-# Generating contour plots for each variable
-for var_index, var_name in zip(variables, var_names):
-    if var_index < dataset.num_variables:
-        save_contour_plot(0, var_index, var_name, show_mesh=False)  # All without mesh
-    else:
-        print(f"Warning: Variable index {var_index} is out of range. Skipping.")
+    # Generating contour plots for each variable
+    for var_index, var_name in zip(variables, var_names):
+        save_contour_plot(var_index, var_name, show_mesh=False)  # All without mesh
 
-# Special cases for user_specified and psi
-user_specified_index = 6
-save_contour_plot(0, user_specified_index, "vel", show_mesh=True)
+    # Special cases for user_specified and psi
+    save_contour_plot(user_specified_index, "vel", show_mesh=True)
 
-# Psi with and without U/V vectors
-psi_index = 7
-# Set U and V vectors for psi
-tp.active_frame().plot(PlotType.Cartesian2D).vector.u_variable_index = 2
-tp.active_frame().plot(PlotType.Cartesian2D).vector.v_variable_index = 3
-tp.active_frame().plot().show_vector = True
-save_contour_plot(0, psi_index, "psi_vec", show_mesh=False)
-
-# Now, psi without vectors
-tp.active_frame().plot().show_vector = False
-save_contour_plot(0, psi_index, "psi_vec", show_mesh=False)
-
-# Animation Logic for each contour variable
-for var_index, var_name in zip(variables, var_names):
-    animation_files = sorted([f for f in os.listdir() if f.startswith("tec_animation_frame_") and f.endswith(".plt")])
-
-    if animation_files:
-        print(f"Found {len(animation_files)} animation frames for {var_name}.")
-        animation_filename = f'{output_folder}/{identifier}_{"vel" if var_name == "user_specified" else var_name}_anim.mp4' 
-        if os.path.exists(animation_filename):
-            print(f"Animation file already exists: {animation_filename}")
+    # Psi with and without U/V vectors
+    backend.show_vectors(True)
+    save_contour_plot(psi_index, "psi_vec", show_mesh=False)
+
+    # Now, psi without vectors
+    backend.show_vectors(False)
+    save_contour_plot(psi_index, "psi_vec", show_mesh=False)
+
+    skipped += export_animations(run_dir, backend, frames, input_mtime)
+    write_skipped_outputs(run_dir, skipped)
+
+def export_animations(run_dir, backend, frames, input_mtime):
+    """Exports a movie of each contour variable from one load of the animation frames.
+
+    Returns the movies skipped because the frames do not have their variable.
+    """
+    pending = []
+    for var_index, var_name in zip(variables, var_names):
+        if is_current(animation_filename(run_dir, var_name), input_mtime):
+            print(f"Animation file already exists: {animation_filename(run_dir, var_name)}")
+        else:
+            pending.append((var_index, var_name))
+    if not pending:
+        return []
+    if not frames:
+        print(f"No animation frames found for {', '.join(var_name for _, var_name in pending)}.")
+        return []
+    print(f"Found {len(frames)} animation frames for {', '.join(var_name for _, var_name in pending)}.")
+
+    try:
+        num_variables = backend.load_frames(frames)
+    except Exception as e:
+        print(f"Error loading animation frames: {str(e)}")
+        return []
+
+    skipped = []
+    for var_index, var_name in pending:
+        if var_index >= num_variables:
+            print(f"Warning: Variable index {var_index} is out of range. Skipping.")
+            skipped.append(animation_filename(run_dir, var_name))
             continue
         try:
-            # Import each animation frame into a new layout
-            for frame_file in animation_files:
-                tp.data.load_tecplot(frame_file, reset_style=False)
-
-                # Set the viewport similar to static images
-                plot = tp.active_frame().plot()
-                plot.show_mesh = False
-                plot.show_contour = True
-                plot.show_edge = True
-                plot.show_shade = False
-                plot.contour(0).variable_index = var_index  # Set to current variable
-                plot.contour(0).colormap_name = "Sequential - Viridis"
-
-                # Set axes limits
-                plot.axes.x_axis.min = -9.56551
-                plot.axes.x_axis.max = 19.3116
-                plot.axes.y_axis.min = -7.5
-                plot.axes.y_axis.max = 7.5
-                plot.view.fit()  # Ensure the plot fits within the view
-
-                # Configure the legend
-                legend = plot.contour(0).legend
-                legend.show = True
-                legend.auto_resize = True
-                legend.label_step = 10
-                legend.overlay_bar_grid = False
-                legend.position = (99, 70)  # Frame percentages
-
-                tp.macro.execute_command('$!RedrawAll')  # Redraw to apply changes
-
-            # Export animation settings
-            tp.macro.execute_command('''$!ExportSetup 
-              ExportFormat = MPEG4''')
-            tp.macro.execute_command('''$!ExportSetup 
-              ImageWidth = 3840''')  # Set to 3840 as requested
-            tp.macro.execute_command('''$!ExportSetup 
-              UseSuperSampleAntiAliasing = Yes''')
-            tp.macro.execute_command(f'''$!ExportSetup 
-              ExportFName = '{animation_filename}' ''')
-
-            # Animate the frames
-            tp.macro.execute_command('''$!AnimateZones 
-              ZoneAnimationMode = StepByNumber
-              Start = 1
-              End = {}  # Use len(animation_files) here
-              Skip = 1
-              CreateMovieFile = Yes
-              LimitScreenSpeed = Yes
-              MaxScreenSpeed = 12'''.format(len(animation_files))) 
-            
+            backend.export_movie(var_index, animation_filename(run_dir, var_name))
             print(f"Animation for {var_name} exported successfully.")
         except Exception as e:
             print(f"Error processing animation frames for {var_name}: {str(e)}")
-    else:
-        print(f"No animation frames found for {var_name}.")
+    return skipped
 
-print("Processing complete. Check the output folder for results.")
\ No newline at end of file
+if __name__ == "__main__":
+    try:
+        export_run(os.getcwd(), TecplotBackend())
+    except RuntimeError as e:
+        print(str(e))
+        exit(1)
+    print("Processing complete. Check the output folder for results.")
@@ -0,0 +1,200 @@
+import json
+import os
+import socket
+import threading
+import time
+
+# Work queue on a shared directory, so runner processes on several hosts can split a
+# sweep between them without a broker. Each row is a JSON task file that moves between
+# four sub-directories:
+#
+#   pending/  waiting to be run
+#   claimed/  being run; the file name carries the worker's id and its mtime is the lease
+#   done/     finished (completed, served from cache, or already present)
+#   failed/   crashed even after the time step reductions
+#
+# A worker claims a task by renaming it from pending/ into claimed/, which succeeds for
+# exactly one worker. While it runs, a heartbeat thread keeps touching the claimed file.
+# A claim whose file has not been touched for lease_seconds belongs to a dead worker, and
+# any worker moves it back into pending/, marked as reclaimed so that the next worker
+# overrides the dead worker's partial run directory instead of skipping it. A task left
+# half-reclaimed by a worker that died is reclaimed again in the same way. Lease ages
+# are measured against the shared filesystem's own clock, so clock differences between
+# hosts do not matter.
+
+queue_dir = "work_queue"
+lease_seconds = 300
+heartbeat_seconds = 30
+poll_seconds = 10
+
+states = ["pending", "claimed", "done", "failed"]
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+class WorkQueue:
+    def __init__(self, path, lease=lease_seconds, heartbeat=heartbeat_seconds):
+        self.path = path
+        self.lease = lease
+        self.heartbeat = min(heartbeat, lease / 3)  # Several heartbeats per lease, so one slow touch does not lose it
+        for state in states:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def state_dir(self, state):
+        return os.path.join(self.path, state)
+
+    def task_names(self, state):
+        """Returns the task file names in a state, with any claim suffix removed."""
+        return sorted(name.split(".json")[0] + ".json" for name in os.listdir(self.state_dir(state)) if ".json" in name and not name.endswith(".tmp"))
+
+    def enqueue(self, rows):
+        """Adds (index, row) pairs as pending tasks, skipping any already in the queue. Returns the number added."""
+        known = set()
+        for state in states:
+            known.update(self.task_names(state))
+        added = 0
+        for index, row in rows:
+            name = f"{index + 1:06d}.json"
+            if name in known:
+                continue
+            temp_path = os.path.join(self.state_dir("pending"), f".{name}.{socket.gethostname()}.{os.getpid()}.tmp")
+            with open(temp_path, "w") as f:
+                json.dump({"index": index, "row": row}, f)
+            os.replace(temp_path, os.path.join(self.state_dir("pending"), name))
+            known.add(name)
+            added += 1
+        return added
+
+    def filesystem_now(self):
+        """Returns the current time according to the shared filesystem."""
+        probe = os.path.join(self.path, f".clock.{worker_id()}")
+        with open(probe, "w"):
+            pass
+        now = os.stat(probe).st_mtime
+        os.remove(probe)
+        return now
+
+    def reclaim_expired(self):
+        """Moves claims whose lease has run out back to pending. Returns the number reclaimed.
+
+        A reclaim renames the claim to .reclaim-<time>-<worker>, with the filesystem time it
+        started, before moving it on. One left behind by a reclaimer that died is reclaimed
+        again once that time is a lease old.
+        """
+        now = self.filesystem_now()
+        reclaimed = 0
+        for name in os.listdir(self.state_dir("claimed")):
+            claimed_path = os.path.join(self.state_dir("claimed"), name)
+            task_name = name.split(".json")[0] + ".json"
+            reclaim_path = os.path.join(self.state_dir("claimed"), f"{task_name}.reclaim-{int(now)}-{worker_id()}")
+            try:
+                if ".reclaim-" in name:
+                    started = float(name.split(".reclaim-")[1].split("-")[0])
+                else:
+                    started = os.stat(claimed_path).st_mtime
+                if now - started < self.lease:
+                    continue
+                os.rename(claimed_path, reclaim_path)  # Only one worker wins the rename
+                with open(reclaim_path, "r") as f:
+                    task = json.load(f)
+            except FileNotFoundError:
+                continue  # Finished, or reclaimed by another worker
+            except ValueError:
+                continue  # Not a claim this queue wrote
+            task["reclaimed"] = True
+            with open(reclaim_path, "w") as f:
+                json.dump(task, f)
+            os.rename(reclaim_path, os.path.join(self.state_dir("pending"), task_name))
+            print(f"Reclaimed expired task {name}")
+            reclaimed += 1
+        return reclaimed
+
+    def claim(self, owner):
+        """Claims the next pending task. Returns a Claim, or None if nothing is pending."""
+        for name in self.task_names("pending"):
+            pending_path = os.path.join(self.state_dir("pending"), name)
+            claimed_path = os.path.join(self.state_dir("claimed"), f"{name}.{owner}")
+            try:
+                # Start the lease before the rename, so the claim never appears with the mtime it was queued with
+                os.utime(pending_path)
+                os.rename(pending_path, claimed_path)
+                with open(claimed_path, "r") as f:
+                    task = json.load(f)
+            except FileNotFoundError:
+                continue  # Another worker got there first, or reclaimed it
+            return Claim(self, claimed_path, name, task)
+        return None
+
+    def is_finished(self):
+        return not self.task_names("pending") and not self.task_names("claimed")
+
+class Claim:
+    """A claimed task, with a heartbeat that keeps its lease alive until it is completed."""
+
+    def __init__(self, queue, path, name, task):
+        self.queue = queue
+        self.path = path
+        self.name = name
+        self.index = task["index"]
+        self.row = task["row"]
+        self.reclaimed = task.get("reclaimed", False)
+        self.lost = threading.Event()  # Set once another worker has reclaimed the task
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.thread.start()
+
+    def heartbeat(self):
+        while not self.stopped.wait(self.queue.heartbeat):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost.set()
+                print(f"Lost the lease on task {self.name}; another worker may run it again.")
+                return
+
+    def complete(self, succeeded=True):
+        """Moves the task to done/ or failed/ and stops the heartbeat. A lost task is left to the worker that reclaimed it."""
+        self.stopped.set()
+        self.thread.join()
+        if self.lost.is_set():
+            print(f"Task {self.name} was reclaimed before it finished.")
+            return
+        try:
+            os.rename(self.path, os.path.join(self.queue.state_dir("done" if succeeded else "failed"), self.name))
+        except FileNotFoundError:
+            print(f"Task {self.name} was reclaimed before it finished.")
+
+def run_worker(queue, handle_task, wait_for_others=True, poll=poll_seconds):
+    """Claims and runs tasks until the queue is empty.
+
+    handle_task(index, row, reclaimed, lost) runs one task and returns True if it succeeded.
+    lost is an event set if the task's lease is lost, when handle_task should stop. With
+    wait_for_others, the worker keeps polling while other workers hold claims, so it can
+    take over any whose lease runs out.
+    """
+    owner = worker_id()
+    while True:
+        try:
+            queue.reclaim_expired()
+            claim = queue.claim(owner)
+        except OSError as e:
+            # A shared filesystem hiccup must not end the worker; try again after a poll
+            print(f"Error claiming a task: {e}")
+            time.sleep(min(poll, queue.lease))
+            continue
+        if claim is None:
+            if not wait_for_others or queue.is_finished():
+                return
+            time.sleep(min(poll, queue.lease))
+            continue
+        succeeded = False
+        try:
+            succeeded = handle_task(claim.index, claim.row, claim.reclaimed, claim.lost)
+        except Exception as e:
+            print(f"Error processing index {claim.index + 1}: {e}")
+        finally:
+            claim.complete(succeeded)
+
+def print_status(queue):
+    for state in states:
+        print(f"{state}: {len(queue.task_names(state))}")